@@ -1,13 +1,48 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify, stream_with_context
 from flask_cors import CORS
 import os
+import re
 import uuid
-import hashlib
+import mimetypes
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from werkzeug.utils import secure_filename
 from config import FILE_STORE_CONFIG
+from file_utils import UploadTooLargeError, stream_to_temp, iter_zip_stream
+from blob_store import InvalidObjectKeyError, check_name_segment, get_object_path, get_object_hash, store_object, delete_object
+from cog_convert import COG_CONTENT_TYPES, submit_conversion
+from derivatives import (TRANSFORMABLE_TYPES, DerivativeError, has_transform, parse_transform,
+                         derivative_key, get_output_mimetype, derivative_cache)
+from metadata_index import (MAX_LIST_LIMIT, init_index, reserve_object, release_object, delete_object_record,
+                            get_object_record, list_objects, get_conversion_status, get_usage,
+                            get_quota, check_quota, rebuild_index)
+from multipart_upload import (MultipartUploadError, MAX_PARTS, initiate_upload, load_manifest,
+                              upload_part, list_parts, complete_upload, abort_upload)
+
+# multipart 表单中除文件内容外的边界、字段等开销上限
+FORM_OVERHEAD_BYTES = 1024 * 1024
+
+# 不可变对象（uuid命名）的客户端缓存时间：1年
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# uuid命名的对象文件名
+UUID_FILENAME_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(\.[^.]+)?$')
+
+# 单次打包下载的最大对象数
+MAX_ZIP_OBJECTS = 1000
 
 app = Flask(__name__, static_folder=FILE_STORE_CONFIG['base_path'], static_url_path='/api/file')
+# 请求体超过上限时在解析表单之前直接拒绝
+app.config['MAX_CONTENT_LENGTH'] = FILE_STORE_CONFIG['max_size'] + FORM_OVERHEAD_BYTES
 CORS(app)
+init_index()
+
+@app.before_request
+def reject_hidden_static_paths():
+    """静态文件路由不提供以点开头的内部文件和目录（内容存储、分片暂存、衍生图缓存等）"""
+    if request.endpoint == 'static':
+        filename = (request.view_args or {}).get('filename', '')
+        if any(part.startswith('.') for part in filename.replace('\\', '/').split('/')):
+            return jsonify({'code': 404, 'msg': '文件不存在'}), 404
 
 def ensure_directory(bucket_name):
     """确保存储目录存在"""
@@ -16,9 +51,70 @@ def ensure_directory(bucket_name):
         os.makedirs(directory)
     return directory
 
+def make_object_filename(original_filename, is_cache):
+    """生成对象文件名"""
+    # 获取扩展名
+    extension = os.path.splitext(original_filename)[1]  # 直接从原始文件名获取扩展名, 已经带点，例如.pdf
+    if is_cache:
+        # 缓存文件名只能是单个路径段，不能写入其他用户的目录
+        check_name_segment(original_filename)
+        # 如果是缓存文件，直接使用原文件名（避免使用文件内容的MD5作为缓存key，因为在网络传输过程中，文件内容可能发生变化，比如文件被重新组织）
+        filename = original_filename
+    else:
+        # 否则，使用uuid作为文件名
+        filename = str(uuid.uuid4()) + extension
+    return filename
+
+def upload_result(bucket, object_key, size, sha256, deduplicated=False, content_type=None):
+    """生成上传成功的返回数据，包含用户ID路径的文件访问URL；TIFF文件同时提交后台COG转换"""
+    conversion = None
+    if FILE_STORE_CONFIG['cog_on_upload']:
+        conversion = submit_conversion(bucket, object_key, content_type)
+    return {
+        'url': f"{FILE_STORE_CONFIG['access_url']}/{bucket}/{object_key}",
+        'bucket': bucket,
+        'objectKey': object_key,
+        'size': size,
+        'sha256': sha256,
+        'deduplicated': deduplicated,
+        'conversion': conversion
+    }
+
+def save_object(bucket, object_key, tmp_path, size, content_type, sha256):
+    """
+    占用配额并写入对象记录后把临时文件存入内容存储，存储失败时撤销记录
+
+    Returns:
+        tuple: (是否命中已有内容, 超出配额时的提示信息)
+    """
+    quota_error, previous = reserve_object(bucket, object_key, size, content_type, sha256)
+    if quota_error:
+        os.remove(tmp_path)
+        return False, quota_error
+    try:
+        return store_object(tmp_path, sha256, bucket, object_key), None
+    except BaseException:
+        release_object(bucket, object_key, previous)
+        raise
+
 @app.route('/api/file/upload/<bucket>', methods=['POST'])
 def upload_file(bucket):
     """上传文件"""
+    # 根据请求头中的长度提前拒绝，不读取请求体
+    if request.content_length is not None and \
+            request.content_length > FILE_STORE_CONFIG['max_size'] + FORM_OVERHEAD_BYTES:
+        return jsonify({'code': 400, 'msg': '文件大小超过限制'}), 400
+    
+    # 获取用户ID，从请求头或默认为'default'
+    user_id = request.headers.get('X-User-ID', 'default')
+    check_name_segment(user_id)
+    
+    # 按请求长度（扣除表单开销）预估文件大小，明显超出配额时不接收文件内容
+    if request.content_length is not None:
+        quota_error = check_quota(user_id, bucket, max(0, request.content_length - FORM_OVERHEAD_BYTES))
+        if quota_error:
+            return jsonify({'code': 400, 'msg': quota_error}), 400
+    
     if 'file' not in request.files:
         return jsonify({'code': 400, 'msg': '没有文件'}), 400
     
@@ -26,79 +122,323 @@ def upload_file(bucket):
     if file.filename == '':
         return jsonify({'code': 400, 'msg': '没有选择文件'}), 400
     
-    print(f"file.content_type: {file.content_type}")
-    
     # 验证文件类型
     if file.content_type not in FILE_STORE_CONFIG['allowed_types']:
         return jsonify({'code': 400, 'msg': '不支持的文件类型'}), 400
     
-    # 一次性读取文件内容
-    content = file.read()
-    
-    # 验证文件大小
-    if len(content) > FILE_STORE_CONFIG['max_size']:
-        return jsonify({'code': 400, 'msg': '文件大小超过限制'}), 400
-    
     # 检查是否是缓存文件
     is_cache = request.form.get('is_cache') == 'true'
-    print(f"is_cache: {is_cache}")
-
-    # 获取用户ID，从请求头或默认为'default'
-    user_id = request.headers.get('X-User-ID', 'default')
     
-    # 生成文件名并保存
-    # 获取扩展名
-    extension = os.path.splitext(file.filename)[1]  # 直接从原始文件名获取扩展名, 已经带点，例如.pdf
-    if is_cache:
-        # 如果是缓存文件，直接使用原文件名（避免使用文件内容的MD5作为缓存key，因为在网络传输过程中，文件内容可能发生变化，比如文件被重新组织）
-        filename = file.filename
-        print(f"cache_filename: {filename}")
-    else:
-        # 否则，使用uuid作为文件名
-        filename = str(uuid.uuid4()) + extension
-        print(f"filename: {filename}")
+    # 生成文件名
+    filename = make_object_filename(file.filename, is_cache)
     
-    # 创建用户专属目录
+    # 校验对象路径后创建用户专属目录
+    object_key = f"{user_id}/{filename}"
+    get_object_path(bucket, object_key)
     user_directory = os.path.join(bucket, user_id)
     directory = ensure_directory(user_directory)
-    file_path = os.path.join(directory, filename)
     
-    # 使用已读取的内容写入文件
-    with open(file_path, 'wb') as f:
-        f.write(content)
+    # 分块写入临时文件，边写边校验大小并计算哈希，完成后存入内容存储（相同内容只保留一份）
+    try:
+        tmp_path, size, sha256 = stream_to_temp(file.stream, directory, FILE_STORE_CONFIG['max_size'])
+    except UploadTooLargeError:
+        return jsonify({'code': 400, 'msg': '文件大小超过限制'}), 400
+    deduplicated, quota_error = save_object(bucket, object_key, tmp_path, size, file.content_type, sha256)
+    if quota_error:
+        return jsonify({'code': 400, 'msg': quota_error}), 400
+    
+    return jsonify({
+        'code': 200,
+        'msg': '上传成功',
+        'data': upload_result(bucket, object_key, size, sha256, deduplicated, file.content_type)
+    })
+
+def check_upload_owner(bucket, upload_id):
+    """读取上传任务清单并校验存储桶和用户"""
+    manifest = load_manifest(upload_id)
+    user_id = request.headers.get('X-User-ID', 'default')
+    if manifest['bucket'] != bucket or manifest['userId'] != user_id:
+        raise MultipartUploadError('上传任务不存在', 404)
+    return manifest
+
+@app.errorhandler(InvalidObjectKeyError)
+def invalid_object_key(error):
+    """存储桶或对象路径不合法"""
+    return jsonify({'code': 400, 'msg': str(error)}), 400
+
+@app.errorhandler(MultipartUploadError)
+def multipart_upload_error(error):
+    """分片上传错误"""
+    return jsonify({'code': error.code, 'msg': str(error)}), error.code
+
+@app.route('/api/file/multipart/<bucket>', methods=['POST'])
+def initiate_multipart_upload(bucket):
+    """创建分片上传任务"""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    content_type = data.get('contentType', '')
+    if not filename:
+        return jsonify({'code': 400, 'msg': '没有选择文件'}), 400
+    if content_type not in FILE_STORE_CONFIG['allowed_types']:
+        return jsonify({'code': 400, 'msg': '不支持的文件类型'}), 400
+    try:
+        size = int(data['size'])
+        if size < 0:
+            raise ValueError(size)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'code': 400, 'msg': '缺少文件大小或格式不正确'}), 400
+    if size > FILE_STORE_CONFIG['max_size']:
+        return jsonify({'code': 400, 'msg': '文件大小超过限制'}), 400
+    
+    user_id = request.headers.get('X-User-ID', 'default')
+    check_name_segment(user_id)
+    quota_error = check_quota(user_id, bucket, size)
+    if quota_error:
+        return jsonify({'code': 400, 'msg': quota_error}), 400
+    if data.get('isCache') is True:
+        check_name_segment(filename)
+    get_object_path(bucket, f"{user_id}/{filename}")
+    upload_id = initiate_upload(bucket, user_id, filename, content_type, size, data.get('isCache') is True)
+    return jsonify({
+        'code': 200,
+        'msg': '创建成功',
+        'data': {
+            'uploadId': upload_id,
+            'chunkSize': FILE_STORE_CONFIG['chunk_size'],
+            'maxParts': MAX_PARTS
+        }
+    })
+
+@app.route('/api/file/multipart/<bucket>/<upload_id>/<int:part_number>', methods=['PUT'])
+def upload_multipart_part(bucket, upload_id, part_number):
+    """上传分片，请求体为分片原始数据，X-Content-SHA256 请求头为分片的SHA-256"""
+    check_upload_owner(bucket, upload_id)
+    part = upload_part(upload_id, part_number, request.stream, request.headers.get('X-Content-SHA256'))
+    return jsonify({'code': 200, 'msg': '上传成功', 'data': part})
+
+@app.route('/api/file/multipart/<bucket>/<upload_id>', methods=['GET'])
+def list_multipart_parts(bucket, upload_id):
+    """列出已上传的分片，用于断点续传"""
+    check_upload_owner(bucket, upload_id)
+    return jsonify({
+        'code': 200,
+        'msg': '查询成功',
+        'data': {'uploadId': upload_id, 'parts': list_parts(upload_id)}
+    })
+
+@app.route('/api/file/multipart/<bucket>/<upload_id>/complete', methods=['POST'])
+def complete_multipart_upload(bucket, upload_id):
+    """合并分片，生成最终文件"""
+    manifest = check_upload_owner(bucket, upload_id)
+    data = request.get_json(silent=True) or {}
     
-    # 返回文件访问URL，包含用户ID路径
+    user_id = manifest['userId']
+    filename = make_object_filename(manifest['filename'], manifest['isCache'])
+    directory = ensure_directory(os.path.join(bucket, user_id))
     object_key = f"{user_id}/{filename}"
-    url = f"{FILE_STORE_CONFIG['access_url']}/{bucket}/{object_key}"
+    _, tmp_path, size, sha256 = complete_upload(upload_id, directory, data.get('parts'))
+    deduplicated, quota_error = save_object(bucket, object_key, tmp_path, size, manifest['contentType'], sha256)
+    if quota_error:
+        return jsonify({'code': 400, 'msg': quota_error}), 400
+    abort_upload(upload_id)
+    
     return jsonify({
         'code': 200,
         'msg': '上传成功',
+        'data': upload_result(bucket, object_key, size, sha256, deduplicated, manifest['contentType'])
+    })
+
+@app.route('/api/file/multipart/<bucket>/<upload_id>', methods=['DELETE'])
+def abort_multipart_upload(bucket, upload_id):
+    """取消分片上传任务"""
+    check_upload_owner(bucket, upload_id)
+    abort_upload(upload_id)
+    return jsonify({'code': 200, 'msg': '取消成功'})
+
+@app.route('/api/file/zip/<bucket>', methods=['GET', 'POST'])
+def download_zip(bucket):
+    """
+    把多个对象打包为ZIP流式下载
+    
+    对象路径通过JSON请求体 {"objectKeys": [...], "filename": "..."} 或查询参数 key（可重复）传入，
+    响应在读取第一个文件时就开始发送，已压缩的图片、视频等直接存储
+    """
+    data = request.get_json(silent=True) or {}
+    object_keys = data.get('objectKeys') or request.args.getlist('key')
+    if not object_keys:
+        return jsonify({'code': 400, 'msg': '没有选择文件'}), 400
+    if len(object_keys) > MAX_ZIP_OBJECTS:
+        return jsonify({'code': 400, 'msg': f'一次最多打包{MAX_ZIP_OBJECTS}个文件'}), 400
+    
+    # 开始发送后无法再返回错误，先检查全部对象
+    entries = []
+    for object_key in dict.fromkeys(object_keys):
+        try:
+            file_path = get_object_path(bucket, object_key)
+        except InvalidObjectKeyError:
+            file_path = None
+        if file_path is None or not os.path.isfile(file_path):
+            return jsonify({'code': 404, 'msg': f'文件不存在: {object_key}'}), 404
+        record = get_object_record(bucket, object_key)
+        content_type = record['contentType'] if record else mimetypes.guess_type(file_path)[0]
+        entries.append((object_key, file_path, content_type))
+    
+    download_name = secure_filename(data.get('filename') or request.args.get('filename') or '') or f'{bucket}.zip'
+    if not download_name.endswith('.zip'):
+        download_name += '.zip'
+    return Response(
+        stream_with_context(iter_zip_stream(entries)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+    )
+
+@app.route('/api/file/usage', methods=['GET'])
+def get_storage_usage():
+    """查询当前用户（X-User-ID）的存储用量和配额"""
+    user_id = request.headers.get('X-User-ID', 'default')
+    if request.args.get('userId') not in (None, '', user_id):
+        return jsonify({'code': 403, 'msg': '只能查询自己的存储用量'}), 403
+    usage = get_usage(user_id)
+    buckets = [
+        {'bucket': bucket, 'bytes': item['bytes'], 'objects': item['objects'], 'quota': get_quota(bucket)}
+        for bucket, item in sorted(usage.items())
+    ]
+    return jsonify({
+        'code': 200,
+        'msg': '查询成功',
+        'data': {
+            'userId': user_id,
+            'bytes': sum(item['bytes'] for item in buckets),
+            'objects': sum(item['objects'] for item in buckets),
+            'quota': get_quota(),
+            'buckets': buckets
+        }
+    })
+
+@app.route('/api/file/list/<bucket>', methods=['GET'])
+def list_files(bucket):
+    """分页列出当前用户（X-User-ID）在存储桶中的对象，支持按前缀过滤"""
+    user_id = request.headers.get('X-User-ID', 'default')
+    if request.args.get('owner') not in (None, '', user_id):
+        return jsonify({'code': 403, 'msg': '只能列出自己的文件'}), 403
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'code': 400, 'msg': 'limit必须是整数'}), 400
+    
+    items, next_marker = list_objects(
+        bucket,
+        prefix=request.args.get('prefix', ''),
+        marker=request.args.get('marker'),
+        limit=limit,
+        owner=user_id
+    )
+    for item in items:
+        item['url'] = f"{FILE_STORE_CONFIG['access_url']}/{bucket}/{item['objectKey']}"
+    return jsonify({
+        'code': 200,
+        'msg': '查询成功',
         'data': {
-            'url': url,
-            'bucket': bucket,
-            'objectKey': object_key
+            'items': items,
+            'nextMarker': next_marker,
+            'isTruncated': next_marker is not None,
+            'maxLimit': MAX_LIST_LIMIT
         }
     })
 
+@app.route('/api/file/meta/<bucket>/<path:object_key>', methods=['GET'])
+def get_file_meta(bucket, object_key):
+    """获取对象元数据"""
+    record = get_object_record(bucket, object_key)
+    if record is None:
+        return jsonify({'code': 404, 'msg': '文件不存在'}), 404
+    return jsonify({'code': 200, 'msg': '查询成功', 'data': record})
+
+@app.route('/api/file/cog/<bucket>/<path:object_key>', methods=['POST'])
+def convert_to_cog(bucket, object_key):
+    """把TIFF对象转换为云优化GeoTIFF（供算法服务在上传后调用）"""
+    record = get_object_record(bucket, object_key)
+    if record is None:
+        return jsonify({'code': 404, 'msg': '文件不存在'}), 404
+    if record['contentType'] not in COG_CONTENT_TYPES:
+        return jsonify({'code': 400, 'msg': '只支持转换TIFF文件'}), 400
+    status = submit_conversion(bucket, object_key, record['contentType'])
+    return jsonify({'code': 200, 'msg': '已提交转换', 'data': {'status': status}})
+
+@app.route('/api/file/cog/<bucket>/<path:object_key>', methods=['GET'])
+def get_cog_status(bucket, object_key):
+    """查询COG转换状态"""
+    status = get_conversion_status(bucket, object_key)
+    if status is None:
+        return jsonify({'code': 404, 'msg': '没有转换记录'}), 404
+    return jsonify({'code': 200, 'msg': '查询成功', 'data': status})
+
 @app.route('/api/file/<bucket>/<path:object_key>', methods=['GET'])
 def get_file(bucket, object_key):
     """获取文件"""
-    file_path = os.path.join(FILE_STORE_CONFIG['base_path'], bucket, object_key)
+    try:
+        file_path = get_object_path(bucket, object_key)
+    except InvalidObjectKeyError:
+        return jsonify({'code': 404, 'msg': '文件不存在'}), 404
     if not os.path.exists(file_path):
         return jsonify({'code': 404, 'msg': '文件不存在'}), 404
-    return send_file(file_path)
+    
+    # 强ETag：优先使用内容哈希，旧文件使用 inode/大小/修改时间
+    etag = get_object_hash(bucket, object_key)
+    if etag is None:
+        stat = os.stat(file_path)
+        etag = f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    
+    if has_transform(request.args):
+        # 带缩放/裁剪/格式参数时返回衍生图
+        content_type = mimetypes.guess_type(file_path)[0]
+        if content_type not in TRANSFORMABLE_TYPES:
+            return jsonify({'code': 400, 'msg': '该文件类型不支持生成衍生图'}), 400
+        try:
+            params = parse_transform(request.args)
+            etag = derivative_key(bucket, object_key, etag, params)
+            file_path = derivative_cache.get(file_path, etag, params)
+        except DerivativeError as e:
+            return jsonify({'code': 400, 'msg': str(e)}), 400
+        except FutureTimeoutError:
+            return jsonify({'code': 503, 'msg': '衍生图生成超时，请稍后重试'}), 503
+        response = send_file(file_path, mimetype=get_output_mimetype(params), conditional=True, etag=etag)
+    else:
+        # conditional=True 时处理 Range、If-None-Match、If-Modified-Since，返回206/304
+        response = send_file(file_path, conditional=True, etag=etag)
+    
+    if UUID_FILENAME_PATTERN.match(os.path.basename(object_key)):
+        # uuid命名的对象内容不会改变，允许客户端长期缓存
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        # 缓存文件等可能被同名覆盖的对象，每次使用前向服务端验证
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/file/<bucket>/<path:object_key>', methods=['DELETE'])
 def delete_file(bucket, object_key):
-    """删除文件"""
-    file_path = os.path.join(FILE_STORE_CONFIG['base_path'], bucket, object_key)
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    """删除文件，最后一个引用被删除时同时删除内容文件"""
+    try:
+        delete_object(bucket, object_key)
+    except InvalidObjectKeyError:
+        return jsonify({'code': 404, 'msg': '文件不存在'}), 404
+    delete_object_record(bucket, object_key)
     return jsonify({
         'code': 200,
         'msg': '删除成功'
     })
 
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+    return jsonify({'code': 400, 'msg': '文件大小超过限制'}), 400
+
+@app.cli.command('rebuild-index')
+def rebuild_index_command():
+    """扫描存储目录重建对象元数据索引"""
+    count = rebuild_index()
+    print(f"索引重建完成，共 {count} 个对象")
+
 if __name__ == '__main__':
     # 确保基础存储目录存在
     if not os.path.exists(FILE_STORE_CONFIG['base_path']):
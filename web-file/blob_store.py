@@ -0,0 +1,175 @@
+"""
+内容寻址的去重存储
+
+文件内容按SHA-256保存为 base_path/.blobs/sha256/<前两位>/<sha256>，对象路径 base_path/<bucket>/<object_key>
+是指向该文件的硬链接，文件的硬链接数即为引用计数。相同内容重复上传时只做一次哈希和一次链接，
+最后一个引用的对象被删除时才删除内容文件
+
+对象对应的哈希记录在 base_path/.blobs/refs/<bucket>/<object_key> 中，删除对象时据此找到内容文件
+"""
+
+import os
+import uuid
+from config import FILE_STORE_CONFIG
+
+# 内容存储目录（位于存储根目录下）
+BLOB_DIR = '.blobs'
+
+# 内容文件在链接过程中被并发删除时的重试次数
+LINK_RETRIES = 3
+
+class InvalidObjectKeyError(Exception):
+    """对象路径不合法"""
+    pass
+
+def check_name_segment(name):
+    """
+    校验用户ID或文件名是单个路径段
+
+    Raises:
+        InvalidObjectKeyError: 为空、为 '.' 或 '..'，或者包含路径分隔符
+    """
+    if not name or name in ('.', '..') or '/' in name or '\\' in name:
+        raise InvalidObjectKeyError(f'无效的文件名: {name}')
+
+def get_object_path(bucket, object_key):
+    """
+    获取对象文件路径
+
+    存储桶不能以点开头（保留给内部目录）；对象路径必须是规范形式，不能包含反斜杠、空段、'.' 或 '..'，
+    保证对象路径的第一段（用户ID）就是对象实际所在的用户目录
+    """
+    if not bucket or bucket.startswith('.') or '/' in bucket or '\\' in bucket:
+        raise InvalidObjectKeyError(f'无效的存储桶: {bucket}')
+    if not object_key or '\\' in object_key or any(part in ('', '.', '..') for part in object_key.split('/')):
+        raise InvalidObjectKeyError(f'无效的对象路径: {object_key}')
+    bucket_dir = os.path.abspath(os.path.join(FILE_STORE_CONFIG['base_path'], bucket))
+    path = os.path.abspath(os.path.join(bucket_dir, object_key))
+    if os.path.commonpath([bucket_dir, path]) != bucket_dir or path == bucket_dir:
+        raise InvalidObjectKeyError(f'无效的对象路径: {object_key}')
+    return path
+
+def get_blob_path(sha256):
+    """获取内容文件路径"""
+    return os.path.join(FILE_STORE_CONFIG['base_path'], BLOB_DIR, 'sha256', sha256[:2], sha256)
+
+def _get_ref_path(bucket, object_key):
+    """获取对象哈希记录路径"""
+    return os.path.join(FILE_STORE_CONFIG['base_path'], BLOB_DIR, 'refs', bucket, object_key)
+
+def get_object_hash(bucket, object_key):
+    """
+    获取对象内容的SHA-256
+
+    Returns:
+        str: SHA-256十六进制摘要，对象不是通过内容存储写入的时返回None
+    """
+    try:
+        with open(_get_ref_path(bucket, object_key), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def _write_ref(bucket, object_key, sha256):
+    """原子写入对象哈希记录"""
+    ref_path = _get_ref_path(bucket, object_key)
+    os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+    tmp_path = f"{ref_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(sha256)
+    os.replace(tmp_path, ref_path)
+
+def _link_into_place(source_path, target_path):
+    """创建指向 source_path 的硬链接并原子替换 target_path"""
+    tmp_path = os.path.join(os.path.dirname(target_path), f".link-{uuid.uuid4().hex}.tmp")
+    os.link(source_path, tmp_path)
+    try:
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def release_blob(sha256):
+    """
+    内容文件不再被任何对象引用时删除
+
+    先把内容文件改名再检查引用数，避免检查之后、删除之前有新上传链接到该文件
+    """
+    blob_path = get_blob_path(sha256)
+    try:
+        if os.stat(blob_path).st_nlink > 1:
+            return
+        releasing_path = f"{blob_path}.{uuid.uuid4().hex}.releasing"
+        os.rename(blob_path, releasing_path)
+    except FileNotFoundError:
+        return
+
+    if os.stat(releasing_path).st_nlink > 1:
+        # 改名前又有对象引用了该内容，放回原处（原处已有新内容文件时以新文件为准）
+        try:
+            os.link(releasing_path, blob_path)
+        except FileExistsError:
+            pass
+    os.remove(releasing_path)
+
+def store_object(tmp_path, sha256, bucket, object_key):
+    """
+    把上传完成的临时文件存入内容存储，并在对象路径上创建硬链接
+
+    内容已存在时直接删除临时文件，只创建对象链接；对象路径已有旧文件时原子替换，并释放旧内容
+
+    Args:
+        tmp_path (str): 临时文件路径（需与存储根目录在同一文件系统）
+        sha256 (str): 文件内容的SHA-256
+        bucket (str): 存储桶
+        object_key (str): 对象路径
+
+    Returns:
+        bool: 是否命中已有内容（重复上传）
+    """
+    object_path = get_object_path(bucket, object_key)
+    blob_path = get_blob_path(sha256)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    old_sha256 = get_object_hash(bucket, object_key)
+
+    for _ in range(LINK_RETRIES):
+        try:
+            os.link(tmp_path, blob_path)
+            deduplicated = False
+        except FileExistsError:
+            deduplicated = True
+        try:
+            _link_into_place(blob_path, object_path)
+            break
+        except FileNotFoundError:
+            # 内容文件在链接前被最后一个引用的删除操作释放，重新写入
+            continue
+    else:
+        raise IOError(f"写入内容存储失败: {sha256}")
+
+    os.remove(tmp_path)
+    _write_ref(bucket, object_key, sha256)
+    if old_sha256 and old_sha256 != sha256:
+        release_blob(old_sha256)
+    return deduplicated
+
+def delete_object(bucket, object_key):
+    """
+    删除对象，最后一个引用被删除时同时删除内容文件
+
+    Returns:
+        bool: 对象是否存在
+    """
+    object_path = get_object_path(bucket, object_key)
+    sha256 = get_object_hash(bucket, object_key)
+    existed = os.path.exists(object_path)
+    if existed:
+        os.remove(object_path)
+    if sha256:
+        try:
+            os.remove(_get_ref_path(bucket, object_key))
+        except FileNotFoundError:
+            pass
+        release_blob(sha256)
+    return existed
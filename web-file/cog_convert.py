@@ -0,0 +1,170 @@
+"""
+上传后的云优化GeoTIFF（COG）转换
+
+image/tiff 对象上传后在后台转换为内部分块、DEFLATE压缩并带概览金字塔的GeoTIFF。转换结果以新的UUID文件名
+写入同一用户目录，原对象保持不变（UUID文件名的对象按不可变内容缓存，不能原地替换）。转换状态和结果对象路径
+记录在元数据索引中。GDAL为可选依赖，未安装时不做转换
+"""
+
+import os
+import logging
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from blob_store import get_object_path, get_object_hash, store_object
+from file_utils import file_sha256
+from metadata_index import upsert_object, set_conversion_status
+
+logger = logging.getLogger(__name__)
+
+try:
+    from osgeo import gdal
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
+# 需要转换的文件类型
+COG_CONTENT_TYPES = {'image/tiff'}
+
+# 后台转换线程数（GDAL在转换过程中释放GIL，转换本身较重，默认串行）
+COG_WORKERS = 1
+
+# 分块大小
+COG_BLOCK_SIZE = 512
+
+# 小于该尺寸的影像不生成概览
+OVERVIEW_MIN_SIZE = 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 本进程中正在排队或转换的对象
+_pending = set()
+
+def is_cog_supported():
+    """是否安装了GDAL"""
+    return gdal is not None
+
+def _get_executor():
+    """获取转换线程池（首次使用时创建）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=COG_WORKERS, thread_name_prefix='cog-convert')
+        return _executor
+
+def _is_optimized(path):
+    """影像是否已经是内部分块且带概览的GeoTIFF"""
+    ds = gdal.Open(path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"无法打开影像文件: {path}")
+    band = ds.GetRasterBand(1)
+    block_width, _ = band.GetBlockSize()
+    tiled = block_width < ds.RasterXSize or ds.RasterXSize <= COG_BLOCK_SIZE
+    needs_overviews = max(ds.RasterXSize, ds.RasterYSize) > OVERVIEW_MIN_SIZE
+    return tiled and (band.GetOverviewCount() > 0 or not needs_overviews)
+
+def _translate_to_cog(source_path, target_path):
+    """
+    转换为COG
+
+    GDAL 3.1 及以上使用COG驱动；更早的版本先在临时分块GeoTIFF上构建概览，再复制为带内部概览的分块GeoTIFF
+    """
+    common_options = ['COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER', 'NUM_THREADS=ALL_CPUS']
+    if gdal.GetDriverByName('COG') is not None:
+        gdal.Translate(target_path, source_path, format='COG',
+                       creationOptions=common_options + ['PREDICTOR=YES', f'BLOCKSIZE={COG_BLOCK_SIZE}',
+                                                         'OVERVIEWS=AUTO'])
+        return
+
+    tiled_options = common_options + ['PREDICTOR=2', 'TILED=YES',
+                                      f'BLOCKXSIZE={COG_BLOCK_SIZE}', f'BLOCKYSIZE={COG_BLOCK_SIZE}']
+    staging_path = f"{target_path}.staging.tif"
+    try:
+        ds = gdal.Translate(staging_path, source_path, format='GTiff', creationOptions=tiled_options)
+        levels = []
+        factor = 2
+        while max(ds.RasterXSize, ds.RasterYSize) / factor >= COG_BLOCK_SIZE:
+            levels.append(factor)
+            factor *= 2
+        if levels:
+            ds.BuildOverviews('AVERAGE', levels)
+        ds = None
+        gdal.Translate(target_path, staging_path, format='GTiff',
+                       creationOptions=tiled_options + ['COPY_SRC_OVERVIEWS=YES'])
+    finally:
+        if os.path.exists(staging_path):
+            gdal.GetDriverByName('GTiff').Delete(staging_path)
+
+def convert_object(bucket, object_key, content_type):
+    """
+    把对象转换为COG并另存为新对象（在转换线程中执行）
+
+    转换前记录源内容哈希，转换完成时对象已被覆盖或删除则放弃结果
+
+    Args:
+        bucket (str): 存储桶
+        object_key (str): 对象路径
+        content_type (str): 文件类型
+    """
+    try:
+        source_path = get_object_path(bucket, object_key)
+        source_sha256 = get_object_hash(bucket, object_key)
+        if _is_optimized(source_path):
+            set_conversion_status(bucket, object_key, 'skipped')
+            return
+
+        set_conversion_status(bucket, object_key, 'converting')
+        fd, tmp_path = tempfile.mkstemp(prefix='.cog-', suffix='.tif', dir=os.path.dirname(source_path))
+        os.close(fd)
+        try:
+            _translate_to_cog(source_path, tmp_path)
+            if get_object_hash(bucket, object_key) != source_sha256 or not os.path.exists(source_path):
+                os.remove(tmp_path)
+                set_conversion_status(bucket, object_key, 'failed', '转换期间对象已被修改或删除')
+                return
+            sha256 = file_sha256(tmp_path)
+            size = os.path.getsize(tmp_path)
+            result_key = f"{os.path.dirname(object_key)}/{uuid.uuid4()}.tif"
+            store_object(tmp_path, sha256, bucket, result_key)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        upsert_object(bucket, result_key, size, content_type, sha256)
+        set_conversion_status(bucket, object_key, 'done', result_key=result_key)
+    except Exception as e:
+        logger.error(f"COG转换失败 {bucket}/{object_key}: {str(e)}")
+        set_conversion_status(bucket, object_key, 'failed', str(e))
+    finally:
+        with _executor_lock:
+            _pending.discard((bucket, object_key))
+
+def submit_conversion(bucket, object_key, content_type):
+    """
+    提交COG转换任务
+
+    Args:
+        bucket (str): 存储桶
+        object_key (str): 对象路径
+        content_type (str): 文件类型
+
+    Returns:
+        str: 提交后的转换状态
+    """
+    if content_type not in COG_CONTENT_TYPES:
+        return None
+    if not is_cog_supported():
+        set_conversion_status(bucket, object_key, 'unsupported', '未安装GDAL')
+        return 'unsupported'
+
+    executor = _get_executor()
+    with _executor_lock:
+        if (bucket, object_key) in _pending:
+            return 'pending'
+        _pending.add((bucket, object_key))
+    set_conversion_status(bucket, object_key, 'pending')
+    executor.submit(convert_object, bucket, object_key, content_type)
+    return 'pending'
@@ -54,5 +54,10 @@ FILE_STORE_CONFIG = {
         'application/x-keras',          # Keras模型文件 (.keras)
         'application/x-savedmodel'      # TensorFlow SavedModel格式
     ],
-    'max_size': 1000 * 1024 * 1024  # 最大文件大小：1000MB
+    'max_size': 1000 * 1024 * 1024,  # 最大文件大小：1000MB
+    'chunk_size': 1024 * 1024,  # 上传流式写入的块大小：1MB
+    'cog_on_upload': True,  # TIFF上传后是否在后台转换为云优化GeoTIFF（需要GDAL）
+    'index_path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata.db'),  # 对象元数据索引数据库路径，不能位于存储根目录下（存储根目录作为静态目录对外提供）
+    'user_quota': 10 * 1024 * 1024 * 1024,  # 每个用户的总存储配额：10GB，None表示不限制
+    'bucket_quotas': {}  # 每个用户在各存储桶中的配额，例如 {'avatars': 20 * 1024 * 1024}
 }
\ No newline at end of file
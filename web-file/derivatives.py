@@ -0,0 +1,247 @@
+"""
+图片衍生图（缩放、裁剪、转换格式）
+
+衍生图在有界线程池中生成，结果按 (对象, 源文件版本, 参数) 的哈希保存在 base_path/.derivatives 下，
+缓存总大小超过上限时按最近访问时间淘汰
+"""
+
+import os
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from config import FILE_STORE_CONFIG
+
+# 衍生图缓存目录（位于存储根目录下）
+DERIVATIVE_DIR = '.derivatives'
+
+# 衍生图缓存总大小上限：1GB
+DERIVATIVE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# 生成衍生图的线程数
+DERIVATIVE_WORKERS = 2
+
+# 等待衍生图生成的最长时间（秒）
+DERIVATIVE_TIMEOUT = 60
+
+# 衍生图的最大边长
+MAX_DERIVATIVE_SIZE = 4096
+
+# 可以生成衍生图的源文件类型（Pillow可解码的图片类型）
+TRANSFORMABLE_TYPES = {
+    'image/jpeg', 'image/png', 'image/gif', 'image/tiff', 'image/bmp', 'image/x-ms-bmp',
+    'image/webp', 'image/x-icon', 'image/vnd.microsoft.icon', 'image/x-portable-pixmap',
+    'image/x-portable-graymap', 'image/x-portable-bitmap', 'image/x-portable-anymap'
+} & set(FILE_STORE_CONFIG['allowed_types'])
+
+# 输出格式：(Pillow格式名, 扩展名, MIME类型)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'jpg': ('JPEG', 'jpg', 'image/jpeg'),
+    'png': ('PNG', 'png', 'image/png'),
+    'webp': ('WEBP', 'webp', 'image/webp')
+}
+
+# 请求中表示衍生图参数的查询参数
+TRANSFORM_PARAMS = ('w', 'h', 'crop', 'format', 'quality')
+
+class DerivativeError(Exception):
+    """衍生图参数错误或源文件无法解码"""
+    pass
+
+def has_transform(args):
+    """请求是否带有衍生图参数"""
+    return any(name in args for name in TRANSFORM_PARAMS)
+
+def parse_transform(args):
+    """
+    解析并校验衍生图参数
+
+    Args:
+        args: 查询参数，w/h 为最大宽高，crop 为源图上的裁剪窗口 "x,y,宽,高"，
+            format 为 jpeg/png/webp，quality 为 1-95
+
+    Returns:
+        dict: 规范化后的参数
+    """
+    try:
+        width = int(args['w']) if args.get('w') else None
+        height = int(args['h']) if args.get('h') else None
+        crop = tuple(int(v) for v in args['crop'].split(',')) if args.get('crop') else None
+        quality = int(args.get('quality', 85))
+    except ValueError:
+        raise DerivativeError('衍生图参数必须是整数')
+
+    for size in (width, height):
+        if size is not None and not 1 <= size <= MAX_DERIVATIVE_SIZE:
+            raise DerivativeError(f'宽高必须在1到{MAX_DERIVATIVE_SIZE}之间')
+    if crop is not None and (len(crop) != 4 or crop[0] < 0 or crop[1] < 0 or crop[2] <= 0 or crop[3] <= 0):
+        raise DerivativeError('crop参数格式为 x,y,宽,高')
+    if not 1 <= quality <= 95:
+        raise DerivativeError('quality必须在1到95之间')
+
+    output_format = args.get('format', 'jpeg').lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise DerivativeError(f'不支持的输出格式: {output_format}')
+    return {
+        'w': width,
+        'h': height,
+        'crop': crop,
+        'format': OUTPUT_FORMATS[output_format][1],
+        'quality': quality
+    }
+
+def get_output_mimetype(params):
+    """衍生图的MIME类型"""
+    return OUTPUT_FORMATS[params['format']][2]
+
+def derivative_key(bucket, object_key, version, params):
+    """
+    衍生图缓存键
+
+    Args:
+        bucket (str): 存储桶
+        object_key (str): 对象路径
+        version (str): 源文件版本（内容哈希或ETag），源文件被覆盖后缓存自然失效
+        params (dict): 规范化后的衍生图参数
+
+    Returns:
+        str: 缓存键
+    """
+    payload = f"{bucket}|{object_key}|{version}|{params['w']}|{params['h']}|{params['crop']}|" \
+              f"{params['format']}|{params['quality']}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _to_output_mode(image, pil_format):
+    """把图片转换为输出格式支持的颜色模式"""
+    if image.mode in ('I', 'F'):
+        # 16位/浮点影像线性拉伸到8位
+        low, high = image.getextrema()
+        scale = 255.0 / (high - low) if high > low else 0
+        image = image.point(lambda v: v * scale - low * scale).convert('L')
+    if pil_format == 'JPEG':
+        return image.convert('RGB') if image.mode != 'L' else image
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        return image.convert('RGBA')
+    return image
+
+def render_derivative(source_path, params, target_path):
+    """
+    生成衍生图并原子写入 target_path
+
+    未裁剪时缩放使用 thumbnail，JPEG源图会直接按缩小比例解码
+    """
+    pil_format = OUTPUT_FORMATS[params['format']][0]
+    tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with Image.open(source_path) as image:
+            if image.mode.startswith('I;16'):
+                # 16位影像不支持缩放，先转为32位整数
+                image = image.convert('I')
+            if params['crop'] is not None:
+                x, y, w, h = params['crop']
+                image = image.crop((x, y, x + w, y + h))
+            if params['w'] or params['h']:
+                image.thumbnail((params['w'] or MAX_DERIVATIVE_SIZE, params['h'] or MAX_DERIVATIVE_SIZE))
+            image = _to_output_mode(image, pil_format)
+            save_options = {'quality': params['quality']} if pil_format in ('JPEG', 'WEBP') else {'optimize': True}
+            image.save(tmp_path, pil_format, **save_options)
+        os.replace(tmp_path, target_path)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise DerivativeError(f'无法生成衍生图: {str(e)}')
+    return target_path
+
+class DerivativeCache:
+    """
+    有大小上限的衍生图磁盘缓存
+
+    记录缓存目录总大小，写入后超过上限时删除最近最少访问的文件；命中时更新访问时间
+    """
+    def __init__(self, max_bytes=DERIVATIVE_CACHE_MAX_BYTES, max_workers=DERIVATIVE_WORKERS):
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='derivative')
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._current_bytes = None
+
+    def get_dir(self):
+        """缓存目录"""
+        return os.path.join(FILE_STORE_CONFIG['base_path'], DERIVATIVE_DIR)
+
+    def _scan(self):
+        """扫描缓存目录，返回 [(访问时间, 大小, 路径)]"""
+        entries = []
+        directory = self.get_dir()
+        if not os.path.isdir(directory):
+            return entries
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+        return entries
+
+    def _account(self, size):
+        """累计新写入的大小，超过上限时淘汰"""
+        with self._lock:
+            if self._current_bytes is None:
+                self._current_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._current_bytes += size
+            if self._current_bytes <= self.max_bytes:
+                return
+            entries = sorted(self._scan())
+            self._current_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if self._current_bytes <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    self._current_bytes -= size
+                except OSError:
+                    # 已被删除，或在Windows上正被发送
+                    continue
+
+    def _render(self, source_path, params, target_path, key):
+        """在工作线程中生成衍生图"""
+        try:
+            render_derivative(source_path, params, target_path)
+            self._account(os.path.getsize(target_path))
+            return target_path
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def get(self, source_path, key, params):
+        """
+        获取衍生图路径，缓存未命中时提交生成任务并等待
+
+        Args:
+            source_path (str): 源文件路径
+            key (str): 缓存键
+            params (dict): 规范化后的衍生图参数
+
+        Returns:
+            str: 衍生图文件路径
+        """
+        target_path = os.path.join(self.get_dir(), f"{key}.{params['format']}")
+        if os.path.exists(target_path):
+            try:
+                os.utime(target_path)
+            except FileNotFoundError:
+                pass
+            else:
+                return target_path
+
+        os.makedirs(self.get_dir(), exist_ok=True)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, source_path, params, target_path, key)
+                self._pending[key] = future
+        return future.result(timeout=DERIVATIVE_TIMEOUT)
+
+# 进程内共享的衍生图缓存
+derivative_cache = DerivativeCache()
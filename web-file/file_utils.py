@@ -0,0 +1,122 @@
+"""文件存储辅助函数"""
+
+import os
+import hashlib
+import tempfile
+import zipfile
+from config import FILE_STORE_CONFIG
+
+class UploadTooLargeError(Exception):
+    """上传内容超过大小限制"""
+    pass
+
+def stream_to_temp(stream, directory, max_size):
+    """
+    分块读取上传流并写入目标目录下的临时文件，同时累计大小并计算SHA-256
+
+    超过大小限制时立即停止读取并删除临时文件，内存占用与文件大小无关
+
+    Args:
+        stream: 上传文件流
+        directory (str): 临时文件所在目录（与目标文件同目录，保证可原子重命名）
+        max_size (int): 最大文件大小（字节）
+
+    Returns:
+        tuple: (临时文件路径, 文件大小, SHA-256十六进制摘要)
+    """
+    chunk_size = FILE_STORE_CONFIG['chunk_size']
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix='.upload-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLargeError(f"文件大小超过限制: {max_size}")
+                sha256.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, size, sha256.hexdigest()
+
+def file_sha256(path):
+    """分块计算文件SHA-256"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FILE_STORE_CONFIG['chunk_size']), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+# 本身已压缩的文件类型，打包时直接存储不再压缩
+COMPRESSED_CONTENT_TYPES = {
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'application/zip', 'application/x-zip-compressed'
+}
+
+class StreamBuffer:
+    """
+    只能追加写入的缓冲区，供 zipfile 写入不可寻址的输出流
+
+    zipfile 写入后由生成器取出已写入的数据发送给客户端，缓冲区中只保留尚未发送的一小段数据
+    """
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """取出并清空已写入的数据"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def is_compressed_type(content_type):
+    """文件类型本身是否已压缩"""
+    if not content_type:
+        return False
+    return content_type in COMPRESSED_CONTENT_TYPES or content_type.startswith('video/')
+
+def iter_zip_stream(entries):
+    """
+    边读取文件边生成ZIP数据，不使用临时文件也不在内存中缓存整个压缩包
+
+    Args:
+        entries (list): [(压缩包内文件名, 文件路径, 文件类型)]
+
+    Yields:
+        bytes: ZIP数据块
+    """
+    chunk_size = FILE_STORE_CONFIG['chunk_size']
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zf:
+        for arcname, path, content_type in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zipfile.ZIP_STORED if is_compressed_type(content_type) else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, zf.open(zinfo, 'w', force_zip64=True) as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            # 文件结束时写入的数据描述符
+            yield buffer.pop()
+    # 关闭时写入的中央目录
+    yield buffer.pop()
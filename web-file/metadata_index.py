@@ -0,0 +1,464 @@
+"""
+对象元数据索引
+
+使用嵌入式SQLite数据库记录每个对象的大小、类型、哈希、所有者和时间，上传和删除时同步更新，
+列表和前缀查询直接走索引而不扫描目录；索引丢失或与磁盘不一致时可以从磁盘重建
+"""
+
+import os
+import time
+import sqlite3
+import mimetypes
+from config import FILE_STORE_CONFIG
+from blob_store import get_object_hash
+from file_utils import file_sha256
+
+# 旧版本索引数据库文件名（位于存储根目录下，启动时迁移到 FILE_STORE_CONFIG['index_path']）
+LEGACY_INDEX_FILE = '.metadata.db'
+
+# 列表接口单页最大条数
+MAX_LIST_LIMIT = 1000
+
+# 前缀查询的上界后缀（UTF-8编码下最大的码点）
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    sha256 TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (bucket, object_key)
+);
+CREATE INDEX IF NOT EXISTS idx_objects_owner ON objects (bucket, owner, object_key);
+CREATE INDEX IF NOT EXISTS idx_objects_sha256 ON objects (sha256);
+CREATE TABLE IF NOT EXISTS usage (
+    owner TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    objects INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, bucket)
+);
+CREATE TABLE IF NOT EXISTS conversions (
+    bucket TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    result_key TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (bucket, object_key)
+);
+'''
+
+def get_index_path():
+    """获取索引数据库路径"""
+    return FILE_STORE_CONFIG['index_path']
+
+def _migrate_legacy_index():
+    """把存储根目录下的旧索引数据库（连同WAL文件）移动到新位置"""
+    legacy_path = os.path.join(FILE_STORE_CONFIG['base_path'], LEGACY_INDEX_FILE)
+    if not os.path.exists(legacy_path) or os.path.exists(get_index_path()):
+        return
+    for suffix in ('-wal', '-shm', ''):
+        if os.path.exists(legacy_path + suffix):
+            os.replace(legacy_path + suffix, get_index_path() + suffix)
+
+def get_db():
+    """获取索引数据库连接"""
+    conn = sqlite3.connect(get_index_path(), timeout=30)
+    conn.row_factory = sqlite3.Row
+    # 事务由调用方显式控制（读取和更新需要在同一个事务中的地方使用 BEGIN IMMEDIATE）
+    conn.isolation_level = None
+    return conn
+
+def init_index():
+    """初始化索引数据库，使用WAL模式以便多个工作进程并发读写"""
+    os.makedirs(FILE_STORE_CONFIG['base_path'], exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(get_index_path())), exist_ok=True)
+    _migrate_legacy_index()
+    conn = get_db()
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        # 旧索引的转换记录没有结果对象列
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(conversions)')]
+        if 'result_key' not in columns:
+            conn.execute('ALTER TABLE conversions ADD COLUMN result_key TEXT')
+        # 从没有用量统计的旧索引升级时按对象记录补齐
+        if conn.execute('SELECT 1 FROM usage LIMIT 1').fetchone() is None and \
+                conn.execute('SELECT 1 FROM objects LIMIT 1').fetchone() is not None:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                _recompute_usage(conn)
+    finally:
+        conn.close()
+
+def _row_to_dict(row):
+    """把索引记录转换为接口返回格式"""
+    return {
+        'bucket': row['bucket'],
+        'objectKey': row['object_key'],
+        'owner': row['owner'],
+        'size': row['size'],
+        'contentType': row['content_type'],
+        'sha256': row['sha256'],
+        'createdAt': row['created_at'],
+        'updatedAt': row['updated_at']
+    }
+
+def _add_usage(conn, owner, bucket, bytes_delta, objects_delta):
+    """在当前事务中累加用户在存储桶中的用量"""
+    conn.execute(
+        '''INSERT INTO usage (owner, bucket, bytes, objects) VALUES (?, ?, ?, ?)
+           ON CONFLICT (owner, bucket) DO UPDATE SET
+               bytes = bytes + excluded.bytes, objects = objects + excluded.objects''',
+        (owner, bucket, bytes_delta, objects_delta)
+    )
+
+def _write_object(conn, bucket, object_key, size, content_type, sha256):
+    """
+    在当前事务中写入对象记录并累计用量，覆盖时按新旧大小之差累计
+
+    Returns:
+        dict: 被覆盖的旧记录，没有时返回None
+    """
+    now = time.time()
+    owner = object_key.split('/', 1)[0]
+    row = conn.execute(
+        'SELECT * FROM objects WHERE bucket = ? AND object_key = ?', (bucket, object_key)
+    ).fetchone()
+    conn.execute(
+        '''INSERT INTO objects (bucket, object_key, owner, size, content_type, sha256, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (bucket, object_key) DO UPDATE SET
+               size = excluded.size, content_type = excluded.content_type,
+               sha256 = excluded.sha256, updated_at = excluded.updated_at''',
+        (bucket, object_key, owner, size, content_type, sha256, now, now)
+    )
+    if row is None:
+        _add_usage(conn, owner, bucket, size, 1)
+        return None
+    _add_usage(conn, owner, bucket, size - row['size'], 0)
+    return _row_to_dict(row)
+
+def upsert_object(bucket, object_key, size, content_type, sha256):
+    """
+    写入或更新对象记录，同名对象被覆盖时保留创建时间
+
+    对象记录和用户用量在同一个事务中更新，覆盖时按新旧大小之差累计
+
+    Args:
+        bucket (str): 存储桶
+        object_key (str): 对象路径，第一级目录为所有者（用户ID）
+        size (int): 文件大小（字节）
+        content_type (str): 文件类型
+        sha256 (str): 内容哈希
+    """
+    conn = get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        _write_object(conn, bucket, object_key, size, content_type, sha256)
+        conn.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def reserve_object(bucket, object_key, size, content_type, sha256):
+    """
+    检查配额并写入对象记录
+
+    配额检查和用量累计在同一个 BEGIN IMMEDIATE 事务中完成，并发上传不会都通过检查后一起超出配额。
+    在把文件存入内容存储之前调用，存储失败时用 release_object 撤销
+
+    Args:
+        bucket (str): 存储桶
+        object_key (str): 对象路径，第一级目录为所有者（用户ID）
+        size (int): 文件大小（字节）
+        content_type (str): 文件类型
+        sha256 (str): 内容哈希
+
+    Returns:
+        tuple: (超出配额时的提示信息，未超出时为None; 被覆盖的旧记录，没有时为None)
+    """
+    owner = object_key.split('/', 1)[0]
+    conn = get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute(
+            'SELECT size FROM objects WHERE bucket = ? AND object_key = ?', (bucket, object_key)
+        ).fetchone()
+        quota_error = _quota_error(_read_usage(conn, owner), bucket, size - (row['size'] if row else 0))
+        if quota_error:
+            conn.execute('ROLLBACK')
+            return quota_error, None
+        previous = _write_object(conn, bucket, object_key, size, content_type, sha256)
+        conn.execute('COMMIT')
+        return None, previous
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def release_object(bucket, object_key, previous):
+    """
+    撤销 reserve_object 写入的记录：恢复被覆盖的旧记录，没有旧记录时删除记录
+
+    Args:
+        bucket (str): 存储桶
+        object_key (str): 对象路径
+        previous (dict): reserve_object 返回的旧记录
+    """
+    if previous is None:
+        delete_object_record(bucket, object_key)
+    else:
+        upsert_object(bucket, object_key, previous['size'], previous['contentType'], previous['sha256'])
+
+def delete_object_record(bucket, object_key):
+    """删除对象记录及其转换状态，同时扣减用户用量"""
+    conn = get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute(
+            'SELECT owner, size FROM objects WHERE bucket = ? AND object_key = ?', (bucket, object_key)
+        ).fetchone()
+        if row is not None:
+            conn.execute('DELETE FROM objects WHERE bucket = ? AND object_key = ?', (bucket, object_key))
+            _add_usage(conn, row['owner'], bucket, -row['size'], -1)
+        conn.execute('DELETE FROM conversions WHERE bucket = ? AND object_key = ?', (bucket, object_key))
+        conn.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def get_usage(owner):
+    """
+    查询用户用量
+
+    Args:
+        owner (str): 用户ID
+
+    Returns:
+        dict: 各存储桶的字节数和对象数 {bucket: {'bytes': ..., 'objects': ...}}
+    """
+    conn = get_db()
+    try:
+        return _read_usage(conn, owner)
+    finally:
+        conn.close()
+
+def _read_usage(conn, owner):
+    """在给定连接上读取用户各存储桶的用量"""
+    rows = conn.execute('SELECT bucket, bytes, objects FROM usage WHERE owner = ?', (owner,)).fetchall()
+    return {row['bucket']: {'bytes': row['bytes'], 'objects': row['objects']} for row in rows}
+
+def get_quota(bucket=None):
+    """
+    获取配额（字节），bucket为None时返回用户总配额；未配置时返回None表示不限制
+    """
+    if bucket is None:
+        return FILE_STORE_CONFIG.get('user_quota')
+    return FILE_STORE_CONFIG.get('bucket_quotas', {}).get(bucket)
+
+def check_quota(owner, bucket, incoming_bytes, object_key=None):
+    """
+    检查写入 incoming_bytes 字节后是否超出用户总配额或存储桶配额
+
+    Args:
+        owner (str): 用户ID
+        bucket (str): 存储桶
+        incoming_bytes (int): 将要写入的字节数
+        object_key (str, optional): 将被覆盖的对象路径，覆盖时扣除旧对象大小
+
+    Returns:
+        str: 超出配额时返回提示信息，否则返回None
+    """
+    replaced = 0
+    if object_key is not None:
+        record = get_object_record(bucket, object_key)
+        replaced = record['size'] if record else 0
+    return _quota_error(get_usage(owner), bucket, incoming_bytes - replaced)
+
+def _quota_error(usage, bucket, bytes_delta):
+    """
+    按当前用量判断增加 bytes_delta 字节后是否超出用户总配额或存储桶配额
+
+    Returns:
+        str: 超出配额时返回提示信息，否则返回None
+    """
+    total_quota = get_quota()
+    total_used = sum(item['bytes'] for item in usage.values())
+    if total_quota is not None and bytes_delta > 0 and total_used + bytes_delta > total_quota:
+        return f'超出用户存储配额（已用 {total_used} / {total_quota} 字节）'
+
+    bucket_quota = get_quota(bucket)
+    bucket_used = usage.get(bucket, {}).get('bytes', 0)
+    if bucket_quota is not None and bytes_delta > 0 and bucket_used + bytes_delta > bucket_quota:
+        return f'超出存储桶 {bucket} 的配额（已用 {bucket_used} / {bucket_quota} 字节）'
+    return None
+
+def _recompute_usage(conn):
+    """根据对象记录重新统计全部用量（在当前事务中执行）"""
+    conn.execute('DELETE FROM usage')
+    conn.execute(
+        '''INSERT INTO usage (owner, bucket, bytes, objects)
+           SELECT owner, bucket, SUM(size), COUNT(*) FROM objects GROUP BY owner, bucket'''
+    )
+
+def get_object_record(bucket, object_key):
+    """
+    查询对象记录
+
+    Returns:
+        dict: 对象元数据，不存在时返回None
+    """
+    conn = get_db()
+    try:
+        row = conn.execute(
+            'SELECT * FROM objects WHERE bucket = ? AND object_key = ?', (bucket, object_key)
+        ).fetchone()
+        return _row_to_dict(row) if row else None
+    finally:
+        conn.close()
+
+def list_objects(bucket, prefix='', marker=None, limit=100, owner=None):
+    """
+    按对象路径顺序分页列出对象
+
+    前缀查询转换为对象路径上的范围查询，分页使用上一页最后一个对象路径作为游标，翻页代价与页码无关
+
+    Args:
+        bucket (str): 存储桶
+        prefix (str): 对象路径前缀，例如 '<用户ID>/'
+        marker (str, optional): 上一页最后一个对象路径，从其之后开始列出
+        limit (int): 每页条数，最大 MAX_LIST_LIMIT
+        owner (str, optional): 只列出该所有者的对象
+
+    Returns:
+        tuple: (对象列表, 下一页游标)，没有下一页时游标为None
+    """
+    limit = max(1, min(int(limit), MAX_LIST_LIMIT))
+    sql = 'SELECT * FROM objects WHERE bucket = ?'
+    params = [bucket]
+    if owner is not None:
+        sql += ' AND owner = ?'
+        params.append(owner)
+    if prefix:
+        sql += ' AND object_key >= ? AND object_key < ?'
+        params += [prefix, prefix + PREFIX_UPPER_BOUND]
+    if marker:
+        sql += ' AND object_key > ?'
+        params.append(marker)
+    sql += ' ORDER BY object_key LIMIT ?'
+    params.append(limit + 1)
+
+    conn = get_db()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    items = [_row_to_dict(row) for row in rows[:limit]]
+    next_marker = items[-1]['objectKey'] if len(rows) > limit else None
+    return items, next_marker
+
+def set_conversion_status(bucket, object_key, status, error=None, result_key=None):
+    """
+    记录对象的格式转换状态
+
+    Args:
+        bucket (str): 存储桶
+        object_key (str): 对象路径
+        status (str): pending / converting / done / skipped / failed / unsupported
+        error (str, optional): 失败原因
+        result_key (str, optional): 转换结果的对象路径（同一存储桶）
+    """
+    conn = get_db()
+    try:
+        conn.execute(
+            '''INSERT INTO conversions (bucket, object_key, status, error, result_key, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (bucket, object_key) DO UPDATE SET
+                   status = excluded.status, error = excluded.error,
+                   result_key = excluded.result_key, updated_at = excluded.updated_at''',
+            (bucket, object_key, status, error, result_key, time.time())
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_conversion_status(bucket, object_key):
+    """
+    查询对象的格式转换状态
+
+    Returns:
+        dict: 状态、失败原因、结果对象路径和更新时间，没有转换记录时返回None
+    """
+    conn = get_db()
+    try:
+        row = conn.execute(
+            'SELECT status, error, result_key, updated_at FROM conversions WHERE bucket = ? AND object_key = ?',
+            (bucket, object_key)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'status': row['status'], 'error': row['error'], 'resultKey': row['result_key'],
+                'updatedAt': row['updated_at']}
+    finally:
+        conn.close()
+
+def rebuild_index():
+    """
+    扫描磁盘重建索引
+
+    跳过以点开头的内部目录和临时文件；内容存储中有哈希记录的对象直接使用记录，否则重新计算哈希。
+    重建在一个事务中完成，期间读取方仍看到旧索引
+
+    Returns:
+        int: 索引的对象数
+    """
+    init_index()
+    base_path = FILE_STORE_CONFIG['base_path']
+    records = []
+    for bucket in sorted(os.listdir(base_path)):
+        bucket_dir = os.path.join(base_path, bucket)
+        if bucket.startswith('.') or not os.path.isdir(bucket_dir):
+            continue
+        for root, dirs, files in os.walk(bucket_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                object_key = os.path.relpath(path, bucket_dir).replace(os.sep, '/')
+                stat = os.stat(path)
+                sha256 = get_object_hash(bucket, object_key) or file_sha256(path)
+                records.append((
+                    bucket, object_key, object_key.split('/', 1)[0], stat.st_size,
+                    mimetypes.guess_type(name)[0], sha256, stat.st_mtime, stat.st_mtime
+                ))
+
+    conn = get_db()
+    try:
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM objects')
+            conn.executemany(
+                '''INSERT INTO objects (bucket, object_key, owner, size, content_type, sha256, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                records
+            )
+            _recompute_usage(conn)
+    finally:
+        conn.close()
+    return len(records)
@@ -0,0 +1,236 @@
+"""
+分片上传（initiate / upload part / complete / abort）
+
+每个上传任务在 base_path/.multipart/<upload_id> 下保存清单和分片文件，每个分片的大小和SHA-256
+单独写入旁路文件，分片可以并行、乱序上传，服务重启后已上传的分片仍然有效
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+from config import FILE_STORE_CONFIG
+from file_utils import UploadTooLargeError, stream_to_temp
+
+# 分片上传工作目录（位于存储根目录下）
+MULTIPART_DIR = '.multipart'
+
+# 单个上传任务允许的最大分片数
+MAX_PARTS = 10000
+
+# 未完成的上传任务超过该时间（秒）后被清理
+UPLOAD_EXPIRE_SECONDS = 7 * 24 * 3600
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+class MultipartUploadError(Exception):
+    """分片上传请求错误，code 为返回的HTTP状态码"""
+    def __init__(self, msg, code=400):
+        super().__init__(msg)
+        self.code = code
+
+def get_multipart_root():
+    """获取分片上传工作目录"""
+    return os.path.join(FILE_STORE_CONFIG['base_path'], MULTIPART_DIR)
+
+def get_upload_dir(upload_id):
+    """获取上传任务目录，upload_id 不合法时抛出异常"""
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        raise MultipartUploadError('无效的上传ID', 404)
+    return os.path.join(get_multipart_root(), upload_id)
+
+def _write_json(path, data):
+    """原子写入JSON文件"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _part_name(part_number):
+    """分片文件名"""
+    return f"part-{part_number:05d}"
+
+def initiate_upload(bucket, user_id, filename, content_type, size, is_cache=False):
+    """
+    创建上传任务
+
+    Args:
+        bucket (str): 存储桶
+        user_id (str): 用户ID
+        filename (str): 原始文件名
+        content_type (str): 文件类型
+        size (int): 客户端声明的文件大小，已上传分片的总大小不能超过该值
+        is_cache (bool): 是否是缓存文件
+
+    Returns:
+        str: 上传ID
+    """
+    cleanup_expired_uploads()
+    upload_id = uuid.uuid4().hex
+    upload_dir = get_upload_dir(upload_id)
+    os.makedirs(upload_dir)
+    _write_json(os.path.join(upload_dir, 'manifest.json'), {
+        'uploadId': upload_id,
+        'bucket': bucket,
+        'userId': user_id,
+        'filename': filename,
+        'contentType': content_type,
+        'size': size,
+        'isCache': is_cache,
+        'createdAt': time.time()
+    })
+    return upload_id
+
+def load_manifest(upload_id):
+    """读取上传任务清单，任务不存在时抛出异常"""
+    manifest_path = os.path.join(get_upload_dir(upload_id), 'manifest.json')
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise MultipartUploadError('上传任务不存在', 404)
+
+def upload_part(upload_id, part_number, stream, expected_sha256=None):
+    """
+    保存一个分片
+
+    分片先流式写入临时文件，校验SHA-256后再重命名为分片文件，同一分片重复上传时以最后一次为准。
+    写入时按声明的文件大小减去其他已上传分片的大小限制本分片，超出时立即停止读取
+
+    Args:
+        upload_id (str): 上传ID
+        part_number (int): 分片序号，从1开始
+        stream: 分片数据流
+        expected_sha256 (str, optional): 客户端计算的分片SHA-256，不一致时拒绝该分片
+
+    Returns:
+        dict: 分片序号、大小和SHA-256
+    """
+    manifest = load_manifest(upload_id)
+    if not 1 <= part_number <= MAX_PARTS:
+        raise MultipartUploadError(f'分片序号必须在1到{MAX_PARTS}之间')
+
+    upload_dir = get_upload_dir(upload_id)
+    # 同一分片重新上传时替换旧分片，不计入已上传大小
+    staged_size = sum(part['size'] for part in list_parts(upload_id) if part['partNumber'] != part_number)
+    declared_size = manifest.get('size', FILE_STORE_CONFIG['max_size'])
+    try:
+        tmp_path, size, sha256 = stream_to_temp(stream, upload_dir, max(declared_size - staged_size, 0))
+    except UploadTooLargeError:
+        raise MultipartUploadError('已上传分片的总大小超过声明的文件大小')
+    except FileNotFoundError:
+        raise MultipartUploadError('上传任务不存在', 404)
+
+    if expected_sha256 and expected_sha256.lower() != sha256:
+        os.remove(tmp_path)
+        raise MultipartUploadError('分片校验失败')
+
+    part = {'partNumber': part_number, 'size': size, 'sha256': sha256}
+    part_path = os.path.join(upload_dir, _part_name(part_number))
+    os.replace(tmp_path, part_path)
+    _write_json(f"{part_path}.json", part)
+    return part
+
+def list_parts(upload_id):
+    """
+    列出已上传的分片
+
+    Args:
+        upload_id (str): 上传ID
+
+    Returns:
+        list: 按序号排列的分片信息
+    """
+    load_manifest(upload_id)
+    upload_dir = get_upload_dir(upload_id)
+    parts = []
+    for name in os.listdir(upload_dir):
+        if name.startswith('part-') and name.endswith('.json'):
+            with open(os.path.join(upload_dir, name), 'r', encoding='utf-8') as f:
+                parts.append(json.load(f))
+    return sorted(parts, key=lambda part: part['partNumber'])
+
+def complete_upload(upload_id, directory, parts=None):
+    """
+    合并分片
+
+    按序号依次把分片流式复制到目标目录下的临时文件中，同时计算整体SHA-256，不把分片读入内存
+
+    Args:
+        upload_id (str): 上传ID
+        directory (str): 目标目录，合并结果的临时文件放在该目录下以便原子重命名
+        parts (list, optional): 客户端提交的分片列表 [{'partNumber': 1, 'sha256': '...'}]，
+            为None时合并全部已上传分片
+
+    Returns:
+        tuple: (上传任务清单, 临时文件路径, 文件大小, SHA-256十六进制摘要)
+    """
+    manifest = load_manifest(upload_id)
+    uploaded = {part['partNumber']: part for part in list_parts(upload_id)}
+    if not uploaded:
+        raise MultipartUploadError('没有已上传的分片')
+
+    if parts is None:
+        numbers = sorted(uploaded)
+    else:
+        numbers = []
+        for part in parts:
+            number = int(part.get('partNumber', 0))
+            if number not in uploaded:
+                raise MultipartUploadError(f'分片{number}未上传')
+            if part.get('sha256') and part['sha256'].lower() != uploaded[number]['sha256']:
+                raise MultipartUploadError(f'分片{number}校验失败')
+            numbers.append(number)
+        if numbers != sorted(set(numbers)):
+            raise MultipartUploadError('分片序号必须递增且不重复')
+
+    total_size = sum(uploaded[number]['size'] for number in numbers)
+    if total_size > FILE_STORE_CONFIG['max_size']:
+        raise MultipartUploadError('文件大小超过限制')
+    # 并行上传的分片各自通过检查后总大小仍可能超出，合并前再按声明的大小校验
+    if 'size' in manifest and total_size != manifest['size']:
+        raise MultipartUploadError('分片总大小与声明的文件大小不一致')
+
+    upload_dir = get_upload_dir(upload_id)
+    chunk_size = FILE_STORE_CONFIG['chunk_size']
+    sha256 = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(prefix='.upload-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            for number in numbers:
+                with open(os.path.join(upload_dir, _part_name(number)), 'rb') as src:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        sha256.update(chunk)
+                        dst.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return manifest, tmp_path, total_size, sha256.hexdigest()
+
+def abort_upload(upload_id):
+    """删除上传任务及其全部分片"""
+    upload_dir = get_upload_dir(upload_id)
+    if not os.path.isdir(upload_dir):
+        raise MultipartUploadError('上传任务不存在', 404)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+
+def cleanup_expired_uploads():
+    """清理超过 UPLOAD_EXPIRE_SECONDS 未完成的上传任务"""
+    root = get_multipart_root()
+    if not os.path.isdir(root):
+        return
+    deadline = time.time() - UPLOAD_EXPIRE_SECONDS
+    for name in os.listdir(root):
+        upload_dir = os.path.join(root, name)
+        try:
+            if os.path.isdir(upload_dir) and os.path.getmtime(upload_dir) < deadline:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+        except OSError:
+            continue
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import FILE_STORE_CONFIG
+import metadata_index
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """在临时目录中创建存储根目录和索引数据库，返回存储根目录"""
+    base_path = tmp_path / 'file_store'
+    monkeypatch.setitem(FILE_STORE_CONFIG, 'base_path', str(base_path))
+    monkeypatch.setitem(FILE_STORE_CONFIG, 'index_path', str(tmp_path / 'metadata.db'))
+    monkeypatch.setitem(FILE_STORE_CONFIG, 'user_quota', None)
+    monkeypatch.setitem(FILE_STORE_CONFIG, 'bucket_quotas', {})
+    metadata_index.init_index()
+    return base_path
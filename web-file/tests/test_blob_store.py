@@ -0,0 +1,76 @@
+import os
+import hashlib
+import tempfile
+import pytest
+
+import blob_store
+from blob_store import InvalidObjectKeyError
+
+
+def _stage(store, data):
+    """在存储根目录下写入临时文件，返回 (路径, SHA-256)"""
+    os.makedirs(store, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.upload-', suffix='.tmp', dir=store)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return tmp_path, hashlib.sha256(data).hexdigest()
+
+
+def _store(store, bucket, object_key, data):
+    tmp_path, sha256 = _stage(store, data)
+    return blob_store.store_object(tmp_path, sha256, bucket, object_key), sha256
+
+
+def test_duplicate_content_shares_one_blob(store):
+    assert _store(store, 'files', 'u1/a.txt', b'same')[0] is False
+    deduplicated, sha256 = _store(store, 'files', 'u1/b.txt', b'same')
+
+    assert deduplicated is True
+    blob_path = blob_store.get_blob_path(sha256)
+    assert os.stat(blob_path).st_nlink == 3
+    with open(blob_store.get_object_path('files', 'u1/b.txt'), 'rb') as f:
+        assert f.read() == b'same'
+    assert not [name for name in os.listdir(store) if name.endswith('.tmp')]
+
+
+def test_blob_released_with_last_reference(store):
+    _, sha256 = _store(store, 'files', 'u1/a.txt', b'data')
+    _store(store, 'files', 'u2/a.txt', b'data')
+    blob_path = blob_store.get_blob_path(sha256)
+
+    assert blob_store.delete_object('files', 'u1/a.txt') is True
+    assert os.path.exists(blob_path)
+    assert blob_store.get_object_hash('files', 'u1/a.txt') is None
+
+    assert blob_store.delete_object('files', 'u2/a.txt') is True
+    assert not os.path.exists(blob_path)
+    assert blob_store.delete_object('files', 'u2/a.txt') is False
+
+
+def test_overwrite_releases_previous_blob(store):
+    _, old_sha256 = _store(store, 'files', 'u1/a.txt', b'old')
+    _, new_sha256 = _store(store, 'files', 'u1/a.txt', b'new')
+
+    assert not os.path.exists(blob_store.get_blob_path(old_sha256))
+    assert os.stat(blob_store.get_blob_path(new_sha256)).st_nlink == 2
+    assert blob_store.get_object_hash('files', 'u1/a.txt') == new_sha256
+
+
+def test_release_keeps_blob_still_linked(store):
+    _, sha256 = _store(store, 'files', 'u1/a.txt', b'data')
+    blob_store.release_blob(sha256)
+    assert os.path.exists(blob_store.get_blob_path(sha256))
+    assert not [name for name in os.listdir(os.path.dirname(blob_store.get_blob_path(sha256)))
+                if name.endswith('.releasing')]
+
+
+@pytest.mark.parametrize('bucket, object_key', [
+    ('.blobs', 'u1/a.txt'),
+    ('files', '../u1/a.txt'),
+    ('files', 'u1//a.txt'),
+    ('files', 'u1\\a.txt'),
+    ('files', ''),
+])
+def test_invalid_object_path(store, bucket, object_key):
+    with pytest.raises(InvalidObjectKeyError):
+        blob_store.get_object_path(bucket, object_key)
@@ -0,0 +1,92 @@
+import threading
+
+import metadata_index
+
+
+def _reserve(object_key, size, bucket='files'):
+    return metadata_index.reserve_object(bucket, object_key, size, 'text/plain', 'sha')
+
+
+def test_usage_counts_new_and_overwritten_objects(store):
+    metadata_index.upsert_object('files', 'u1/a.txt', 10, 'text/plain', 'sha')
+    metadata_index.upsert_object('files', 'u1/b.txt', 5, 'text/plain', 'sha')
+    metadata_index.upsert_object('files', 'u1/a.txt', 4, 'text/plain', 'sha')
+
+    assert metadata_index.get_usage('u1') == {'files': {'bytes': 9, 'objects': 2}}
+
+    metadata_index.delete_object_record('files', 'u1/b.txt')
+    assert metadata_index.get_usage('u1') == {'files': {'bytes': 4, 'objects': 1}}
+    assert metadata_index.get_usage('u2') == {}
+
+
+def test_reserve_rejects_over_user_quota(store, monkeypatch):
+    monkeypatch.setitem(metadata_index.FILE_STORE_CONFIG, 'user_quota', 100)
+
+    assert _reserve('u1/a.txt', 60) == (None, None)
+    quota_error, previous = _reserve('u1/b.txt', 50)
+
+    assert quota_error is not None
+    assert previous is None
+    assert metadata_index.get_object_record('files', 'u1/b.txt') is None
+    assert metadata_index.get_usage('u1')['files']['bytes'] == 60
+
+
+def test_reserve_rejects_over_bucket_quota(store, monkeypatch):
+    monkeypatch.setitem(metadata_index.FILE_STORE_CONFIG, 'bucket_quotas', {'avatars': 10})
+
+    assert _reserve('u1/a.png', 20)[0] is None
+    assert _reserve('u1/a.png', 20, bucket='avatars')[0] is not None
+
+
+def test_overwrite_only_checks_growth(store, monkeypatch):
+    monkeypatch.setitem(metadata_index.FILE_STORE_CONFIG, 'user_quota', 100)
+    _reserve('u1/a.txt', 90)
+
+    # 用量已接近配额时，缩小或等大覆盖仍然允许
+    quota_error, previous = _reserve('u1/a.txt', 80)
+    assert quota_error is None
+    assert previous['size'] == 90
+    assert _reserve('u1/a.txt', 120)[0] is not None
+
+
+def test_release_restores_previous_record(store):
+    _reserve('u1/a.txt', 10)
+    _, previous = _reserve('u1/a.txt', 30)
+    metadata_index.release_object('files', 'u1/a.txt', previous)
+    assert metadata_index.get_object_record('files', 'u1/a.txt')['size'] == 10
+    assert metadata_index.get_usage('u1')['files'] == {'bytes': 10, 'objects': 1}
+
+    _, previous = _reserve('u1/b.txt', 5)
+    metadata_index.release_object('files', 'u1/b.txt', previous)
+    assert metadata_index.get_object_record('files', 'u1/b.txt') is None
+    assert metadata_index.get_usage('u1')['files'] == {'bytes': 10, 'objects': 1}
+
+
+def test_concurrent_reservations_respect_quota(store, monkeypatch):
+    monkeypatch.setitem(metadata_index.FILE_STORE_CONFIG, 'user_quota', 100)
+    results = []
+    barrier = threading.Barrier(8)
+
+    def reserve(i):
+        barrier.wait()
+        results.append(_reserve(f'u1/{i}.txt', 30)[0])
+
+    threads = [threading.Thread(target=reserve, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(None) == 3
+    assert metadata_index.get_usage('u1')['files'] == {'bytes': 90, 'objects': 3}
+
+
+def test_list_objects_filters_owner_and_pages(store):
+    for object_key in ['u1/a', 'u1/b', 'u1/c', 'u2/a']:
+        metadata_index.upsert_object('files', object_key, 1, None, None)
+
+    items, marker = metadata_index.list_objects('files', owner='u1', limit=2)
+    assert [item['objectKey'] for item in items] == ['u1/a', 'u1/b']
+    items, marker = metadata_index.list_objects('files', owner='u1', limit=2, marker=marker)
+    assert [item['objectKey'] for item in items] == ['u1/c']
+    assert marker is None
@@ -0,0 +1,86 @@
+import io
+import os
+import hashlib
+import pytest
+
+import multipart_upload
+from multipart_upload import MultipartUploadError
+
+
+def _initiate(size):
+    return multipart_upload.initiate_upload('files', 'u1', 'a.bin', 'application/octet-stream', size)
+
+
+def test_parts_merge_in_order(store):
+    upload_id = _initiate(6)
+    multipart_upload.upload_part(upload_id, 2, io.BytesIO(b'def'))
+    multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'abc'))
+
+    manifest, tmp_path, size, sha256 = multipart_upload.complete_upload(upload_id, str(store))
+    with open(tmp_path, 'rb') as f:
+        assert f.read() == b'abcdef'
+    assert size == 6
+    assert sha256 == hashlib.sha256(b'abcdef').hexdigest()
+    assert manifest['filename'] == 'a.bin'
+
+
+def test_parts_cannot_exceed_declared_size(store):
+    upload_id = _initiate(5)
+    multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'abc'))
+
+    with pytest.raises(MultipartUploadError):
+        multipart_upload.upload_part(upload_id, 2, io.BytesIO(b'def'))
+    assert [part['partNumber'] for part in multipart_upload.list_parts(upload_id)] == [1]
+    upload_dir = multipart_upload.get_upload_dir(upload_id)
+    assert not [name for name in os.listdir(upload_dir) if name.endswith('.tmp')]
+
+
+def test_reuploaded_part_replaces_previous(store):
+    upload_id = _initiate(4)
+    multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'abcd'))
+    multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'wxyz'))
+
+    _, tmp_path, size, _ = multipart_upload.complete_upload(upload_id, str(store))
+    with open(tmp_path, 'rb') as f:
+        assert f.read() == b'wxyz'
+    assert size == 4
+
+
+def test_complete_rejects_size_mismatch(store):
+    upload_id = _initiate(6)
+    multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'abc'))
+
+    with pytest.raises(MultipartUploadError):
+        multipart_upload.complete_upload(upload_id, str(store))
+
+
+def test_complete_rejects_max_size(store, monkeypatch):
+    upload_id = _initiate(6)
+    multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'abcdef'))
+    monkeypatch.setitem(multipart_upload.FILE_STORE_CONFIG, 'max_size', 5)
+
+    with pytest.raises(MultipartUploadError):
+        multipart_upload.complete_upload(upload_id, str(store))
+
+
+def test_part_checksum_mismatch(store):
+    upload_id = _initiate(3)
+    with pytest.raises(MultipartUploadError):
+        multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'abc'), expected_sha256='0' * 64)
+    assert multipart_upload.list_parts(upload_id) == []
+
+
+def test_abort_removes_upload(store):
+    upload_id = _initiate(3)
+    multipart_upload.upload_part(upload_id, 1, io.BytesIO(b'abc'))
+    multipart_upload.abort_upload(upload_id)
+
+    with pytest.raises(MultipartUploadError) as excinfo:
+        multipart_upload.load_manifest(upload_id)
+    assert excinfo.value.code == 404
+
+
+def test_invalid_upload_id(store):
+    with pytest.raises(MultipartUploadError) as excinfo:
+        multipart_upload.get_upload_dir('../manifest')
+    assert excinfo.value.code == 404
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+训练断点模块
+
+按epoch保存完整训练状态（模型、优化器、学习率调度器、梯度缩放器、训练历史、随机数状态和最佳精度），
+任务失败或进程中断后重新训练时从最近一个有效断点继续。
+
+断点和模型文件由后台写入线程序列化并原子写入，训练线程只负责把状态复制到CPU
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import inspect
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 断点存储路径（断点不能放在文件服务公开的 file_store 目录下）
+CHECKPOINT_DIR = Path(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) / 'results' / 'checkpoints'
+
+# 旧版本的断点存储路径，读取任务断点时迁移到 CHECKPOINT_DIR
+LEGACY_CHECKPOINT_DIR = Path(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) / 'file_store/checkpoints'
+
+# 每个任务保留的最近断点数
+CHECKPOINT_KEEP = 2
+
+# 每个任务额外保留的验证准确率最高的断点数
+CHECKPOINT_KEEP_BEST = 1
+
+# 断点索引文件，记录各断点的epoch和验证准确率
+CHECKPOINT_INDEX_FILE = 'index.json'
+
+# 允许排队（含正在写入）的最大写入任务数，超出时训练线程阻塞，限制待写快照占用的内存
+WRITER_MAX_PENDING = 2
+
+# 断点格式版本
+CHECKPOINT_VERSION = 1
+
+# 断点中必须包含的字段
+REQUIRED_KEYS = ('version', 'epoch', 'model_name', 'num_classes', 'model_state_dict',
+                 'optimizer_state_dict', 'scheduler_state_dict', 'history', 'best_val_acc')
+
+def get_checkpoint_dir(task_id):
+    """
+    获取任务的断点目录，旧路径下有该任务的断点时先迁移
+
+    Args:
+        task_id (int): 训练任务ID
+
+    Returns:
+        Path: 断点目录
+    """
+    checkpoint_dir = CHECKPOINT_DIR / str(task_id)
+    legacy_dir = LEGACY_CHECKPOINT_DIR / str(task_id)
+    if legacy_dir.is_dir() and not checkpoint_dir.exists():
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        shutil.move(str(legacy_dir), str(checkpoint_dir))
+        logger.info(f"任务 {task_id} 的断点已迁移到 {checkpoint_dir}")
+    return checkpoint_dir
+
+def list_checkpoints(task_id):
+    """
+    列出任务的断点文件，按epoch从新到旧排列
+
+    Args:
+        task_id (int): 训练任务ID
+
+    Returns:
+        list: 断点文件路径列表
+    """
+    checkpoint_dir = get_checkpoint_dir(task_id)
+    if not checkpoint_dir.exists():
+        return []
+    return sorted(checkpoint_dir.glob('checkpoint_epoch*.pt'), reverse=True)
+
+def state_to_cpu(state):
+    """
+    复制状态中的全部张量到CPU
+
+    Args:
+        state: 状态字典，可以嵌套字典、列表和元组
+
+    Returns:
+        与输入结构相同、张量位于CPU且与训练中的参数不共享存储的副本
+    """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {k: state_to_cpu(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(state_to_cpu(v) for v in state)
+    return state
+
+# torch 1.13 起 torch.load 支持 weights_only，只还原张量和基本类型，断点文件不能借反序列化执行代码；
+# 更早的版本没有该参数，按原方式加载
+TORCH_LOAD_KWARGS = {'weights_only': True} if 'weights_only' in inspect.signature(torch.load).parameters else {}
+
+def capture_rng_state():
+    """
+    获取各随机数生成器的状态
+
+    numpy状态转换为列表保存，断点文件只包含张量和基本类型
+
+    Returns:
+        dict: 随机数状态
+    """
+    np_state = np.random.get_state()
+    state = {
+        'python': random.getstate(),
+        'numpy': [np_state[0], np_state[1].tolist(), np_state[2], np_state[3], np_state[4]],
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def restore_rng_state(state):
+    """
+    恢复各随机数生成器的状态
+
+    Args:
+        state (dict): capture_rng_state 返回的随机数状态
+    """
+    python_state = state['python']
+    random.setstate((python_state[0], tuple(python_state[1]), python_state[2]))
+    np_state = state['numpy']
+    np.random.set_state((np_state[0], np.array(np_state[1], dtype=np.uint32), np_state[2], np_state[3], np_state[4]))
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available() and len(state['cuda']) == torch.cuda.device_count():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def atomic_save(obj, path):
+    """
+    序列化并原子写入文件
+
+    先写入同目录下的临时文件再重命名，进程在写入过程中退出不会留下不完整的文件
+
+    Args:
+        obj: 要保存的对象
+        path (Path): 保存路径
+
+    Returns:
+        int: 文件大小（字节）
+    """
+    path = Path(path)
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        torch.save(obj, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        raise
+    return path.stat().st_size
+
+def select_retained(entries, keep_last, keep_best=0):
+    """
+    选出需要保留的文件：最近 keep_last 个以及指标最高的 keep_best 个
+
+    Args:
+        entries (list): (名称, epoch, 指标) 列表，指标可以为None
+        keep_last (int): 保留的最近文件数
+        keep_best (int): 保留的指标最高的文件数
+
+    Returns:
+        set: 需要保留的名称
+    """
+    by_epoch = sorted(entries, key=lambda e: e[1], reverse=True)
+    retained = set(name for name, _, _ in by_epoch[:keep_last])
+    scored = [e for e in entries if e[2] is not None]
+    by_metric = sorted(scored, key=lambda e: (e[2], e[1]), reverse=True)
+    retained.update(name for name, _, _ in by_metric[:keep_best])
+    return retained
+
+def _read_index(checkpoint_dir):
+    """
+    读取断点索引，文件缺失或损坏时返回空索引
+    """
+    try:
+        with open(checkpoint_dir / CHECKPOINT_INDEX_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_checkpoint(state, task_id, metric=None, keep=CHECKPOINT_KEEP, keep_best=CHECKPOINT_KEEP_BEST):
+    """
+    保存断点
+
+    原子写入断点文件，保存后只保留最近 keep 个断点以及验证准确率最高的 keep_best 个断点
+
+    Args:
+        state (dict): 训练状态，必须包含 REQUIRED_KEYS 中的字段
+        task_id (int): 训练任务ID
+        metric (float, optional): 本断点的验证准确率
+        keep (int): 保留的最近断点数
+        keep_best (int): 保留的最佳断点数
+
+    Returns:
+        int: 断点文件大小（字节）
+    """
+    try:
+        checkpoint_dir = get_checkpoint_dir(task_id)
+        checkpoint_path = checkpoint_dir / f"checkpoint_epoch{state['epoch']:04d}.pt"
+        size = atomic_save(dict(state, version=CHECKPOINT_VERSION), checkpoint_path)
+
+        # 更新索引并淘汰多余的断点
+        index = _read_index(checkpoint_dir)
+        index[checkpoint_path.name] = {'epoch': state['epoch'], 'metric': metric}
+        existing = set(p.name for p in list_checkpoints(task_id))
+        entries = [(name, info['epoch'], info.get('metric')) for name, info in index.items() if name in existing]
+        entries += [(name, -1, None) for name in existing if name not in index]
+        retained = select_retained(entries, keep, keep_best)
+        for name in existing - retained:
+            os.remove(checkpoint_dir / name)
+        index = {name: info for name, info in index.items() if name in retained}
+        with open(checkpoint_dir / f".{CHECKPOINT_INDEX_FILE}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(checkpoint_dir / f".{CHECKPOINT_INDEX_FILE}.tmp", checkpoint_dir / CHECKPOINT_INDEX_FILE)
+        return size
+    except Exception as e:
+        logger.error(f"保存断点失败: {str(e)}")
+        raise
+
+def load_latest_checkpoint(task_id, model_name, num_classes):
+    """
+    加载最近一个有效断点
+
+    从新到旧依次尝试，跳过无法读取、字段不完整或与当前模型不匹配的断点
+
+    Args:
+        task_id (int): 训练任务ID
+        model_name (str): 模型名称
+        num_classes (int): 类别数量
+
+    Returns:
+        dict: 断点内容，没有有效断点时返回None
+    """
+    for checkpoint_path in list_checkpoints(task_id):
+        try:
+            state = torch.load(checkpoint_path, map_location='cpu', **TORCH_LOAD_KWARGS)
+        except Exception as e:
+            logger.warning(f"断点文件无法读取，跳过 {checkpoint_path}: {str(e)}")
+            continue
+        if not isinstance(state, dict) or any(key not in state for key in REQUIRED_KEYS):
+            logger.warning(f"断点文件不完整，跳过: {checkpoint_path}")
+            continue
+        if state['version'] != CHECKPOINT_VERSION or state['model_name'] != model_name or state['num_classes'] != num_classes:
+            logger.warning(f"断点与当前训练配置不匹配，跳过: {checkpoint_path}")
+            continue
+        logger.info(f"找到有效断点: {checkpoint_path}（已完成 {state['epoch']} 轮）")
+        return state
+    return None
+
+def remove_checkpoints(task_id):
+    """
+    删除任务的全部断点
+
+    Args:
+        task_id (int): 训练任务ID
+    """
+    checkpoint_dir = get_checkpoint_dir(task_id)
+    if checkpoint_dir.exists():
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        logger.info(f"已删除任务 {task_id} 的断点")
+
+class CheckpointWriter:
+    """
+    后台断点写入队列
+
+    所有写入在同一个线程中按提交顺序执行，同一任务的文件不会乱序覆盖；
+    等待中的任务数达到上限时提交方阻塞。按任务统计快照耗时和写入耗时
+    """
+    def __init__(self, max_pending=WRITER_MAX_PENDING):
+        """
+        初始化写入队列
+
+        Args:
+            max_pending (int): 允许排队（含正在写入）的最大任务数
+        """
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-writer')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stats = {}
+
+    def _get_stats(self, task_id):
+        return self._stats.setdefault(task_id, {
+            'writes': 0, 'errors': 0, 'bytes': 0,
+            'write_seconds': 0.0, 'max_write_seconds': 0.0, 'last_write_seconds': 0.0,
+            'snapshots': 0, 'snapshot_seconds': 0.0
+        })
+
+    def record_snapshot(self, task_id, seconds):
+        """
+        记录训练线程复制状态的耗时
+
+        Args:
+            task_id (int): 训练任务ID
+            seconds (float): 耗时（秒）
+        """
+        with self._lock:
+            stats = self._get_stats(task_id)
+            stats['snapshots'] += 1
+            stats['snapshot_seconds'] += seconds
+
+    def _run(self, task_id, write_fn, args):
+        """
+        执行写入并记录耗时（在写入线程中执行）
+        """
+        start = time.perf_counter()
+        try:
+            size = write_fn(*args)
+        except Exception:
+            with self._lock:
+                self._get_stats(task_id)['errors'] += 1
+            raise
+        seconds = time.perf_counter() - start
+        with self._lock:
+            stats = self._get_stats(task_id)
+            stats['writes'] += 1
+            stats['bytes'] += size or 0
+            stats['write_seconds'] += seconds
+            stats['last_write_seconds'] = seconds
+            stats['max_write_seconds'] = max(stats['max_write_seconds'], seconds)
+        return size
+
+    def submit(self, task_id, write_fn, *args):
+        """
+        提交写入任务
+
+        Args:
+            task_id (int): 训练任务ID，用于分组统计和等待
+            write_fn (callable): 写入函数，返回写入的字节数
+            *args: 写入函数的参数
+
+        Returns:
+            concurrent.futures.Future: 结果为写入的字节数
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, task_id, write_fn, args)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.setdefault(task_id, set()).add(future)
+
+        def on_done(f):
+            self._slots.release()
+            with self._lock:
+                pending = self._pending.get(task_id)
+                if pending is not None:
+                    pending.discard(f)
+                    if not pending:
+                        self._pending.pop(task_id, None)
+            if f.exception() is not None:
+                logger.error(f"后台写入失败（任务 {task_id}）: {str(f.exception())}")
+
+        future.add_done_callback(on_done)
+        return future
+
+    def flush(self, task_id, timeout=None):
+        """
+        等待任务已提交的写入全部完成
+
+        Args:
+            task_id (int): 训练任务ID
+            timeout (float, optional): 最长等待秒数
+
+        Returns:
+            list: 写入失败的异常
+        """
+        with self._lock:
+            pending = list(self._pending.get(task_id, ()))
+        done, _ = wait_futures(pending, timeout=timeout)
+        return [f.exception() for f in done if f.exception() is not None]
+
+    def metrics(self, task_id=None):
+        """
+        获取写入统计
+
+        Args:
+            task_id (int, optional): 训练任务ID，为None时返回全部任务的统计
+
+        Returns:
+            dict: 写入次数、失败次数、字节数、总/平均/最大/最近写入耗时以及快照次数和耗时
+        """
+        with self._lock:
+            if task_id is None:
+                return {str(k): self._summarize(v) for k, v in self._stats.items()}
+            return self._summarize(self._stats.get(task_id) or self._get_stats(task_id))
+
+    @staticmethod
+    def _summarize(stats):
+        result = dict(stats)
+        result['avg_write_seconds'] = stats['write_seconds'] / stats['writes'] if stats['writes'] else 0.0
+        result['avg_snapshot_seconds'] = stats['snapshot_seconds'] / stats['snapshots'] if stats['snapshots'] else 0.0
+        return result
+
+# 进程内共享的断点写入队列
+checkpoint_writer = CheckpointWriter()
+
+def submit_checkpoint(state, task_id, metric=None):
+    """
+    提交断点到后台写入队列
+
+    Args:
+        state (dict): 训练状态，张量需已复制到CPU
+        task_id (int): 训练任务ID
+        metric (float, optional): 本断点的验证准确率
+
+    Returns:
+        concurrent.futures.Future: 写入任务
+    """
+    return checkpoint_writer.submit(task_id, save_checkpoint, state, task_id, metric)
@@ -12,7 +12,8 @@ import torch
 import time
 from pathlib import Path
 from .model_loader import load_model, get_default_model
-from .preprocessing import ImagePreprocessor
+from .preprocessing import ImagePreprocessor, shared_image_cache
+from utils.image_utils import save_class_map, CLASS_MAP_NODATA
 
 logger = logging.getLogger(__name__)
 
@@ -57,8 +58,8 @@ class RemoteSensingClassifier:
         self.model = load_model(model_name)
         self.model.to(self.device)
         
-        # 创建预处理器
-        self.preprocessor = ImagePreprocessor()
+        # 创建预处理器，共享进程内解码缓存，避免重复解码同一影像
+        self.preprocessor = ImagePreprocessor(cache=shared_image_cache)
     
     def predict(self, image_path):
         """
@@ -74,8 +75,8 @@ class RemoteSensingClassifier:
             # 记录开始时间
             start_time = time.time()
             
-            # 读取并预处理图像
-            image = self.preprocessor.read_image(image_path)
+            # 读取并预处理图像，大图按目标大小降采样解码
+            image = self.preprocessor.read_image(image_path, target_size=self.preprocessor.image_size)
             tensor_image = self.preprocessor.preprocess(image)
             
             # 添加批次维度
@@ -151,7 +152,7 @@ class RemoteSensingClassifier:
             logger.error(f"批量预测失败: {str(e)}")
             raise
     
-    def segment(self, image_path, tile_size=256, overlap=32):
+    def segment(self, image_path, tile_size=256, overlap=32, class_map_path=None):
         """
         对大型遥感影像进行分割分类
         
@@ -161,6 +162,7 @@ class RemoteSensingClassifier:
             image_path (str): 影像文件路径
             tile_size (int): 分割块大小
             overlap (int): 重叠像素数
+            class_map_path (str, optional): 类别图保存路径，提供时将分块预测结果保存为GeoTIFF类别图
             
         Returns:
             dict: 分割分类结果
@@ -178,6 +180,9 @@ class RemoteSensingClassifier:
             # 存储每个类别的像素数
             class_pixels = {class_id: 0 for class_id in CLASS_MAPPING.keys()}
             
+            # 分块类别图，每个单元对应一个分割块
+            class_grid = np.full((h_tiles, w_tiles), CLASS_MAP_NODATA, dtype=np.uint8)
+            
             # 分割并预测
             for h in range(h_tiles):
                 for w in range(w_tiles):
@@ -211,6 +216,7 @@ class RemoteSensingClassifier:
                     # 累计像素数
                     tile_pixels = (h_end - h_start) * (w_end - w_start)
                     class_pixels[predicted_class] += tile_pixels
+                    class_grid[h, w] = predicted_class
             
             # 计算每个类别的面积占比
             total_pixels = height * width
@@ -226,7 +232,7 @@ class RemoteSensingClassifier:
             main_class_percentage = (class_pixels[main_class_id] / total_pixels) * 100
             
             # 返回结果
-            return {
+            result = {
                 'main_class': {
                     'class_id': main_class_id,
                     'class_name': main_class_name,
@@ -235,6 +241,14 @@ class RemoteSensingClassifier:
                 'class_distribution': class_percentages
             }
             
+            # 保存类别图，供地图瓦片服务渲染
+            if class_map_path is not None:
+                save_class_map(class_grid, class_map_path, cell_size=stride, source_size=(width, height),
+                               source_path=image_path)
+                result['class_map_file'] = Path(class_map_path).name
+            
+            return result
+            
         except Exception as e:
             logger.error(f"分割分类失败: {str(e)}")
             raise
\ No newline at end of file
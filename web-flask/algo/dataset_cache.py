@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+训练数据集预解码缓存模块
+
+训练开始前把数据集中的影像一次性解码并缩放为固定尺寸，写入uint8内存映射数组和标签数组，
+之后的每个epoch以及同一数据集的后续训练任务直接从内存映射中读取，不再重复解码。
+缓存以数据集内容哈希和目标尺寸为键，多个加载进程通过操作系统页缓存共享同一份数据
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import uuid
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# 缓存目录
+DATASET_CACHE_DIR = Path(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) / 'results' / 'dataset_cache'
+
+# 缓存总大小上限，超出后按最近使用时间淘汰
+DATASET_CACHE_MAX_BYTES = 20 * 1024 * 1024 * 1024
+
+# 使用中的缓存的租约有效期（秒），训练任务每个epoch刷新一次，
+# 超过该时间未刷新视为任务已异常退出，不再阻止淘汰
+LEASE_TIMEOUT = 6 * 3600
+
+# 默认目标尺寸 (高度, 宽度)，与训练和验证变换的缩放尺寸一致
+DEFAULT_IMAGE_SIZE = (256, 256)
+
+# 解码线程数（OpenCV解码时释放GIL）
+DECODE_WORKERS = min(8, os.cpu_count() or 1)
+
+# 计算文件哈希时的读取块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+IMAGES_FILE = 'images.npy'
+LABELS_FILE = 'labels.npy'
+META_FILE = 'meta.json'
+LEASE_DIR = 'leases'
+
+def file_digest(path):
+    """
+    计算文件内容的SHA-256哈希值
+
+    Args:
+        path (str): 文件路径
+
+    Returns:
+        str: 哈希值
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def dataset_digest(file_hashes, labels, image_size):
+    """
+    计算数据集缓存键
+
+    只与文件内容、标签和目标尺寸有关，与文件路径和文件顺序无关，
+    同一数据集每次解压到不同的临时目录也能命中缓存
+
+    Args:
+        file_hashes (list): 各影像文件的内容哈希
+        labels (list): 各影像的标签
+        image_size (tuple): 目标尺寸 (高度, 宽度)
+
+    Returns:
+        str: 缓存键
+    """
+    h = hashlib.sha256()
+    h.update(f"{image_size[0]}x{image_size[1]}\n".encode('utf-8'))
+    for file_hash, label in sorted(zip(file_hashes, (int(l) for l in labels))):
+        h.update(f"{file_hash}:{label}\n".encode('utf-8'))
+    return h.hexdigest()
+
+def _decode_resized(image_path, image_size):
+    """
+    解码影像并缩放为目标尺寸（在解码线程中执行）
+
+    Args:
+        image_path (str): 影像文件路径
+        image_size (tuple): 目标尺寸 (高度, 宽度)
+
+    Returns:
+        numpy.ndarray: RGB图像，形状为 (H, W, 3)，解码失败时返回None
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        return None
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if image.shape[:2] != tuple(image_size):
+        image = cv2.resize(image, (image_size[1], image_size[0]), interpolation=cv2.INTER_AREA)
+    return image
+
+class MmapDatasetCache:
+    """
+    预解码数据集缓存
+
+    对象可以安全地传给DataLoader加载进程：内存映射在每个进程首次读取时才打开，
+    不会随数据集一起被序列化。持有租约期间缓存不会被淘汰，使用结束后调用 release 释放
+    """
+    def __init__(self, cache_dir, rows, lease_path=None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir (Path): 缓存目录
+            rows (numpy.ndarray): 数据集样本索引到缓存行号的映射
+            lease_path (Path, optional): 租约文件路径
+        """
+        self.cache_dir = Path(cache_dir)
+        self.rows = rows
+        self.lease_path = lease_path
+        self._images = None
+        self._labels = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        state['_labels'] = None
+        return state
+
+    def _open(self):
+        """
+        以只读方式打开内存映射
+        """
+        self._images = np.load(self.cache_dir / IMAGES_FILE, mmap_mode='r')
+        self._labels = np.load(self.cache_dir / LABELS_FILE, mmap_mode='r')
+
+    def get(self, idx):
+        """
+        读取样本
+
+        Args:
+            idx (int): 数据集样本索引
+
+        Returns:
+            tuple: (RGB图像, 标签)，图像为可写的副本，形状为 (H, W, 3)
+        """
+        if self._images is None:
+            self._open()
+        row = self.rows[idx]
+        return np.array(self._images[row]), int(self._labels[row])
+
+    def refresh(self):
+        """
+        刷新租约和最近使用时间，训练过程中每个epoch调用一次
+        """
+        _touch(self.cache_dir)
+        if self.lease_path is not None:
+            _touch_lease(self.lease_path)
+
+    def release(self):
+        """
+        释放租约，之后缓存可以被淘汰
+        """
+        if self.lease_path is None:
+            return
+        try:
+            os.remove(self.lease_path)
+        except OSError:
+            pass
+        self.lease_path = None
+
+def _touch(cache_dir):
+    """
+    更新缓存的最近使用时间
+    """
+    try:
+        os.utime(cache_dir / META_FILE)
+    except OSError:
+        pass
+
+def _touch_lease(lease_path):
+    """
+    刷新租约文件的修改时间
+    """
+    try:
+        os.utime(lease_path)
+    except OSError:
+        pass
+
+def _acquire_lease(cache_dir):
+    """
+    在缓存目录下创建租约文件
+
+    Args:
+        cache_dir (Path): 缓存目录
+
+    Returns:
+        Path: 租约文件路径，缓存目录不存在时返回None
+    """
+    lease_dir = cache_dir / LEASE_DIR
+    try:
+        lease_dir.mkdir(exist_ok=True)
+        lease_path = lease_dir / f"{os.getpid()}-{uuid.uuid4().hex}"
+        lease_path.touch()
+        return lease_path
+    except OSError:
+        return None
+
+def _in_use(cache_dir):
+    """
+    判断缓存是否持有未过期的租约
+    """
+    lease_dir = cache_dir / LEASE_DIR
+    if not lease_dir.is_dir():
+        return False
+    deadline = time.time() - LEASE_TIMEOUT
+    for lease_path in lease_dir.iterdir():
+        try:
+            if lease_path.stat().st_mtime > deadline:
+                return True
+        except OSError:
+            continue
+    return False
+
+def _cache_size(cache_dir):
+    """
+    计算缓存目录占用的字节数
+    """
+    return sum(f.stat().st_size for f in cache_dir.iterdir() if f.is_file())
+
+def prune_dataset_caches(max_bytes=DATASET_CACHE_MAX_BYTES, keep=None):
+    """
+    按最近使用时间淘汰缓存，直到总大小不超过上限。其他任务正在使用（持有未过期租约）的缓存不会被淘汰
+
+    Args:
+        max_bytes (int): 缓存总大小上限
+        keep (str, optional): 不淘汰的缓存键
+    """
+    if not DATASET_CACHE_DIR.exists():
+        return
+    entries = []
+    for cache_dir in DATASET_CACHE_DIR.iterdir():
+        meta_path = cache_dir / META_FILE
+        if not cache_dir.is_dir() or not meta_path.exists():
+            continue
+        entries.append((meta_path.stat().st_mtime, cache_dir, _cache_size(cache_dir)))
+
+    total = sum(size for _, _, size in entries)
+    for _, cache_dir, size in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        if cache_dir.name == keep or _in_use(cache_dir):
+            continue
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        total -= size
+        logger.info(f"已淘汰数据集缓存: {cache_dir.name}")
+
+def _build(cache_dir, image_paths, labels, order, image_size):
+    """
+    解码数据集并写入缓存目录
+
+    Args:
+        cache_dir (Path): 缓存目录
+        image_paths (list): 影像路径列表
+        labels (list): 标签列表
+        order (list): 按缓存行号排列的样本索引
+        image_size (tuple): 目标尺寸 (高度, 宽度)
+    """
+    DATASET_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    build_dir = Path(tempfile.mkdtemp(prefix=f".{cache_dir.name}-", dir=DATASET_CACHE_DIR))
+    try:
+        images = np.lib.format.open_memmap(build_dir / IMAGES_FILE, mode='w+', dtype=np.uint8,
+                                           shape=(len(order), image_size[0], image_size[1], 3))
+        failed = 0
+        with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as executor:
+            decoded = executor.map(lambda i: _decode_resized(image_paths[i], image_size), order)
+            for row, image in enumerate(decoded):
+                if image is None:
+                    logger.warning(f"读取图像失败 {image_paths[order[row]]}，缓存中使用空图像")
+                    failed += 1
+                    continue
+                images[row] = image
+        images.flush()
+        del images
+
+        np.save(build_dir / LABELS_FILE, np.array([labels[i] for i in order], dtype=np.int64))
+        with open(build_dir / META_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'count': len(order),
+                'image_size': list(image_size),
+                'failed': failed,
+                'created_at': time.time()
+            }, f)
+
+        try:
+            os.rename(build_dir, cache_dir)
+        except OSError:
+            # 其他任务已经生成了同一缓存
+            shutil.rmtree(build_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+def open_dataset_cache(image_paths, labels, image_size=DEFAULT_IMAGE_SIZE):
+    """
+    打开数据集的预解码缓存，缓存不存在时先解码生成
+
+    Args:
+        image_paths (list): 影像路径列表
+        labels (list): 标签列表（数值索引）
+        image_size (tuple): 目标尺寸 (高度, 宽度)
+
+    Returns:
+        MmapDatasetCache: 预解码缓存，持有租约，使用结束后需调用 release
+    """
+    try:
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as executor:
+            file_hashes = list(executor.map(file_digest, image_paths))
+        digest = dataset_digest(file_hashes, labels, image_size)
+        cache_dir = DATASET_CACHE_DIR / digest
+
+        # 缓存行按 (文件哈希, 标签) 排序，与样本顺序无关
+        order = sorted(range(len(image_paths)), key=lambda i: (file_hashes[i], int(labels[i])))
+        rows = np.empty(len(order), dtype=np.int64)
+        rows[order] = np.arange(len(order), dtype=np.int64)
+
+        # 先取得租约再确认缓存存在，避免检查之后被其他任务淘汰
+        lease_path = _acquire_lease(cache_dir) if cache_dir.exists() else None
+        if lease_path is not None and (cache_dir / META_FILE).exists():
+            _touch(cache_dir)
+            logger.info(f"命中数据集缓存 {digest}，共 {len(order)} 张图像")
+        else:
+            if cache_dir.exists():
+                # 淘汰过程中被中断留下的残缺目录
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            logger.info(f"生成数据集缓存 {digest}，共 {len(order)} 张图像")
+            _build(cache_dir, image_paths, [int(l) for l in labels], order, image_size)
+            lease_path = _acquire_lease(cache_dir)
+            logger.info(f"数据集缓存生成完成，耗时: {time.time() - start:.2f}秒")
+            prune_dataset_caches(keep=digest)
+        return MmapDatasetCache(cache_dir, rows, lease_path)
+    except Exception as e:
+        logger.error(f"打开数据集缓存失败: {str(e)}")
+        raise
@@ -7,64 +7,267 @@
 
 import os
 import logging
+import threading
+from collections import OrderedDict
 import numpy as np
 import cv2
 from pathlib import Path
 from osgeo import gdal
+from PIL import Image
 import torch
+import torch.nn.functional as F
 from torchvision import transforms
 
 logger = logging.getLogger(__name__)
 
+# 解码缓存默认字节预算
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 读取的波段配置（前三个波段，输出RGB三通道）
+DEFAULT_BAND_CONFIG = ('RGB', 3)
+
+# OpenCV降采样解码模式，键为缩小倍数
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+# ImageNet标准化参数
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+class DecodedImageCache:
+    """
+    解码影像LRU缓存
+
+    以 (文件路径, 修改时间, 文件大小, 波段配置) 为键缓存解码后的数组，
+    按字节预算做LRU淘汰。缓存中的数组被设为只读，返回只读视图以防止调用方修改缓存内容。
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        """
+        初始化缓存
+
+        Args:
+            max_bytes (int): 缓存字节预算，超出后按最近最少使用顺序淘汰
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(image_path, band_config):
+        """
+        生成缓存键
+
+        Args:
+            image_path (str): 影像文件路径
+            band_config (tuple): 波段配置
+
+        Returns:
+            tuple: 缓存键，文件被修改后键随之变化
+        """
+        stat = os.stat(image_path)
+        return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, band_config)
+
+    def get(self, key):
+        """
+        查询缓存
+
+        Args:
+            key (tuple): 缓存键
+
+        Returns:
+            numpy.ndarray: 只读视图，未命中时返回None
+        """
+        with self._lock:
+            array = self._entries.get(key)
+            if array is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return array.view()
+
+    def put(self, key, array):
+        """
+        写入缓存
+
+        Args:
+            key (tuple): 缓存键
+            array (numpy.ndarray): 解码后的数组
+
+        Returns:
+            numpy.ndarray: 只读视图
+        """
+        array.setflags(write=False)
+        nbytes = array.nbytes
+        if nbytes > self.max_bytes:
+            # 单个数组超出预算，不缓存
+            return array.view()
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._current_bytes -= old.nbytes
+            self._entries[key] = array
+            self._current_bytes += nbytes
+
+            # 按LRU顺序淘汰直到满足预算
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= evicted.nbytes
+                self._evictions += 1
+
+        return array.view()
+
+    def get_or_load(self, image_path, loader, band_config=DEFAULT_BAND_CONFIG):
+        """
+        获取解码后的影像，未命中时调用loader解码并写入缓存
+
+        Args:
+            image_path (str): 影像文件路径
+            loader (callable): 解码函数，参数为影像路径，返回numpy数组
+            band_config (tuple): 波段配置，作为缓存键的一部分
+
+        Returns:
+            numpy.ndarray: 只读的影像数组
+        """
+        key = self.make_key(image_path, band_config)
+        array = self.get(key)
+        if array is not None:
+            return array
+        return self.put(key, loader(image_path))
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        Returns:
+            dict: 命中次数、未命中次数、命中率、淘汰次数及占用字节数
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'current_bytes': self._current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+# 进程内共享的解码缓存
+shared_image_cache = DecodedImageCache()
+
 class ImagePreprocessor:
     """
     遥感影像预处理器
     """
-    def __init__(self, image_size=(256, 256)):
+    def __init__(self, image_size=(256, 256), cache=None):
         """
         初始化预处理器
         
         Args:
             image_size (tuple): 图像调整大小 (高度, 宽度)
+            cache (DecodedImageCache, optional): 解码缓存，为None时不缓存
         """
         self.image_size = image_size
+        self.cache = cache
         
         # 定义标准化变换
         self.transform = transforms.Compose([
             transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+            transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD)
         ])
+        
+        # 批量标准化使用的广播张量，形状为 (1, C, 1, 1)
+        self.mean = torch.tensor(NORMALIZE_MEAN, dtype=torch.float32).view(1, -1, 1, 1)
+        self.std = torch.tensor(NORMALIZE_STD, dtype=torch.float32).view(1, -1, 1, 1)
     
-    def read_image(self, image_path):
+    def read_image(self, image_path, target_size=None):
         """
         读取遥感影像文件
         
-        支持常见的遥感影像格式，如TIFF、IMG等
+        支持常见的遥感影像格式，如TIFF、IMG等。配置了缓存时返回的数组为只读。
         
         Args:
             image_path (str): 影像文件路径
+            target_size (tuple, optional): 后续预处理的目标大小，与 image_size 含义相同。
+                提供时，远大于目标大小的JPEG/PNG会以降采样模式解码；分块分割等需要原始分辨率的场景不要提供
             
         Returns:
-            numpy.ndarray: 读取的影像数据
+            numpy.ndarray: 读取的影像数据，uint8类型
         """
         try:
             file_ext = Path(image_path).suffix.lower()
             
             # 使用GDAL读取遥感影像
             if file_ext in ['.tif', '.tiff', '.img']:
-                return self._read_with_gdal(image_path)
+                reader = 'gdal'
+                loader = self._read_with_gdal
             
             # 使用OpenCV读取普通图像
             elif file_ext in ['.jpg', '.jpeg', '.png']:
-                return self._read_with_opencv(image_path)
+                reduce_factor = 1
+                if target_size is not None:
+                    reduce_factor = self._choose_reduce_factor(image_path, target_size)
+                reader = f'opencv_1/{reduce_factor}'
+                loader = lambda path: self._read_with_opencv(path, reduce_factor=reduce_factor)
             
             else:
                 raise ValueError(f"不支持的文件格式: {file_ext}")
+            
+            if self.cache is None:
+                return loader(image_path)
+            
+            # 通过缓存读取，返回只读数组
+            return self.cache.get_or_load(image_path, loader, band_config=(reader,) + DEFAULT_BAND_CONFIG)
                 
         except Exception as e:
             logger.error(f"读取影像文件失败: {str(e)}")
             raise
     
+    @staticmethod
+    def _choose_reduce_factor(image_path, target_size):
+        """
+        根据文件头中的图像尺寸选择降采样解码倍数
+        
+        选择使解码结果仍不小于目标大小的最大倍数，只读取文件头，不解码像素
+        
+        Args:
+            image_path (str): 图像文件路径
+            target_size (tuple): 目标大小，与 cv2.resize 的 dsize 一致 (宽度, 高度)
+            
+        Returns:
+            int: 缩小倍数，1表示原始分辨率解码
+        """
+        try:
+            with Image.open(image_path) as img:
+                width, height = img.size
+        except Exception as e:
+            logger.warning(f"读取图像文件头失败，使用原始分辨率解码: {str(e)}")
+            return 1
+        
+        target_w, target_h = target_size
+        for factor in sorted(REDUCED_DECODE_FLAGS, reverse=True):
+            if width // factor >= target_w and height // factor >= target_h:
+                return factor
+        return 1
+    
     def _read_with_gdal(self, image_path):
         """
         使用GDAL读取遥感影像
@@ -108,35 +311,33 @@ class ImagePreprocessor:
             logger.error(f"GDAL读取影像失败: {str(e)}")
             raise
     
-    def _read_with_opencv(self, image_path):
+    def _read_with_opencv(self, image_path, reduce_factor=1):
         """
         使用OpenCV读取普通图像
         
         Args:
             image_path (str): 图像文件路径
+            reduce_factor (int): 降采样解码倍数（1、2、4或8），JPEG可在解码阶段直接缩小
             
         Returns:
-            numpy.ndarray: 读取的图像数据，形状为 (H, W, C)
+            numpy.ndarray: 读取的图像数据，形状为 (H, W, C)，uint8类型，归一化推迟到预处理阶段
         """
         try:
             # 读取图像
-            image = cv2.imread(image_path)
+            flags = REDUCED_DECODE_FLAGS.get(reduce_factor, cv2.IMREAD_COLOR)
+            image = cv2.imread(image_path, flags)
             if image is None:
                 raise IOError(f"无法打开图像文件: {image_path}")
             
-            # 转换为RGB格式
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # 确保图像为3通道
+            # 确保图像为3通道并转换为RGB格式
             if len(image.shape) == 2:
                 image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
             elif image.shape[2] == 1:
                 image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
             elif image.shape[2] == 4:
                 image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
-            
-            # 归一化到0-1范围
-            image = image.astype(np.float32) / 255.0
+            else:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             
             return image
             
@@ -167,19 +368,87 @@ class ImagePreprocessor:
             logger.error(f"图像预处理失败: {str(e)}")
             raise
     
-    def batch_preprocess(self, images):
+    @staticmethod
+    def _batch_resize(tensor, size):
+        """
+        双线性缩放一批图像
+        
+        uint8输入优先直接缩放（与cv2对uint8的处理一致）；当前PyTorch版本不支持时转换为float后缩放
+        
+        Args:
+            tensor (torch.Tensor): 图像批次，形状为 (N, C, H, W)
+            size (tuple): 目标大小 (高度, 宽度)
+            
+        Returns:
+            torch.Tensor: 缩放后的图像批次
+        """
+        if tensor.dtype == torch.uint8:
+            try:
+                return F.interpolate(tensor, size=size, mode='bilinear', align_corners=False)
+            except RuntimeError:
+                tensor = tensor.float()
+        return F.interpolate(tensor, size=size, mode='bilinear', align_corners=False)
+    
+    def batch_preprocess(self, images, device=None):
         """
         批量预处理图像
         
+        将形状和数据类型相同的图像分为一组，每组只调用一次 interpolate 完成缩放，
+        并以一次广播运算完成标准化，结果与逐张调用 preprocess 一致。
+        
         Args:
             images (list): 输入图像列表
+            device (torch.device, optional): 执行缩放和标准化的设备，默认为CPU
             
         Returns:
             torch.Tensor: 预处理后的图像张量批次，形状为 (B, C, H, W)
         """
         try:
-            processed_images = [self.preprocess(img) for img in images]
-            return torch.stack(processed_images)
+            if len(images) == 0:
+                raise ValueError("输入图像列表为空")
+            
+            # 按形状和数据类型分组，记录原始顺序
+            groups = {}
+            for idx, img in enumerate(images):
+                groups.setdefault((img.shape, img.dtype), []).append(idx)
+            
+            # 与 cv2.resize(image, self.image_size) 的输出尺寸保持一致
+            out_h, out_w = self.image_size[1], self.image_size[0]
+            mean = self.mean.to(device) if device is not None else self.mean
+            std = self.std.to(device) if device is not None else self.std
+            
+            batch = None
+            for (shape, dtype), indices in groups.items():
+                stacked = np.stack([images[i] for i in indices])
+                if stacked.ndim == 3:
+                    stacked = stacked[..., np.newaxis]
+                
+                # (N, H, W, C) -> (N, C, H, W)，保持channels_last内存布局，避免额外拷贝
+                tensor = torch.from_numpy(stacked)
+                if device is not None:
+                    tensor = tensor.to(device)
+                tensor = tensor.permute(0, 3, 1, 2)
+                
+                # 整组一次缩放，先缩放再转换为float以减少转换的数据量
+                if shape[:2] != (out_h, out_w):
+                    tensor = self._batch_resize(tensor, (out_h, out_w))
+                tensor = tensor.to(torch.float32, memory_format=torch.contiguous_format)
+                
+                # 广播标准化；与 ToTensor 保持一致，仅对uint8输入缩放到0-1，并与标准化合并为一次乘加
+                if dtype == np.uint8:
+                    tensor = tensor.mul_(1.0 / (255.0 * std)).sub_(mean / std)
+                else:
+                    tensor = tensor.sub_(mean).div_(std)
+                
+                # 所有图像同组时直接返回，避免再拷贝一次
+                if len(groups) == 1:
+                    return tensor
+                
+                if batch is None:
+                    batch = tensor.new_empty((len(images),) + tuple(tensor.shape[1:]))
+                batch[indices] = tensor
+            
+            return batch
             
         except Exception as e:
             logger.error(f"批量图像预处理失败: {str(e)}")
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""
+分片训练数据集模块
+
+把按类别目录组织的小文件数据集打包为若干个约 100–500MB 的tar分片，分片内顺序存放编码后的影像和标签，
+训练时按分片顺序读取，用分片级打乱加缓冲区打乱代替逐文件随机读取
+
+分片目录结构：
+    index.json            类别名称、样本总数和各分片信息
+    shard-000000.tar      <序号>.<扩展名> 为编码后的影像，<序号>.cls 为类别索引
+
+用法：
+python -m algo.shards convert --source <类别目录或ZIP文件> --output_dir <输出目录>
+python -m algo.shards benchmark --folder <类别目录> --shard_dir <分片目录>
+"""
+
+import os
+import io
+import json
+import time
+import random
+import tarfile
+import zipfile
+import logging
+import argparse
+import multiprocessing as mp
+from pathlib import Path
+import numpy as np
+import cv2
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+import albumentations as A
+
+logger = logging.getLogger(__name__)
+
+# 单个分片的目标大小
+SHARD_MAX_BYTES = 256 * 1024 * 1024
+
+# 默认打乱缓冲区样本数
+DEFAULT_SHUFFLE_BUFFER = 1000
+
+# 分片索引文件
+SHARD_INDEX_FILE = 'index.json'
+
+IMAGE_EXTS = ['.jpg', '.jpeg', '.png', '.tif', '.tiff']
+
+def is_shard_dir(path):
+    """
+    判断目录是否为分片数据集
+
+    Args:
+        path (str or Path): 目录路径
+
+    Returns:
+        bool: 是否包含分片索引
+    """
+    return (Path(path) / SHARD_INDEX_FILE).is_file()
+
+def iter_folder_samples(data_dir, class_names=None):
+    """
+    遍历类别目录中的样本
+
+    Args:
+        data_dir (str or Path): 数据集目录，每个子目录为一个类别
+        class_names (list, optional): 类别名称列表，决定类别索引，不在列表中的子目录被跳过；
+            未提供时使用全部子目录。训练集和验证集应传入训练时使用的同一个列表
+
+    Returns:
+        tuple: (类别名称列表, 样本列表)，样本为 (读取函数, 扩展名, 类别索引)
+    """
+    if class_names is None:
+        class_names = sorted(d.name for d in Path(data_dir).iterdir() if d.is_dir())
+    samples = []
+    for label, class_name in enumerate(class_names):
+        class_dir = Path(data_dir) / class_name
+        if not class_dir.is_dir():
+            continue
+        for f in sorted(class_dir.iterdir()):
+            if f.is_file() and f.suffix.lower() in IMAGE_EXTS:
+                samples.append((f.read_bytes, f.suffix.lower(), label))
+    return class_names, samples
+
+def iter_zip_samples(zip_ref, split=None):
+    """
+    遍历ZIP文件中的样本
+
+    影像所在的直接父目录名称作为类别；指定划分时只读取该划分目录（如 train/、val/）下的影像
+
+    Args:
+        zip_ref (zipfile.ZipFile): 已打开的ZIP文件
+        split (str, optional): 划分名称
+
+    Returns:
+        tuple: (类别名称列表, 样本列表)，样本为 (读取函数, 扩展名, 类别索引)
+    """
+    members = []
+    for info in zip_ref.infolist():
+        path = Path(info.filename)
+        if info.is_dir() or path.suffix.lower() not in IMAGE_EXTS or len(path.parts) < 2:
+            continue
+        if split is not None and split not in path.parts[:-2]:
+            continue
+        members.append((path.parent.name, info))
+
+    class_names = sorted(set(name for name, _ in members))
+    label_of = {name: idx for idx, name in enumerate(class_names)}
+    samples = [
+        (lambda info=info: zip_ref.read(info), Path(info.filename).suffix.lower(), label_of[name])
+        for name, info in sorted(members, key=lambda m: m[1].filename)
+    ]
+    return class_names, samples
+
+def write_shards(class_names, samples, output_dir, shard_max_bytes=SHARD_MAX_BYTES, seed=0):
+    """
+    把样本写入分片
+
+    样本先整体打乱再顺序写入，每个分片内包含各个类别的样本
+
+    Args:
+        class_names (list): 类别名称列表
+        samples (list): 样本列表，样本为 (读取函数, 扩展名, 类别索引)
+        output_dir (str or Path): 输出目录
+        shard_max_bytes (int): 单个分片的目标大小
+        seed (int): 打乱使用的随机种子
+
+    Returns:
+        dict: 分片索引
+    """
+    output_dir = Path(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    order = list(range(len(samples)))
+    random.Random(seed).shuffle(order)
+
+    shards = []
+    tar = None
+    shard_path = None
+    shard_count = 0
+
+    def close_shard():
+        tar.close()
+        final_path = shard_path.with_suffix('')
+        os.replace(shard_path, final_path)
+        shards.append({'name': final_path.name, 'count': shard_count, 'bytes': final_path.stat().st_size})
+
+    def add_member(name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = 0
+        tar.addfile(info, io.BytesIO(data))
+
+    try:
+        for key, idx in enumerate(order):
+            read, ext, label = samples[idx]
+            if tar is None:
+                shard_path = output_dir / f"shard-{len(shards):06d}.tar.tmp"
+                tar = tarfile.open(shard_path, 'w', format=tarfile.USTAR_FORMAT)
+                shard_count = 0
+            add_member(f"{key:08d}{ext}", read())
+            add_member(f"{key:08d}.cls", str(label).encode('ascii'))
+            shard_count += 1
+            if tar.offset >= shard_max_bytes:
+                close_shard()
+                tar = None
+        if tar is not None:
+            close_shard()
+            tar = None
+    finally:
+        if tar is not None:
+            tar.close()
+            os.remove(shard_path)
+
+    index = {
+        'classes': class_names,
+        'count': len(samples),
+        'shards': shards
+    }
+    with open(output_dir / SHARD_INDEX_FILE, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    logger.info(f"已写入 {len(shards)} 个分片，共 {len(samples)} 个样本: {output_dir}")
+    return index
+
+def convert_dataset(source, output_dir, shard_max_bytes=SHARD_MAX_BYTES, class_names=None):
+    """
+    把类别目录或ZIP数据集转换为分片
+
+    ZIP中包含 train/、val/ 目录时按划分分别写入 output_dir/train 和 output_dir/val
+
+    Args:
+        source (str or Path): 类别目录或ZIP文件路径
+        output_dir (str or Path): 输出目录
+        shard_max_bytes (int): 单个分片的目标大小
+        class_names (list, optional): 类别目录输入时使用的类别名称列表
+
+    Returns:
+        dict: 各划分的分片索引，键为划分名称（类别目录输入时为None）
+    """
+    try:
+        source = Path(source)
+        if source.is_dir():
+            class_names, samples = iter_folder_samples(source, class_names)
+            return {None: write_shards(class_names, samples, output_dir, shard_max_bytes)}
+
+        result = {}
+        with zipfile.ZipFile(source, 'r') as zip_ref:
+            parts = set()
+            for name in zip_ref.namelist():
+                parts.update(Path(name).parts[:-2])
+            splits = [split for split in ('train', 'val') if split in parts]
+            if not splits:
+                class_names, samples = iter_zip_samples(zip_ref)
+                return {None: write_shards(class_names, samples, output_dir, shard_max_bytes)}
+            for split in splits:
+                class_names, samples = iter_zip_samples(zip_ref, split)
+                result[split] = write_shards(class_names, samples, Path(output_dir) / split, shard_max_bytes)
+        return result
+    except Exception as e:
+        logger.error(f"转换分片数据集失败: {str(e)}")
+        raise
+
+def _iter_shard(shard_path):
+    """
+    顺序读取分片中的样本
+
+    Args:
+        shard_path (Path): 分片路径
+
+    Yields:
+        tuple: (编码后的影像数据, 类别索引)
+    """
+    with tarfile.open(shard_path, 'r|') as tar:
+        image = None
+        for member in tar:
+            if not member.isfile():
+                continue
+            data = tar.extractfile(member).read()
+            if member.name.endswith('.cls'):
+                if image is not None:
+                    yield image, int(data)
+                image = None
+            else:
+                image = data
+
+class ShardedIterableDataset(IterableDataset):
+    """
+    分片数据集
+
+    每个epoch打乱分片顺序后按加载进程轮流分配分片，分片内顺序读取，
+    读出的样本经过固定大小的缓冲区随机输出。训练循环在每个epoch开始前调用 set_epoch，
+    保留加载进程（persistent_workers）时进程种子不变，由epoch序号区分各epoch的打乱顺序
+    """
+    def __init__(self, shard_dir, transform=None, shuffle=True, buffer_size=DEFAULT_SHUFFLE_BUFFER):
+        """
+        初始化数据集
+
+        Args:
+            shard_dir (str or Path): 分片目录
+            transform (callable, optional): 数据变换
+            shuffle (bool): 是否打乱分片顺序和样本顺序
+            buffer_size (int): 打乱缓冲区样本数
+        """
+        self.shard_dir = Path(shard_dir)
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        with open(self.shard_dir / SHARD_INDEX_FILE, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.class_names = index['classes']
+        self.shards = [s['name'] for s in index['shards']]
+        self.count = index['count']
+        # 共享内存中的epoch序号，主进程更新后已启动的加载进程也能读到
+        self._epoch = mp.Value('i', 0)
+        logger.info(f"从分片目录 {shard_dir} 加载数据集")
+        logger.info(f"找到 {len(self.class_names)} 个类别: {self.class_names}")
+        logger.info(f"总共 {self.count} 张图像，{len(self.shards)} 个分片")
+
+    def __len__(self):
+        return self.count
+
+    def set_epoch(self, epoch):
+        """
+        设置当前epoch序号（在创建本epoch的数据迭代器之前调用）
+
+        Args:
+            epoch (int): epoch序号
+        """
+        self._epoch.value = epoch
+
+    def _decode(self, data):
+        """
+        解码影像并应用变换
+
+        Args:
+            data (bytes): 编码后的影像数据
+
+        Returns:
+            torch.Tensor or numpy.ndarray: 变换后的图像
+        """
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("无法解码分片中的图像")
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if self.transform:
+            if isinstance(self.transform, A.Compose):
+                image = self.transform(image=image)["image"]
+            else:
+                image = self.transform(image)
+        return image
+
+    def _samples(self, base_seed):
+        """
+        读取当前加载进程负责的分片中的样本
+
+        所有加载进程使用相同的种子打乱分片顺序，再按进程编号轮流分配，保证每个分片每个epoch只读取一次
+
+        Args:
+            base_seed (str): 本epoch各加载进程共用的种子
+
+        Yields:
+            tuple: (编码后的影像数据, 类别索引)
+        """
+        shards = list(self.shards)
+        if self.shuffle:
+            random.Random(base_seed).shuffle(shards)
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            shards = shards[worker_info.id::worker_info.num_workers]
+
+        for name in shards:
+            yield from _iter_shard(self.shard_dir / name)
+
+    def __iter__(self):
+        # 加载进程的种子来自DataLoader，主进程加载时从全局随机数生成器取种子；
+        # 保留加载进程时该种子在各epoch之间不变，因此分片顺序和缓冲区的种子都混入epoch序号
+        epoch = self._epoch.value
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            base_seed = worker_info.seed - worker_info.id
+            rng = random.Random(f"{worker_info.seed}-{epoch}")
+        else:
+            base_seed = int(torch.empty((), dtype=torch.int64).random_().item())
+            rng = random.Random(f"{base_seed}-{epoch}")
+
+        samples = self._samples(f"{base_seed}-{epoch}")
+        if not self.shuffle:
+            for data, label in samples:
+                yield self._decode(data), torch.tensor(label, dtype=torch.long)
+            return
+
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            data, label = buffer[i]
+            buffer[i] = sample
+            yield self._decode(data), torch.tensor(label, dtype=torch.long)
+        rng.shuffle(buffer)
+        for data, label in buffer:
+            yield self._decode(data), torch.tensor(label, dtype=torch.long)
+
+def benchmark_folder(data_dir):
+    """
+    统计按类别目录逐文件随机读取并解码一个epoch的吞吐量
+
+    Args:
+        data_dir (str or Path): 类别目录
+
+    Returns:
+        dict: 样本数、字节数、耗时、每秒图像数和每秒MB数
+    """
+    _, samples = iter_folder_samples(data_dir)
+    random.shuffle(samples)
+    start = time.perf_counter()
+    total_bytes = 0
+    for read, _, _ in samples:
+        data = read()
+        total_bytes += len(data)
+        cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return _throughput(len(samples), total_bytes, time.perf_counter() - start)
+
+def benchmark_shards(shard_dir, buffer_size=DEFAULT_SHUFFLE_BUFFER):
+    """
+    统计顺序读取分片、缓冲区打乱并解码一个epoch的吞吐量
+
+    Args:
+        shard_dir (str or Path): 分片目录
+        buffer_size (int): 打乱缓冲区样本数
+
+    Returns:
+        dict: 样本数、字节数、耗时、每秒图像数和每秒MB数
+    """
+    dataset = ShardedIterableDataset(shard_dir, buffer_size=buffer_size)
+    count = 0
+    start = time.perf_counter()
+    for _ in dataset:
+        count += 1
+    total_bytes = sum((dataset.shard_dir / name).stat().st_size for name in dataset.shards)
+    return _throughput(count, total_bytes, time.perf_counter() - start)
+
+def _throughput(count, total_bytes, seconds):
+    return {
+        'images': count,
+        'bytes': total_bytes,
+        'seconds': round(seconds, 3),
+        'images_per_second': round(count / seconds, 1) if seconds > 0 else None,
+        'mb_per_second': round(total_bytes / 1024 / 1024 / seconds, 1) if seconds > 0 else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='分片训练数据集工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help='把类别目录或ZIP数据集转换为分片')
+    convert_parser.add_argument('--source', type=str, required=True, help='类别目录或ZIP文件路径')
+    convert_parser.add_argument('--output_dir', type=str, required=True, help='输出目录')
+    convert_parser.add_argument('--shard_mb', type=int, default=SHARD_MAX_BYTES // 1024 // 1024, help='单个分片的目标大小（MB）')
+
+    bench_parser = subparsers.add_parser('benchmark', help='比较类别目录和分片的单epoch读取吞吐量')
+    bench_parser.add_argument('--folder', type=str, required=True, help='类别目录')
+    bench_parser.add_argument('--shard_dir', type=str, required=True, help='分片目录')
+    bench_parser.add_argument('--buffer_size', type=int, default=DEFAULT_SHUFFLE_BUFFER, help='打乱缓冲区样本数')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'convert':
+        index = convert_dataset(args.source, args.output_dir, args.shard_mb * 1024 * 1024)
+        for split, info in index.items():
+            print(f"{split or '数据集'}: {info['count']} 个样本，{len(info['shards'])} 个分片")
+    else:
+        print(f"类别目录: {benchmark_folder(args.folder)}")
+        print(f"分片: {benchmark_shards(args.shard_dir, args.buffer_size)}")
+
+if __name__ == '__main__':
+    main()
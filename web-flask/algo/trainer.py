@@ -9,6 +9,12 @@ import os
 import logging
 import time
 import json
+import platform
+import math
+import shutil
+import copy
+import contextlib
+from datetime import datetime
 import numpy as np
 import torch
 import torch.nn as nn
@@ -18,6 +24,15 @@ from pathlib import Path
 import albumentations as A
 from tqdm import tqdm
 from .preprocessing import get_train_transforms, get_val_transforms
+from .dataset_cache import open_dataset_cache
+from .shards import ShardedIterableDataset, is_shard_dir
+from .checkpoint import (capture_rng_state, restore_rng_state, submit_checkpoint, checkpoint_writer,
+                         load_latest_checkpoint, remove_checkpoints, state_to_cpu, atomic_save)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # 设置环境变量以屏蔽albumentations更新提示
 os.environ['NO_ALBUMENTATIONS_UPDATE'] = '1'
@@ -27,11 +42,138 @@ logger = logging.getLogger(__name__)
 # 模型存储路径
 MODEL_DIR = Path(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) / 'file_store/model'
 
+# 每个任务保留的最近定期保存模型（_epochN）文件数
+MODEL_EPOCH_KEEP = 3
+
+# Linux下默认的数据加载进程数
+DEFAULT_NUM_WORKERS = min(4, os.cpu_count() or 1)
+
+# 每个加载进程预取的批次数
+DEFAULT_PREFETCH_FACTOR = 2
+
+def build_loader_options(num_workers=None, pin_memory=None, persistent_workers=None, prefetch_factor=None, device=None):
+    """
+    生成DataLoader的加载参数
+
+    Linux使用fork启动加载进程，默认开启多进程加载；Windows和macOS使用spawn启动，
+    要求数据集可序列化且入口受 __main__ 保护，默认在主进程中加载。未指定的参数使用平台默认值
+
+    Args:
+        num_workers (int, optional): 加载进程数，0表示在主进程中加载
+        pin_memory (bool, optional): 是否使用锁页内存，默认仅在使用GPU时开启
+        persistent_workers (bool, optional): 是否在epoch之间保留加载进程，默认在多进程加载时开启
+        prefetch_factor (int, optional): 每个加载进程预取的批次数
+        device (torch.device, optional): 训练设备
+
+    Returns:
+        dict: DataLoader的关键字参数
+    """
+    if num_workers is None:
+        num_workers = DEFAULT_NUM_WORKERS if platform.system() == 'Linux' else 0
+    num_workers = max(0, int(num_workers))
+    if pin_memory is None:
+        pin_memory = device is not None and torch.device(device).type == 'cuda'
+
+    options = {
+        'num_workers': num_workers,
+        'pin_memory': bool(pin_memory)
+    }
+    # persistent_workers 和 prefetch_factor 只能在多进程加载时设置
+    if num_workers > 0:
+        options['persistent_workers'] = True if persistent_workers is None else bool(persistent_workers)
+        options['prefetch_factor'] = max(1, int(prefetch_factor or DEFAULT_PREFETCH_FACTOR))
+    return options
+
+def resolve_precision(mixed_precision, device):
+    """
+    确定训练精度
+
+    GPU上使用fp16自动混合精度并配合梯度缩放；CPU上使用bf16自动混合精度，需要 PyTorch 1.10 及以上版本
+
+    Args:
+        mixed_precision (bool): 是否开启混合精度
+        device (torch.device): 训练设备
+
+    Returns:
+        str: 'fp16'、'bf16' 或 'fp32'
+    """
+    if not mixed_precision:
+        return 'fp32'
+    if device.type == 'cuda':
+        return 'fp16'
+    if hasattr(torch, 'autocast'):
+        return 'bf16'
+    logger.warning(f"当前PyTorch版本 {torch.__version__} 不支持CPU混合精度，使用fp32训练")
+    return 'fp32'
+
+def autocast_context(precision, device):
+    """
+    获取自动混合精度上下文
+
+    Args:
+        precision (str): 训练精度
+        device (torch.device): 训练设备
+
+    Returns:
+        上下文管理器
+    """
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    dtype = torch.float16 if precision == 'fp16' else torch.bfloat16
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type=device.type, dtype=dtype)
+    return torch.cuda.amp.autocast()
+
+def get_peak_memory_mb(device):
+    """
+    获取峰值内存占用
+
+    GPU上为本epoch的显存分配峰值；CPU上为进程的常驻内存峰值（Windows上无法获取）
+
+    Args:
+        device (torch.device): 训练设备
+
+    Returns:
+        float: 峰值内存（MB），无法获取时返回None
+    """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 1024 / 1024
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss在Linux上以KB为单位，在macOS上以字节为单位
+    return peak / 1024 / 1024 if platform.system() == 'Darwin' else peak / 1024
+
+def is_out_of_memory_error(error):
+    """
+    判断异常是否为显存或内存不足
+
+    Args:
+        error (Exception): 异常
+
+    Returns:
+        bool: 是否为内存不足
+    """
+    message = str(error)
+    return 'out of memory' in message or "can't allocate memory" in message
+
+class TrainingInterrupted(Exception):
+    """
+    训练被暂停或取消
+    """
+    def __init__(self, action):
+        """
+        Args:
+            action (str): 停止原因，'pause' 或 'cancel'
+        """
+        super().__init__(f"训练已{'暂停' if action == 'pause' else '取消'}")
+        self.action = action
+
 class RemoteSensingDataset(Dataset):
     """
     遥感影像数据集
     """
-    def __init__(self, data_dir=None, image_paths=None, labels=None, transform=None):
+    def __init__(self, data_dir=None, image_paths=None, labels=None, transform=None, cache=None, mmap_cache=None):
         """
         初始化数据集
         
@@ -40,8 +182,12 @@ class RemoteSensingDataset(Dataset):
             image_paths (list, optional): 图像路径列表
             labels (list, optional): 标签列表
             transform (callable, optional): 数据变换
+            cache (DecodedImageCache, optional): 解码缓存，跨epoch复用解码结果
+            mmap_cache (MmapDatasetCache, optional): 预解码缓存，提供时直接从内存映射读取图像
         """
         self.transform = transform
+        self.cache = cache
+        self.mmap_cache = mmap_cache
         self.label_to_idx = {}
         self.idx_to_label = {}
         
@@ -89,15 +235,33 @@ class RemoteSensingDataset(Dataset):
     def __len__(self):
         return len(self.image_paths)
     
+    @staticmethod
+    def _decode_image(image_path):
+        """
+        解码图像文件为RGB数组
+        
+        Args:
+            image_path (str): 图像文件路径
+            
+        Returns:
+            numpy.ndarray: RGB图像，形状为 (H, W, C)
+        """
+        import cv2
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"无法读取图像文件: {image_path}")
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    
     def __getitem__(self, idx):
         # 读取图像
         image_path = self.image_paths[idx]
         try:
-            import cv2
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError(f"无法读取图像文件: {image_path}")
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            if self.mmap_cache is not None:
+                image, _ = self.mmap_cache.get(idx)
+            elif self.cache is not None:
+                image = self.cache.get_or_load(image_path, self._decode_image)
+            else:
+                image = self._decode_image(image_path)
             
             # 应用变换
             if self.transform:
@@ -239,33 +403,212 @@ class ModelTrainer:
         except Exception as e:
             logger.error(f"创建模型失败: {str(e)}")
             raise    
-    def train(self, train_data, val_data=None, epochs=30, batch_size=32, save_interval=5, task_id=None, user_id=None):
+
+    def _train_batch(self, images, labels, precision, scaler, micro_batch_size, non_blocking):
+        """
+        训练一个批次：按微批次切分后逐个前向和反向传播累积梯度，再更新一次参数
+
+        每个微批次的损失按 微批次样本数/批次样本数 缩放，累积的梯度等于整个批次平均损失的梯度，
+        参数更新与直接使用该批次训练一致（BatchNorm的统计量仍按微批次计算）
+
+        Args:
+            images (torch.Tensor): 批次图像
+            labels (torch.Tensor): 批次标签
+            precision (str): 训练精度
+            scaler (GradScaler): 梯度缩放器
+            micro_batch_size (int): 微批次大小
+            non_blocking (bool): 是否异步拷贝数据到设备
+
+        Returns:
+            tuple: (损失总和, 正确数)
+        """
+        batch_samples = labels.size(0)
+        loss_sum = 0.0
+        correct = 0
+        for micro_images, micro_labels in zip(images.split(micro_batch_size), labels.split(micro_batch_size)):
+            micro_images = micro_images.to(self.device, non_blocking=non_blocking)
+            micro_labels = micro_labels.to(self.device, non_blocking=non_blocking)
+            
+            # 前向传播
+            with autocast_context(precision, self.device):
+                outputs = self.model(micro_images)
+                
+                # 处理GoogleNet特殊输出结构
+                if self.model_name == 'GoogleNet' and hasattr(outputs, 'logits'):
+                    # GoogleNet返回的是GoogLeNetOutputs对象，需要提取logits
+                    loss = self.criterion(outputs.logits, micro_labels)
+                    _, predicted = torch.max(outputs.logits, 1) # 使用 outputs.logits
+                else:
+                    # 其他模型返回的是普通张量
+                    loss = self.criterion(outputs, micro_labels)
+                    _, predicted = torch.max(outputs, 1)
+            
+            # 反向传播（未开启梯度缩放时scaler直接透传）
+            scaler.scale(loss * (micro_labels.size(0) / batch_samples)).backward()
+            loss_sum += loss.item() * micro_labels.size(0)
+            correct += (predicted == micro_labels).sum().item()
+        
+        scaler.step(self.optimizer)
+        scaler.update()
+        self.optimizer.zero_grad()
+        return loss_sum, correct
+    
+    def _train_epoch(self, train_loader, desc, precision, scaler, micro_batch_size, non_blocking, stop_signal=None):
+        """
+        训练一个epoch
+
+        数据按有效批次大小加载，每个批次切分为微批次累积梯度后更新一次参数。显存或内存不足时丢弃当前批次
+        已累积的梯度，微批次大小减半后重新训练当前批次，之前的批次不受影响
+
+        Args:
+            train_loader (DataLoader): 按有效批次大小加载的训练数据
+            desc (str): 进度条描述
+            precision (str): 训练精度
+            scaler (GradScaler): 梯度缩放器
+            micro_batch_size (int): 微批次大小
+            non_blocking (bool): 是否异步拷贝数据到设备
+            stop_signal (callable, optional): 每个批次前调用，返回 'cancel' 时停止训练（暂停请求在epoch结束时处理）
+
+        Returns:
+            dict: 训练损失总和 loss、正确数 correct、样本数 total、等待数据加载的秒数 loader_wait
+                和epoch结束时的微批次大小 micro_batch_size
+
+        Raises:
+            TrainingInterrupted: 训练被取消
+        """
+        self.model.train()
+        train_loss = 0.0
+        train_correct = 0
+        train_total = 0
+        loader_wait = 0.0
+        self.optimizer.zero_grad()
+        
+        # 添加进度条
+        train_pbar = tqdm(train_loader, desc=desc)
+        wait_start = time.perf_counter()
+        for images, labels in train_pbar:
+            # 统计等待数据加载的时间
+            loader_wait += time.perf_counter() - wait_start
+            
+            # 检查取消请求
+            if stop_signal is not None and stop_signal() == 'cancel':
+                raise TrainingInterrupted('cancel')
+            
+            while True:
+                try:
+                    loss_sum, correct = self._train_batch(images, labels, precision, scaler, micro_batch_size, non_blocking)
+                    break
+                except RuntimeError as e:
+                    if not is_out_of_memory_error(e) or micro_batch_size <= 1:
+                        raise
+                
+                # 内存不足：丢弃本批次未更新的梯度，微批次减半后重新训练本批次
+                self.optimizer.zero_grad()
+                if self.device.type == 'cuda':
+                    torch.cuda.empty_cache()
+                micro_batch_size = max(1, micro_batch_size // 2)
+                logger.warning(f"训练内存不足，微批次大小减小为 {micro_batch_size}，重新训练当前批次")
+            
+            # 统计
+            train_loss += loss_sum
+            train_total += labels.size(0)
+            train_correct += correct
+            
+            # 更新进度条
+            train_pbar.set_postfix({'loss': f'{loss_sum / labels.size(0):.4f}', 'acc': f'{correct / labels.size(0):.4f}'})
+            wait_start = time.perf_counter()
+        
+        return {
+            'loss': train_loss,
+            'correct': train_correct,
+            'total': train_total,
+            'loader_wait': loader_wait,
+            'micro_batch_size': micro_batch_size
+        }
+    
+    def _checkpoint_state(self, epoch, history, best_val_acc, scaler, micro_batch_size):
+        """
+        生成完整训练状态，张量均复制到CPU，其余可变对象深拷贝，后台写入期间训练可以继续修改原对象
+
+        Args:
+            epoch (int): 已完成的epoch数
+            history (dict): 训练历史记录
+            best_val_acc (float): 最佳验证准确率
+            scaler (GradScaler): 梯度缩放器
+            micro_batch_size (int): 当前微批次大小
+
+        Returns:
+            dict: 训练状态
+        """
+        return {
+            'epoch': epoch,
+            'model_name': self.model_name,
+            'num_classes': self.num_classes,
+            'model_state_dict': state_to_cpu(self.model.state_dict()),
+            'optimizer_state_dict': state_to_cpu(self.optimizer.state_dict()),
+            'scheduler_state_dict': copy.deepcopy(self.scheduler.state_dict()),
+            'scaler_state_dict': copy.deepcopy(scaler.state_dict()),
+            'history': copy.deepcopy(history),
+            'best_val_acc': best_val_acc,
+            'micro_batch_size': micro_batch_size,
+            'rng_state': capture_rng_state()
+        }
+    
+    def train(self, train_data, val_data=None, epochs=30, batch_size=32, save_interval=5, task_id=None, user_id=None, image_cache=None,
+              loader_options=None, mmap_cache=False, mixed_precision=False, micro_batch_size=None, accumulation_steps=None,
+              resume=True, checkpoint_interval=1, stop_signal=None):
         """
         训练模型
         
         Args:
-            train_data (dict): 训练数据，包含 'images' 和 'labels' 键
-            val_data (dict, optional): 验证数据，包含 'images' 和 'labels' 键
+            train_data (dict or str): 训练数据，包含 'images' 和 'labels' 键，或类别目录、分片目录路径
+            val_data (dict or str, optional): 验证数据，格式同 train_data
             epochs (int): 训练轮数
-            batch_size (int): 批次大小
+            batch_size (int): 批次大小（有效批次大小，即每次参数更新使用的样本数）
             save_interval (int): 保存模型的间隔轮数
             task_id (int, optional): 训练任务ID，用于保存模型和清理临时文件
             user_id (int, optional): 用户ID，用于指定保存路径
+            image_cache (DecodedImageCache, optional): 解码缓存，提供时训练集和验证集共享该缓存；
+                只在主进程加载（num_workers 为0）时使用，多进程加载时忽略
+            loader_options (dict, optional): 数据加载参数（num_workers、pin_memory、persistent_workers、prefetch_factor），
+                未指定的参数使用平台默认值
+            mmap_cache (bool): 是否使用预解码缓存，开启时训练前把数据集解码为内存映射数组，之后不再重复解码
+            mixed_precision (bool): 是否使用混合精度训练（GPU上为fp16，CPU上为bf16）
+            micro_batch_size (int, optional): 微批次大小，每次前向和反向传播使用的样本数，
+                每个有效批次（batch_size 个样本，epoch末尾可能不足）切分为微批次累积梯度后更新一次参数，学习率调度仍按epoch进行
+            accumulation_steps (int, optional): 梯度累积步数，未指定微批次大小时微批次大小为 batch_size/accumulation_steps
+                （向上取整）。训练中显存或内存不足时微批次大小自动减半并重新训练当前批次
+            resume (bool): 是否从任务最近一个有效断点继续训练
+            checkpoint_interval (int): 保存断点的间隔轮数，需要提供 task_id
+            stop_signal (callable, optional): 每个训练批次前和每个epoch结束时调用，返回 'cancel' 时立即停止并删除断点；
+                返回 'pause' 时在当前epoch结束、保存断点后停止，恢复后从下一轮开始
             
         Returns:
-            dict: 训练历史记录
+            dict: 训练历史记录，loader_wait 为每个epoch训练阶段等待数据加载的总秒数，
+                images_per_sec 为训练阶段吞吐量，peak_memory_mb 为峰值内存，precision 为训练精度
+            
+        Raises:
+            TrainingInterrupted: 训练被暂停或取消
         """
+        start_time = time.time()
+        # 本次训练持有的预解码缓存，结束时释放租约
+        mmap_caches = []
         try:
             # 准备数据集
             train_transform = get_train_transforms()
             val_transform = get_val_transforms()
             
-            # 支持两种数据加载方式
-            if isinstance(train_data, str):
+            # 支持三种数据加载方式
+            if isinstance(train_data, str) and is_shard_dir(train_data):
+                # 从分片目录顺序读取数据集
+                self.train_dataset = ShardedIterableDataset(train_data, transform=train_transform, shuffle=True)
+                self.num_classes = len(self.train_dataset.class_names)
+            elif isinstance(train_data, str):
                 # 从目录加载数据集
                 self.train_dataset = RemoteSensingDataset(
                     data_dir=train_data,
-                    transform=train_transform
+                    transform=train_transform,
+                    cache=image_cache
                 )
                 # 更新类别数量
                 self.num_classes = len(self.train_dataset.class_names)
@@ -274,24 +617,67 @@ class ModelTrainer:
                 self.train_dataset = RemoteSensingDataset(
                     image_paths=train_data['images'],
                     labels=train_data['labels'],
-                    transform=train_transform
+                    transform=train_transform,
+                    cache=image_cache
                 )
             
-            train_loader = DataLoader(self.train_dataset, batch_size=batch_size, shuffle=True, num_workers=0) # 将num_workers设置为0以在Windows上兼容。
+            # 分片数据集按顺序读取，不使用预解码缓存
+            sharded = isinstance(self.train_dataset, ShardedIterableDataset)
+            if mmap_cache and not sharded:
+                self.train_dataset.mmap_cache = open_dataset_cache(self.train_dataset.image_paths, self.train_dataset.labels)
+                mmap_caches.append(self.train_dataset.mmap_cache)
+            
+            # 微批次大小和梯度累积步数
+            if micro_batch_size:
+                micro_batch_size = max(1, min(int(micro_batch_size), batch_size))
+            elif accumulation_steps:
+                micro_batch_size = max(1, math.ceil(batch_size / int(accumulation_steps)))
+            else:
+                micro_batch_size = batch_size
+            accumulation_steps = math.ceil(batch_size / micro_batch_size)
+            
+            # 查找断点，沿用断点中因内存不足减小后的微批次大小
+            checkpoint = None
+            if task_id and resume:
+                checkpoint = load_latest_checkpoint(task_id, self.model_name, self.num_classes)
+            if checkpoint is not None and checkpoint.get('micro_batch_size'):
+                micro_batch_size = min(micro_batch_size, checkpoint['micro_batch_size'])
+                accumulation_steps = math.ceil(batch_size / micro_batch_size)
+            logger.info(f"微批次大小: {micro_batch_size}，梯度累积步数: {accumulation_steps}")
+            
+            loader_kwargs = build_loader_options(device=self.device, **(loader_options or {}))
+            logger.info(f"数据加载参数: {loader_kwargs}")
+            non_blocking = loader_kwargs['pin_memory']
+            # 解码缓存只在主进程加载时有效：多进程加载时每个加载进程各持一份副本，内存预算按进程数成倍增加，
+            # 命中统计也留在加载进程中。此时关闭解码缓存，跨epoch复用解码结果应使用 mmap_cache
+            if image_cache is not None and loader_kwargs['num_workers'] > 0:
+                logger.warning(f"多进程加载（{loader_kwargs['num_workers']} 个加载进程）时不使用解码缓存，可改用 mmapCache")
+                image_cache = None
+                if isinstance(self.train_dataset, RemoteSensingDataset):
+                    self.train_dataset.cache = None
+            # 训练数据按有效批次加载，每个批次在训练时切分为微批次；分片数据集自行打乱顺序
+            train_loader = DataLoader(self.train_dataset, batch_size=batch_size, shuffle=not sharded, **loader_kwargs)
             
             if val_data:
-                if isinstance(val_data, str):
+                if isinstance(val_data, str) and is_shard_dir(val_data):
+                    val_dataset = ShardedIterableDataset(val_data, transform=val_transform, shuffle=False)
+                elif isinstance(val_data, str):
                     val_dataset = RemoteSensingDataset(
                         data_dir=val_data,
-                        transform=val_transform
+                        transform=val_transform,
+                        cache=image_cache
                     )
                 else:
                     val_dataset = RemoteSensingDataset(
                         image_paths=val_data['images'],
                         labels=val_data['labels'],
-                        transform=val_transform
+                        transform=val_transform,
+                        cache=image_cache
                     )
-                val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=0) # Set num_workers=0 for Windows compatibility
+                if mmap_cache and not isinstance(val_dataset, ShardedIterableDataset):
+                    val_dataset.mmap_cache = open_dataset_cache(val_dataset.image_paths, val_dataset.labels)
+                    mmap_caches.append(val_dataset.mmap_cache)
+                val_loader = DataLoader(val_dataset, batch_size=micro_batch_size, shuffle=False, **loader_kwargs)
             else:
                 val_loader = None
             
@@ -300,14 +686,27 @@ class ModelTrainer:
                 'train_loss': [],
                 'train_acc': [],
                 'val_loss': [],
-                'val_acc': []
+                'val_acc': [],
+                'loader_wait': [],
+                'images_per_sec': [],
+                'peak_memory_mb': [],
+                'micro_batch_size': [],
+                'checkpoint_stall_seconds': []
             }
             
+            # 混合精度：fp16需要梯度缩放防止梯度下溢，bf16和fp32不需要
+            precision = resolve_precision(mixed_precision, self.device)
+            history['precision'] = precision
+            if hasattr(getattr(torch, 'amp', None), 'GradScaler'):
+                scaler = torch.amp.GradScaler('cuda', enabled=precision == 'fp16')
+            else:  # PyTorch 2.3 以下
+                scaler = torch.cuda.amp.GradScaler(enabled=precision == 'fp16')
+            logger.info(f"训练精度: {precision}")
+            
             # 训练循环
             best_val_acc = 0.0
-            start_time = time.time()
+            start_epoch = 0
             # 更新训练开始时间
-            from datetime import datetime
             from utils.db_utils import update_task_status
             from app import socketio # 导入 socketio 实例
             
@@ -324,52 +723,53 @@ class ModelTrainer:
             }
             socketio.emit('training_status_update', status_message) # 使用 socketio 发送消息
             
-            for epoch in range(epochs):
-                # 训练阶段
-                self.model.train()
-                train_loss = 0.0
-                train_correct = 0
-                train_total = 0
+            # 从断点恢复训练状态
+            if checkpoint is not None:
+                self.model.load_state_dict(checkpoint['model_state_dict'])
+                self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+                self.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+                if checkpoint.get('scaler_state_dict'):
+                    scaler.load_state_dict(checkpoint['scaler_state_dict'])
+                history.update(checkpoint['history'])
+                best_val_acc = checkpoint['best_val_acc']
+                start_epoch = checkpoint['epoch']
+                restore_rng_state(checkpoint['rng_state'])
+                history['resumed_from_epoch'] = start_epoch
+                checkpoint = None
+                logger.info(f"从第 {start_epoch} 轮的断点继续训练")
+            
+            for epoch in range(start_epoch, epochs):
+                # 训练线程因保存模型和断点而停顿的时间（只包含复制状态和排队等待）
+                checkpoint_stall = 0.0
                 
-                # 添加进度条
-                train_pbar = tqdm(train_loader, desc=f'Epoch {epoch+1}/{epochs} [Train]')
-                for images, labels in train_pbar:
-                    images, labels = images.to(self.device), labels.to(self.device)
-                    
-                    # 前向传播
-                    self.optimizer.zero_grad()
-                    outputs = self.model(images)
-                    
-                    # 处理GoogleNet特殊输出结构
-                    if self.model_name == 'GoogleNet' and hasattr(outputs, 'logits'):
-                        # GoogleNet返回的是GoogLeNetOutputs对象，需要提取logits
-                        loss = self.criterion(outputs.logits, labels)
-                        _, predicted = torch.max(outputs.logits, 1) # 使用 outputs.logits
-                    else:
-                        # 其他模型返回的是普通张量
-                        loss = self.criterion(outputs, labels)
-                        _, predicted = torch.max(outputs, 1)
-                    
-                    # 反向传播
-                    loss.backward()
-                    self.optimizer.step()
-                    
-                    # 统计
-                    train_loss += loss.item() * images.size(0)
-                    # _, predicted = torch.max(outputs, 1) # 这行已被移到上面条件判断中
-                    train_total += labels.size(0)
-                    train_correct += (predicted == labels).sum().item()
-                    
-                    # 更新进度条
-                    current_loss = loss.item()
-                    current_acc = (predicted == labels).sum().item() / labels.size(0)
-                    train_pbar.set_postfix({'loss': f'{current_loss:.4f}', 'acc': f'{current_acc:.4f}'})
+                # 训练阶段
+                if self.device.type == 'cuda':
+                    torch.cuda.reset_peak_memory_stats(self.device)
+                if sharded:
+                    self.train_dataset.set_epoch(epoch)
+                for cache in mmap_caches:
+                    cache.refresh()
+                train_start = time.perf_counter()
+                epoch_stats = self._train_epoch(train_loader, f'Epoch {epoch+1}/{epochs} [Train]', precision,
+                                                scaler, micro_batch_size, non_blocking, stop_signal)
+                micro_batch_size = epoch_stats['micro_batch_size']
+                train_loss = epoch_stats['loss']
+                train_correct = epoch_stats['correct']
+                train_total = epoch_stats['total']
+                loader_wait = epoch_stats['loader_wait']
                 
                 # 计算训练指标
+                train_seconds = time.perf_counter() - train_start
                 epoch_train_loss = train_loss / train_total
                 epoch_train_acc = train_correct / train_total
+                images_per_sec = train_total / train_seconds if train_seconds > 0 else 0.0
+                peak_memory_mb = get_peak_memory_mb(self.device)
                 history['train_loss'].append(epoch_train_loss)
                 history['train_acc'].append(epoch_train_acc)
+                history['loader_wait'].append(loader_wait)
+                history['images_per_sec'].append(images_per_sec)
+                history['peak_memory_mb'].append(peak_memory_mb)
+                history['micro_batch_size'].append(micro_batch_size)
                 
                 # 验证阶段
                 if val_loader:
@@ -382,20 +782,22 @@ class ModelTrainer:
                         # 添加验证进度条
                         val_pbar = tqdm(val_loader, desc=f'Epoch {epoch+1}/{epochs} [Val]')
                         for images, labels in val_pbar:
-                            images, labels = images.to(self.device), labels.to(self.device)
+                            images = images.to(self.device, non_blocking=non_blocking)
+                            labels = labels.to(self.device, non_blocking=non_blocking)
                             
                             # 前向传播
-                            outputs = self.model(images)
-                            
-                            # 处理GoogleNet特殊输出结构
-                            if self.model_name == 'GoogleNet' and hasattr(outputs, 'logits'):
-                                # GoogleNet返回的是GoogLeNetOutputs对象，需要提取logits
-                                loss = self.criterion(outputs.logits, labels)
-                                _, predicted = torch.max(outputs.logits, 1)
-                            else:
-                                # 其他模型返回的是普通张量
-                                loss = self.criterion(outputs, labels)
-                                _, predicted = torch.max(outputs, 1)
+                            with autocast_context(precision, self.device):
+                                outputs = self.model(images)
+                                
+                                # 处理GoogleNet特殊输出结构
+                                if self.model_name == 'GoogleNet' and hasattr(outputs, 'logits'):
+                                    # GoogleNet返回的是GoogLeNetOutputs对象，需要提取logits
+                                    loss = self.criterion(outputs.logits, labels)
+                                    _, predicted = torch.max(outputs.logits, 1)
+                                else:
+                                    # 其他模型返回的是普通张量
+                                    loss = self.criterion(outputs, labels)
+                                    _, predicted = torch.max(outputs, 1)
                             
                             # 统计
                             val_loss += loss.item() * images.size(0)
@@ -415,7 +817,10 @@ class ModelTrainer:
                     # 保存最佳模型
                     if epoch_val_acc > best_val_acc:
                         best_val_acc = epoch_val_acc
-                        self.save_model(f"{self.model_name}_best", user_id=user_id, task_id=task_id)
+                        stall_start = time.perf_counter()
+                        self.save_model(f"{self.model_name}_best", user_id=user_id, task_id=task_id,
+                                        accuracy=best_val_acc, wait=False)
+                        checkpoint_stall += time.perf_counter() - stall_start
                         logger.info(f"保存最佳模型，验证准确率: {epoch_val_acc:.4f}")
                 
                 # 打印进度
@@ -424,11 +829,15 @@ class ModelTrainer:
                               f"Train Loss: {epoch_train_loss:.4f}, "
                               f"Train Acc: {epoch_train_acc:.4f}, "
                               f"Val Loss: {epoch_val_loss:.4f}, "
-                              f"Val Acc: {epoch_val_acc:.4f}")
+                              f"Val Acc: {epoch_val_acc:.4f}, "
+                              f"Loader Wait: {loader_wait:.2f}s, "
+                              f"Throughput: {images_per_sec:.1f} img/s")
                 else:
                     logger.info(f"Epoch {epoch+1}/{epochs} - "
                               f"Train Loss: {epoch_train_loss:.4f}, "
-                              f"Train Acc: {epoch_train_acc:.4f}")
+                              f"Train Acc: {epoch_train_acc:.4f}, "
+                              f"Loader Wait: {loader_wait:.2f}s, "
+                              f"Throughput: {images_per_sec:.1f} img/s")
                 
                 # 通过WebSocket发送进度更新
                 progress_message = {
@@ -440,39 +849,98 @@ class ModelTrainer:
                     'trainAcc': epoch_train_acc,
                     'valLoss': epoch_val_loss if val_loader else None,
                     'valAcc': epoch_val_acc if val_loader else None,
+                    'loaderWait': loader_wait,
+                    'imagesPerSec': images_per_sec,
+                    'peakMemoryMb': peak_memory_mb,
                     'message': f'Epoch {epoch+1} 完成'
                 }
                 socketio.emit('training_status_update', progress_message)
 
                 # 定期保存模型
+                stall_start = time.perf_counter()
                 if (epoch + 1) % save_interval == 0:
-                    self.save_model(f"{self.model_name}_epoch{epoch+1}", user_id=user_id, task_id=task_id)
+                    self.save_model(f"{self.model_name}_epoch{epoch+1}", user_id=user_id, task_id=task_id,
+                                    accuracy=best_val_acc if val_loader else None, wait=False)
+                
+                # 暂停只在epoch结束时进行，断点始终对应完整的epoch；最后一轮结束时直接完成训练
+                pause_requested = stop_signal is not None and epoch + 1 < epochs and stop_signal() == 'pause'
+                
+                # 定期保存断点（暂停时必须保存），断点中的历史记录包含截至上一轮的停顿时间
+                if task_id and ((epoch + 1) % checkpoint_interval == 0 or epoch + 1 == epochs or pause_requested):
+                    snapshot_start = time.perf_counter()
+                    state = self._checkpoint_state(epoch + 1, history, best_val_acc, scaler, micro_batch_size)
+                    checkpoint_writer.record_snapshot(task_id, time.perf_counter() - snapshot_start)
+                    submit_checkpoint(state, task_id, metric=epoch_val_acc if val_loader else None)
+                checkpoint_stall += time.perf_counter() - stall_start
+                history['checkpoint_stall_seconds'].append(checkpoint_stall)
+                if pause_requested:
+                    raise TrainingInterrupted('pause')
+            
+            # 记录解码缓存命中情况
+            if image_cache is not None:
+                logger.info(f"解码缓存统计: {image_cache.stats()}")
             
-            # 保存最终模型
-            self.save_model(f"{self.model_name}_final", user_id=user_id, task_id=task_id)
+            # 保存最终模型，并等待后台写入全部完成
+            self.save_model(f"{self.model_name}_final", user_id=user_id, task_id=task_id,
+                            accuracy=best_val_acc if val_loader else None)
+            write_errors = checkpoint_writer.flush(task_id)
+            if write_errors:
+                raise write_errors[0]
+            history['checkpoint_metrics'] = checkpoint_writer.metrics(task_id)
+            logger.info(f"断点写入统计: {history['checkpoint_metrics']}")
             
-            # 训练成功，发送最终状态
+            # 训练成功，更新任务状态并发送最终状态
+            final_accuracy = history['val_acc'][-1] if history['val_acc'] else history['train_acc'][-1]
+            final_loss = history['val_loss'][-1] if history['val_loss'] else history['train_loss'][-1]
             end_time = datetime.now()
+            update_task_status(task_id, 3, end_time=end_time, accuracy=final_accuracy, loss=final_loss)
             success_message = {
                 'taskId': task_id,
-                'status': 2, # 成功状态
+                'status': 3, # 完成
                 'endTime': end_time.isoformat(),
+                'accuracy': final_accuracy,
+                'loss': final_loss,
                 'message': '训练成功完成',
-                'finalTrainLoss': epoch_train_loss,
-                'finalTrainAcc': epoch_train_acc,
-                'finalValLoss': epoch_val_loss if val_loader else None,
-                'finalValAcc': epoch_val_acc if val_loader else None
+                'finalTrainLoss': history['train_loss'][-1],
+                'finalTrainAcc': history['train_acc'][-1],
+                'finalValLoss': history['val_loss'][-1] if history['val_loss'] else None,
+                'finalValAcc': history['val_acc'][-1] if history['val_acc'] else None
             }
             socketio.emit('training_status_update', success_message)
-            update_task_status(task_id, 2, end_time=end_time) # 更新数据库状态为成功
             logger.info(f"训练任务 {task_id} 成功完成")
             
+            # 训练完成后不再需要断点
+            if task_id:
+                remove_checkpoints(task_id)
+            
             return history
             
+        except TrainingInterrupted as e:
+            if e.action == 'pause':
+                # 本轮结束的断点已经提交，等待写入完成
+                checkpoint_writer.flush(task_id)
+                update_task_status(task_id, 4)
+            else:
+                checkpoint_writer.flush(task_id)
+                if task_id:
+                    remove_checkpoints(task_id)
+                update_task_status(task_id, 5, end_time=datetime.now())
+            logger.info(f"训练任务 {task_id} {str(e)}（第 {epoch+1} 轮）")
+            socketio.emit('training_status_update', {
+                'taskId': task_id,
+                'status': 4 if e.action == 'pause' else 5,
+                'epoch': epoch + 1 if e.action == 'pause' else epoch,
+                'totalEpochs': epochs,
+                'message': str(e)
+            })
+            raise
         except Exception as e:
             logger.error(f"训练失败: {str(e)}")
+            # 等待已提交的断点写完，保留断点供重试时继续训练
+            checkpoint_writer.flush(task_id)
             # 更新任务状态为失败
-            update_task_status(task_id, 2, end_time=datetime.now(), error_msg=str(e))
+            from utils.db_utils import update_task_status
+            update_task_status(task_id, 2, end_time=datetime.now(), error_message=str(e))
             
             # 发送失败消息
             failure_message = {
@@ -481,36 +949,22 @@ class ModelTrainer:
                 'endTime': datetime.now().isoformat(),
                 'message': f'训练失败: {str(e)}'
             }
-            socketio.emit('training_status_update', failure_message)
+            try:
+                from app import socketio
+                socketio.emit('training_status_update', failure_message)
+            except Exception as emit_error:
+                logger.warning(f"发送训练失败消息失败: {str(emit_error)}")
             raise
         finally:
-            # 清理临时文件等操作可以在这里添加
-            pass
-            
             # 计算总训练时间
             total_time = time.time() - start_time
-            logger.info(f"训练完成，总耗时: {total_time:.2f}秒")
+            logger.info(f"训练结束，总耗时: {total_time:.2f}秒")
             
-            # 更新训练结束时间、精度和损失值
-            from datetime import datetime
-            final_accuracy = history['val_acc'][-1] if history['val_acc'] else history['train_acc'][-1]
-            final_loss = history['val_loss'][-1] if history['val_loss'] else history['train_loss'][-1]
-            
-            # 更新任务状态并发布消息
-            update_task_status(task_id, 3, end_time=datetime.now(), accuracy=final_accuracy, loss=final_loss)
-            completion_message = {
-                'taskId': task_id,
-                'status': 3, # 完成
-                'endTime': datetime.now().isoformat(),
-                'accuracy': final_accuracy,
-                'loss': final_loss,
-                'message': '训练成功完成'
-            }
-            socketio.emit('training_status_update', completion_message)
+            for cache in mmap_caches:
+                cache.release()
             
             # 清理临时数据集目录
             if user_id:
-                import shutil
                 temp_dir = Path(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) / 'temp_datasets' / str(user_id) / str(task_id)
                 if temp_dir.exists():
                     try:
@@ -518,17 +972,22 @@ class ModelTrainer:
                         logger.info(f"已清理临时数据集目录: {temp_dir}")
                     except Exception as e:
                         logger.warning(f"清理临时数据集目录失败: {str(e)}")
-            
-            return history
     
-    def save_model(self, model_name=None, user_id=None, task_id=None):
+    def save_model(self, model_name=None, user_id=None, task_id=None, accuracy=None, wait=True):
         """
         保存模型
         
+        训练线程只把状态复制到CPU，序列化、写入文件和更新数据库由后台写入线程完成
+        
         Args:
             model_name (str, optional): 模型名称，如果为None则使用初始化时的名称
             user_id (str, optional): 用户ID，用于指定保存路径
             task_id (str, optional): 任务ID，用于指定保存路径,用于更新数据库中的model_path字段
+            accuracy (float, optional): 模型的验证准确率，写入classification_model表
+            wait (bool): 是否等待写入完成
+            
+        Returns:
+            str: 模型保存路径
         """
         if model_name is None:
             model_name = self.model_name
@@ -539,156 +998,200 @@ class ModelTrainer:
             save_dir = MODEL_DIR / str(user_id)
             if task_id:
                 save_dir = save_dir / str(task_id)
-            os.makedirs(save_dir, exist_ok=True)
             save_path = save_dir / f"{model_name}.pt"
         else:
             save_path = MODEL_DIR / f"{model_name}.pt"
         
         # 保存模型
         try:
-            # 使用CPU版本的状态字典以避免序列化问题
-            model_state = {k: v.cpu() for k, v in self.model.state_dict().items()}
-            optimizer_state = {k: v.cpu() if torch.is_tensor(v) else v for k, v in self.optimizer.state_dict().items()}
-            
-            # 使用pickle协议版本2，提高兼容性
-            torch.save({
-                'model_state_dict': model_state,
-                'optimizer_state_dict': optimizer_state,
-                'scheduler_state_dict': self.scheduler.state_dict(),
+            snapshot_start = time.perf_counter()
+            state = {
+                'model_state_dict': state_to_cpu(self.model.state_dict()),
+                'optimizer_state_dict': state_to_cpu(self.optimizer.state_dict()),
+                'scheduler_state_dict': copy.deepcopy(self.scheduler.state_dict()),
                 'num_classes': self.num_classes
-            }, save_path, _use_new_zipfile_serialization=False)
-            logger.info(f"模型已保存到: {save_path}")
+            }
+            class_names = None
+            if hasattr(self, 'train_dataset') and hasattr(self.train_dataset, 'class_names'):
+                class_names = list(self.train_dataset.class_names)
+            checkpoint_writer.record_snapshot(task_id, time.perf_counter() - snapshot_start)
             
-            # 如果有任务ID，更新数据库中的model_path
-            if task_id:
-                from utils.db_utils import get_db
-                conn = get_db()
+            future = checkpoint_writer.submit(task_id, self._write_model, save_path, state, task_id, class_names, accuracy)
+            if wait:
+                future.result()
+            return str(save_path)
+        except Exception as e:
+            logger.error(f"保存模型失败: {str(e)}")
+            raise
+    
+    @staticmethod
+    def _write_model(save_path, state, task_id, class_names, accuracy):
+        """
+        写入模型文件并更新数据库（在后台写入线程中执行）
+        
+        定期保存的 _epochN 文件只保留最近 MODEL_EPOCH_KEEP 个
+        
+        Args:
+            save_path (Path): 模型保存路径
+            state (dict): 模型状态，张量均位于CPU
+            task_id (str): 任务ID，为空时不更新数据库
+            class_names (list): 类别名称
+            accuracy (float): 模型的验证准确率
+            
+        Returns:
+            int: 模型文件大小（字节）
+        """
+        size = atomic_save(state, save_path)
+        logger.info(f"模型已保存到: {save_path}")
+        
+        if '_epoch' in save_path.stem:
+            prefix = save_path.stem.rsplit('_epoch', 1)[0]
+            epoch_files = [p for p in save_path.parent.glob(f"{prefix}_epoch*.pt") if p.stem[len(prefix) + 6:].isdigit()]
+            epoch_files.sort(key=lambda p: int(p.stem[len(prefix) + 6:]), reverse=True)
+            for old_path in epoch_files[MODEL_EPOCH_KEEP:]:
                 try:
-                    with conn.cursor() as cursor:
-                        # 先获取当前的parameters，确保不丢失classes信息
-                        cursor.execute('SELECT parameters FROM training_task WHERE id = %s', (task_id,))
-                        row = cursor.fetchone()
-                        if row and row.get('parameters'):
-                            try:
-                                # 记录当前parameters，确保后续操作不会丢失classes信息
-                                logger.info(f"保存模型前的parameters: {row['parameters']}")
-                                
-                                # 解析parameters字段
-                                params = {}
-                                try:
-                                    params = json.loads(row['parameters'])
-                                except json.JSONDecodeError:
-                                    logger.warning(f"参数格式无效，将使用空字典")
-                                    params = {}
-                                except Exception as e:
-                                    logger.error(f"解析parameters字段失败: {e}")
-                                    params = {}
-                                
-                                # 如果训练数据集中有类别信息，添加到parameters中
-                                if hasattr(self, 'train_dataset') and hasattr(self.train_dataset, 'class_names'):
-                                    # 将classes和num_classes信息添加到参数中
-                                    # 确保不覆盖现有参数，只添加classes信息
-                                    params['classes'] = [str(cls) for cls in self.train_dataset.class_names]
-                                    params['num_classes'] = len(self.train_dataset.class_names)
-                                    logger.info(f"添加classes信息: {params['classes']}")
-                                    logger.info(f"添加num_classes信息: {params['num_classes']}")
-                                    
-                                    # 更新数据库
-                                    params_json = json.dumps(params)
-                                    cursor.execute(
-                                        'UPDATE training_task SET parameters = %s WHERE id = %s',
-                                        (params_json, task_id)
-                                    )
-                                    conn.commit()
-                                    affected_rows = cursor.rowcount
-                                    logger.info(f"已更新training_task.parameters: 影响行数={affected_rows}")
-                            except Exception as e:
-                                logger.error(f"更新parameters失败: {str(e)}")
-                        
-                        # 更新training_task表中的model_path字段、progress字段
-                        cursor.execute(
-                            'UPDATE training_task SET model_path = %s, progress = 100 WHERE id = %s',
-                            (str(save_path), task_id)
-                        )
-                        conn.commit()
-                        logger.info(f"已更新任务 {task_id} 的模型路径")
+                    os.remove(old_path)
+                    logger.info(f"已删除旧模型文件: {old_path}")
+                except OSError as e:
+                    logger.warning(f"删除旧模型文件失败 {old_path}: {str(e)}")
+        
+        # 如果有任务ID，更新数据库中的model_path
+        if task_id:
+            ModelTrainer._update_model_record(save_path, task_id, class_names, accuracy)
+        return size
+    
+    @staticmethod
+    def _update_model_record(save_path, task_id, class_names, accuracy):
+        """
+        更新训练任务的模型路径和类别信息，并写入classification_model表
+        
+        Args:
+            save_path (Path): 模型保存路径
+            task_id (str): 任务ID
+            class_names (list): 类别名称
+            accuracy (float): 模型的验证准确率
+        """
+        from utils.db_utils import get_db
+        conn = get_db()
+        try:
+            with conn.cursor() as cursor:
+                # 先获取当前的parameters，确保不丢失classes信息
+                cursor.execute('SELECT parameters FROM training_task WHERE id = %s', (task_id,))
+                row = cursor.fetchone()
+                if row and row.get('parameters'):
+                    try:
+                        # 记录当前parameters，确保后续操作不会丢失classes信息
+                        logger.info(f"保存模型前的parameters: {row['parameters']}")
                         
-                        # 将模型信息插入到classification_model表中
+                        # 解析parameters字段
+                        params = {}
                         try:
-                            # 获取训练任务信息
-                            cursor.execute('SELECT user_id, model_name, parameters FROM training_task WHERE id = %s', (task_id,))
-                            task_info = cursor.fetchone()
+                            params = json.loads(row['parameters'])
+                        except json.JSONDecodeError:
+                            logger.warning(f"参数格式无效，将使用空字典")
+                            params = {}
+                        except Exception as e:
+                            logger.error(f"解析parameters字段失败: {e}")
+                            params = {}
+                        
+                        # 如果训练数据集中有类别信息，添加到parameters中
+                        if class_names is not None:
+                            # 将classes和num_classes信息添加到参数中
+                            # 确保不覆盖现有参数，只添加classes信息
+                            params['classes'] = [str(cls) for cls in class_names]
+                            params['num_classes'] = len(class_names)
+                            logger.info(f"添加classes信息: {params['classes']}")
+                            logger.info(f"添加num_classes信息: {params['num_classes']}")
                             
-                            if task_info:
-                                user_id = task_info['user_id']
-                                model_name = task_info['model_name']
-                                parameters = task_info['parameters']
-                                
-                                # 解析parameters
-                                params_dict = {}
-                                try:
-                                    params_dict = json.loads(parameters)
-                                except Exception as e:
-                                    logger.error(f"解析parameters失败: {str(e)}")
-                                
-                                # 获取classes信息
-                                classes = None
-                                if 'classes' in params_dict:
-                                    classes = json.dumps(params_dict['classes'])
-                                
-                                # 计算模型精度（如果有验证数据）
-                                accuracy = None
-                                if 'valAcc' in params_dict:
-                                    accuracy = params_dict['valAcc']
-                                elif hasattr(self, 'best_val_acc'):
-                                    accuracy = self.best_val_acc
-                                
-                                # 检查是否已经为当前训练任务插入过模型记录
-                                # 由于一个训练任务会保存多个模型文件（best、final等），但我们只需要在数据库中保存一条记录
-                                # 所以我们检查是否已经存在相同训练任务ID的其他模型记录
-                                cursor.execute('SELECT id FROM classification_model WHERE model_path LIKE %s', (f'%{task_id}%',))
-                                existing_model = cursor.fetchone()
-                                
-                                if existing_model:
-                                    # 更新现有模型，包括模型路径
-                                    cursor.execute(
-                                        'UPDATE classification_model SET model_name = %s, model_path = %s, model_type = %s, description = %s, '
-                                        'accuracy = %s, classes = %s, parameters = %s, update_time = NOW() '
-                                        'WHERE id = %s',
-                                        (model_name, str(save_path), 'CNN', f'训练的{model_name}模型', accuracy, classes, parameters, existing_model['id'])
-                                    )
-                                    logger.info(f"已更新classification_model表中的模型信息，ID={existing_model['id']}，新路径={save_path}")
-                                    # 记录日志，帮助调试
-                                    logger.info(f"模型更新成功，任务ID={task_id}, 模型名称={model_name}")
+                            # 更新数据库
+                            params_json = json.dumps(params)
+                            cursor.execute(
+                                'UPDATE training_task SET parameters = %s WHERE id = %s',
+                                (params_json, task_id)
+                            )
+                            conn.commit()
+                            affected_rows = cursor.rowcount
+                            logger.info(f"已更新training_task.parameters: 影响行数={affected_rows}")
+                    except Exception as e:
+                        logger.error(f"更新parameters失败: {str(e)}")
+                
+                # 更新training_task表中的model_path字段、progress字段
+                cursor.execute(
+                    'UPDATE training_task SET model_path = %s, progress = 100 WHERE id = %s',
+                    (str(save_path), task_id)
+                )
+                conn.commit()
+                logger.info(f"已更新任务 {task_id} 的模型路径")
+                
+                # 将模型信息插入到classification_model表中
+                try:
+                    # 获取训练任务信息
+                    cursor.execute('SELECT user_id, model_name, parameters FROM training_task WHERE id = %s', (task_id,))
+                    task_info = cursor.fetchone()
+                    
+                    if task_info:
+                        user_id = task_info['user_id']
+                        model_name = task_info['model_name']
+                        parameters = task_info['parameters']
+                        
+                        # 解析parameters
+                        params_dict = {}
+                        try:
+                            params_dict = json.loads(parameters)
+                        except Exception as e:
+                            logger.error(f"解析parameters失败: {str(e)}")
+                        
+                        # 获取classes信息
+                        classes = None
+                        if 'classes' in params_dict:
+                            classes = json.dumps(params_dict['classes'])
+                        
+                        # 计算模型精度（如果有验证数据）
+                        if 'valAcc' in params_dict:
+                            accuracy = params_dict['valAcc']
+                        
+                        # 检查是否已经为当前训练任务插入过模型记录
+                        # 由于一个训练任务会保存多个模型文件（best、final等），但我们只需要在数据库中保存一条记录
+                        # 所以我们检查是否已经存在相同训练任务ID的其他模型记录
+                        cursor.execute('SELECT id FROM classification_model WHERE model_path LIKE %s', (f'%{task_id}%',))
+                        existing_model = cursor.fetchone()
+                        
+                        if existing_model:
+                            # 更新现有模型，包括模型路径
+                            cursor.execute(
+                                'UPDATE classification_model SET model_name = %s, model_path = %s, model_type = %s, description = %s, '
+                                'accuracy = %s, classes = %s, parameters = %s, update_time = NOW() '
+                                'WHERE id = %s',
+                                (model_name, str(save_path), 'CNN', f'训练的{model_name}模型', accuracy, classes, parameters, existing_model['id'])
+                            )
+                            logger.info(f"已更新classification_model表中的模型信息，ID={existing_model['id']}，新路径={save_path}")
+                            # 记录日志，帮助调试
+                            logger.info(f"模型更新成功，任务ID={task_id}, 模型名称={model_name}")
 
-                                else:
-                                    # 只有在没有现有记录时才插入新模型
-                                    # 这样可以确保每个训练任务只插入一条记录到classification_model表中
-                                    # 即使训练过程中保存了多个模型文件（best、final等）
-                                    cursor.execute(
-                                        'INSERT INTO classification_model (user_id, model_name, model_path, model_type, description, '
-                                        'accuracy, classes, parameters, is_default, status, create_time, update_time) '
-                                        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())',
-                                        (user_id, model_name, str(save_path), 'CNN', f'训练的{model_name}模型', 
-                                         accuracy, classes, parameters, 0, 1)
-                                    )
-                                    logger.info(f"已将模型信息插入到classification_model表中，路径={save_path}")
-                                    # 记录日志，帮助调试
-                                    logger.info(f"模型插入成功，任务ID={task_id}, 模型名称={model_name}")
+                        else:
+                            # 只有在没有现有记录时才插入新模型
+                            # 这样可以确保每个训练任务只插入一条记录到classification_model表中
+                            # 即使训练过程中保存了多个模型文件（best、final等）
+                            cursor.execute(
+                                'INSERT INTO classification_model (user_id, model_name, model_path, model_type, description, '
+                                'accuracy, classes, parameters, is_default, status, create_time, update_time) '
+                                'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())',
+                                (user_id, model_name, str(save_path), 'CNN', f'训练的{model_name}模型', 
+                                 accuracy, classes, parameters, 0, 1)
+                            )
+                            logger.info(f"已将模型信息插入到classification_model表中，路径={save_path}")
+                            # 记录日志，帮助调试
+                            logger.info(f"模型插入成功，任务ID={task_id}, 模型名称={model_name}")
 
-                                
-                                conn.commit()
-                        except Exception as e:
-                            logger.error(f"保存模型信息到classification_model表失败: {str(e)}")
-                            # 不抛出异常，确保主流程不受影响
-                finally:
-                    conn.close()
-            
-            return str(save_path)
-        except Exception as e:
-            logger.error(f"保存模型失败: {str(e)}")
-            raise
+                        
+                        conn.commit()
+                except Exception as e:
+                    logger.error(f"保存模型信息到classification_model表失败: {str(e)}")
+                    # 不抛出异常，确保主流程不受影响
+        finally:
+            conn.close()
     
+
     def evaluate(self, test_data, batch_size=32):
         """
         评估模型
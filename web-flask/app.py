@@ -15,8 +15,10 @@ from flask_socketio import SocketIO # 添加 SocketIO 导入
 # 导入路由模块
 from routes.classify import classify_bp
 from routes.model import model_bp
-from routes.train import train_bp
+from routes.train import train_bp, run_queued_training
+from routes.tiles import tiles_bp
 from utils.db_utils import init_db
+from utils.job_queue import training_queue
 
 # 配置日志
 logging.basicConfig(
@@ -41,6 +43,17 @@ if not os.path.exists(log_dir):
 app.register_blueprint(classify_bp, url_prefix='/api/classify')
 app.register_blueprint(model_bp, url_prefix='/api/model')
 app.register_blueprint(train_bp, url_prefix='/api/train')
+app.register_blueprint(tiles_bp, url_prefix='/api/tiles')
+
+def start_training_queue():
+    """
+    启动训练队列，回收心跳超时的训练作业
+
+    只在提供服务的进程中调用，不能放在模块导入时执行：spawn方式启动的子进程（图表渲染进程、数据加载进程）
+    会重新导入本模块。多进程部署时在各工作进程的启动钩子中调用（如 gunicorn 的 post_worker_init），
+    各进程的槽位共用同一个队列
+    """
+    training_queue.start(app, run_queued_training)
 
 def legacy_train_health_check():
     return jsonify({
@@ -55,6 +68,20 @@ def health_check():
     # 这里可以添加更复杂的健康检查逻辑，例如检查数据库连接、依赖服务等
     return jsonify({"status": "ok", "timestamp": datetime.now().isoformat()})
 
+# 运行指标路由
+@app.route('/api/health/metrics', methods=['GET'])
+def metrics():
+    from algo.preprocessing import shared_image_cache
+    from utils.image_writer import result_writer
+    from algo.checkpoint import checkpoint_writer
+    return jsonify({
+        'image_cache': shared_image_cache.stats(),
+        'result_writer': result_writer.metrics(),
+        'checkpoint_writer': checkpoint_writer.metrics(),
+        'training_queue': training_queue.metrics(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 # 错误处理
 @app.errorhandler(404)
 def not_found(error):
@@ -75,6 +102,8 @@ def server_error(error):
 if __name__ == '__main__':
     # 初始化数据库
     init_db()
+    # 启动训练队列，恢复上次未完成的训练作业
+    start_training_queue()
     # 使用 socketio.run() 启动应用，以便支持 WebSocket
     socketio.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=False)
     # app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -6,14 +6,17 @@
 """
 
 import os
+import re
 import logging
 import json
 import time
 from pathlib import Path
-from flask import Blueprint, request, jsonify, current_app
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Blueprint, request, jsonify, current_app, send_file
 from werkzeug.utils import secure_filename
 from algo.classifier import RemoteSensingClassifier
 from algo.model_loader import get_available_models, get_default_model
+from utils.chart_utils import submit_chart, wait_chart, build_chart_data
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,9 @@ classify_bp = Blueprint('classify', __name__)
 # 允许的文件扩展名
 ALLOWED_EXTENSIONS = {'.tif', '.tiff', '.img', '.jpg', '.jpeg', '.png'}
 
+# 获取图表时等待渲染完成的最长时间（秒）
+CHART_WAIT_SECONDS = 10
+
 # 结果保存目录
 RESULT_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / '../results'
 os.makedirs(RESULT_DIR, exist_ok=True)
@@ -216,7 +222,9 @@ def segment():
         
         # 创建分类器并分割分类
         classifier = RemoteSensingClassifier(model_name=model_name)
-        result = classifier.segment(str(save_path), tile_size=tile_size, overlap=overlap)
+        class_map_path = RESULT_DIR / f"{save_path.stem}_classmap.tif"
+        result = classifier.segment(str(save_path), tile_size=tile_size, overlap=overlap,
+                                    class_map_path=str(class_map_path))
         
         # 添加文件信息
         result['file_info'] = {
@@ -226,6 +234,12 @@ def segment():
             'timestamp': timestamp
         }
         
+        # 类别分布图表：返回前端可直接渲染的数据，PNG在渲染进程池中后台生成
+        digest, _ = submit_chart(result['class_distribution'])
+        result['chart'] = build_chart_data(result['class_distribution'])
+        result['chart']['digest'] = digest
+        result['chart']['image_url'] = f"/api/classify/chart/{digest}.png"
+        
         return jsonify({
             'status': 'success',
             'data': result
@@ -235,4 +249,47 @@ def segment():
         return jsonify({
             'status': 'error',
             'message': f"分割分类失败: {str(e)}"
+        }), 500
+
+@classify_bp.route('/chart/<digest>.png', methods=['GET'])
+def get_chart(digest):
+    """
+    获取类别分布图表图片
+    
+    图表正在渲染时最多等待 CHART_WAIT_SECONDS 秒
+    
+    Args:
+        digest (str): 图表哈希值
+        
+    Returns:
+        Response: PNG图片
+    """
+    try:
+        if not re.fullmatch(r'[0-9a-f]{64}', digest):
+            return jsonify({
+                'status': 'error',
+                'message': '无效的图表标识'
+            }), 400
+        
+        chart_path = wait_chart(digest, timeout=CHART_WAIT_SECONDS)
+        if chart_path is None:
+            return jsonify({
+                'status': 'error',
+                'message': '图表不存在'
+            }), 404
+        
+        response = send_file(str(chart_path), mimetype='image/png')
+        # 内容由哈希值决定，可长期缓存
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+    except FutureTimeoutError:
+        return jsonify({
+            'status': 'pending',
+            'message': '图表正在生成，请稍后重试'
+        }), 202
+    except Exception as e:
+        logger.error(f"获取图表失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f"获取图表失败: {str(e)}"
         }), 500
\ No newline at end of file
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+地图瓦片路由模块
+
+为前端地图组件提供原始影像和分割类别图的XYZ瓦片
+"""
+
+import os
+import logging
+from pathlib import Path
+from flask import Blueprint, request, jsonify, Response
+from werkzeug.utils import secure_filename
+from utils.tile_utils import (
+    tile_cache, make_tile_etag, get_raster_info,
+    render_source_tile, render_class_map_tile, encode_tile
+)
+
+logger = logging.getLogger(__name__)
+
+# 创建蓝图
+tiles_bp = Blueprint('tiles', __name__)
+
+# 结果保存目录（与分类路由一致）
+RESULT_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / '../results'
+
+# 支持的图层
+TILE_LAYERS = ('source', 'classmap')
+
+def resolve_raster_path(layer, filename):
+    """
+    根据图层和上传后的文件名定位栅格文件
+
+    Args:
+        layer (str): 图层名称（'source' 或 'classmap'）
+        filename (str): 分类接口返回的 saved_filename
+
+    Returns:
+        Path: 栅格文件路径，不存在时返回None
+    """
+    safe_name = secure_filename(filename)
+    if not safe_name or safe_name != filename:
+        return None
+    if layer == 'classmap':
+        safe_name = f"{Path(safe_name).stem}_classmap.tif"
+    raster_path = RESULT_DIR / safe_name
+    return raster_path if raster_path.is_file() else None
+
+@tiles_bp.route('/<layer>/<filename>/info', methods=['GET'])
+def tile_info(layer, filename):
+    """
+    获取影像的瓦片信息
+
+    前端地图以像素坐标系（如Leaflet的CRS.Simple）使用瓦片，最大缩放级别时瓦片像素与影像像素一一对应
+
+    Args:
+        layer (str): 图层名称
+        filename (str): 文件名
+
+    Returns:
+        JSON: 影像宽高、最大缩放级别和瓦片大小
+    """
+    try:
+        if layer not in TILE_LAYERS:
+            return jsonify({
+                'status': 'error',
+                'message': f"不支持的图层: {layer}"
+            }), 400
+
+        raster_path = resolve_raster_path(layer, filename)
+        if raster_path is None:
+            return jsonify({
+                'status': 'error',
+                'message': f"文件 {filename} 不存在"
+            }), 404
+
+        return jsonify({
+            'status': 'success',
+            'data': get_raster_info(layer, raster_path)
+        })
+    except Exception as e:
+        logger.error(f"获取瓦片信息失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f"获取瓦片信息失败: {str(e)}"
+        }), 500
+
+@tiles_bp.route('/<layer>/<filename>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_tile(layer, filename, z, x, y):
+    """
+    获取XYZ瓦片
+
+    瓦片按需渲染并缓存，支持 If-None-Match 条件请求
+
+    Args:
+        layer (str): 图层名称
+        filename (str): 文件名
+        z (int): 缩放级别
+        x (int): 瓦片列号
+        y (int): 瓦片行号
+
+    Returns:
+        Response: PNG瓦片
+    """
+    try:
+        if layer not in TILE_LAYERS:
+            return jsonify({
+                'status': 'error',
+                'message': f"不支持的图层: {layer}"
+            }), 400
+
+        raster_path = resolve_raster_path(layer, filename)
+        if raster_path is None:
+            return jsonify({
+                'status': 'error',
+                'message': f"文件 {filename} 不存在"
+            }), 404
+
+        etag = make_tile_etag(layer, raster_path, z, x, y)
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': 'public, max-age=86400'
+        }
+
+        # 客户端缓存仍然有效
+        if etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+        data = tile_cache.get(etag)
+        if data is None:
+            if layer == 'classmap':
+                tile = render_class_map_tile(raster_path, z, x, y)
+            else:
+                tile = render_source_tile(raster_path, z, x, y)
+            data = encode_tile(tile)
+            tile_cache.put(etag, data)
+
+        return Response(data, mimetype='image/png', headers=headers)
+    except Exception as e:
+        logger.error(f"渲染瓦片失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f"渲染瓦片失败: {str(e)}"
+        }), 500
@@ -15,8 +15,10 @@ import random
 from pathlib import Path
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from algo.trainer import ModelTrainer
+from algo.trainer import ModelTrainer, TrainingInterrupted
+from algo.preprocessing import DecodedImageCache
 from utils.db_utils import get_db, update_task_status, get_dataset_info, get_task_parameters # 导入 get_task_parameters
+from utils.job_queue import training_queue, ACTION_PAUSE, ACTION_RESUME, ACTION_CANCEL
 
 logger = logging.getLogger(__name__)
 
@@ -262,11 +264,251 @@ def list_datasets():
             'message': f"获取数据集列表失败: {str(e)}"
         }), 500
 
+# 数据加载参数：请求参数名 -> ModelTrainer.train 的 loader_options 键
+LOADER_PARAMS = {
+    'numWorkers': ('num_workers', int),
+    'pinMemory': ('pin_memory', bool),
+    'persistentWorkers': ('persistent_workers', bool),
+    'prefetchFactor': ('prefetch_factor', int)
+}
+
+def parse_bool(value):
+    """
+    解析布尔参数，兼容字符串形式的 'true'、'1' 等
+
+    Args:
+        value: 参数值
+
+    Returns:
+        bool: 解析结果
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def parse_positive_int(data, db_params, name, snake_name):
+    """
+    从请求参数或任务参数中解析正整数参数
+
+    Args:
+        data (dict): 请求数据
+        db_params (dict): 任务参数
+        name (str): 参数名（驼峰命名）
+        snake_name (str): 参数名（下划线命名）
+
+    Returns:
+        int: 参数值，缺失或无效时返回None
+    """
+    for source in (data, db_params or {}):
+        value = source.get(name, source.get(snake_name))
+        if value is None:
+            continue
+        try:
+            value = int(value)
+            if value > 0:
+                return value
+        except (ValueError, TypeError):
+            pass
+        logger.warning(f"参数 {name} 无效: {value}")
+    return None
+
+def parse_bool_param(data, db_params, name, snake_name, default=False):
+    """
+    从请求参数或任务参数中解析布尔参数
+
+    Args:
+        data (dict): 请求数据
+        db_params (dict): 任务参数
+        name (str): 参数名（驼峰命名）
+        snake_name (str): 参数名（下划线命名）
+        default (bool): 两处都未提供时的默认值
+
+    Returns:
+        bool: 参数值
+    """
+    for source in (data, db_params or {}):
+        value = source.get(name, source.get(snake_name))
+        if value is not None:
+            return parse_bool(value)
+    return default
+
+def parse_loader_options(data, db_params=None):
+    """
+    从请求参数或任务参数中解析数据加载参数
+
+    请求中未提供的参数从任务参数中读取，仍未提供的参数由训练器按平台默认值设置
+
+    Args:
+        data (dict): 请求数据
+        db_params (dict, optional): 任务参数
+
+    Returns:
+        dict: 数据加载参数
+    """
+    options = {}
+    for name, (key, cast) in LOADER_PARAMS.items():
+        value = data.get(name)
+        if value is None and db_params:
+            value = db_params.get(name, db_params.get(key))
+        if value is None:
+            continue
+        try:
+            options[key] = parse_bool(value) if cast is bool else cast(value)
+        except (ValueError, TypeError):
+            logger.warning(f"数据加载参数 {name} 无效: {value}，使用默认值")
+    return options
+
 @train_bp.route('/start', methods=['POST'])
 def start_training():
+    """
+    启动训练任务
+
+    训练任务加入队列后立即返回作业ID，由训练槽位在后台执行
+    
+    Returns:
+        JSON: 作业ID和排队位置
+    """
+    return enqueue_training(request.json)
+
+def enqueue_training(data):
+    """
+    把训练任务加入队列
+    
+    Args:
+        data (dict): 训练参数，priority 为队列优先级（数值大的先执行，默认为0）
+        
+    Returns:
+        JSON: 作业ID和排队位置
+    """
     try:
-        # 获取请求数据
-        data = request.json
+        if not data:
+            return jsonify({
+                'status': 'error',
+                'message': '请求数据无效'
+            }), 400
+        if data.get('datasetId') is None:
+            return jsonify({
+                'status': 'error',
+                'message': '缺少必填参数: datasetId'
+            }), 400
+
+        try:
+            priority = int(data.get('priority', 0))
+        except (ValueError, TypeError):
+            return jsonify({
+                'status': 'error',
+                'message': f"优先级无效: {data.get('priority')}"
+            }), 400
+
+        training_queue.start(current_app._get_current_object(), run_queued_training)
+        task_id = data.get('taskId')
+        job_id = training_queue.submit(data, task_id=task_id, priority=priority)
+        job = training_queue.get_job(job_id)
+        return jsonify({
+            'status': 'success',
+            'message': '训练任务已加入队列',
+            'data': {
+                'jobId': job_id,
+                'taskId': task_id,
+                'jobStatus': job['status'],
+                'position': job['position']
+            }
+        })
+    except Exception as e:
+        logger.error(f"训练任务入队失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f"训练任务入队失败: {str(e)}"
+        }), 500
+
+def run_queued_training(data, stop_signal=None):
+    """
+    执行队列中的训练作业（在训练槽位线程中执行）
+    
+    Args:
+        data (dict): 训练参数
+        stop_signal (callable, optional): 返回暂停或取消请求的函数
+        
+    Raises:
+        RuntimeError: 训练失败
+        TrainingInterrupted: 训练被暂停或取消
+    """
+    response = run_training(data, stop_signal=stop_signal)
+    if isinstance(response, tuple):
+        response, status_code = response
+    else:
+        status_code = response.status_code
+    if status_code >= 400:
+        raise RuntimeError((response.get_json() or {}).get('message', f'训练失败，状态码 {status_code}'))
+
+@train_bp.route('/jobs', methods=['GET'])
+def list_training_jobs():
+    """
+    列出训练作业
+    
+    Returns:
+        JSON: 作业列表和队列统计
+    """
+    try:
+        jobs = training_queue.list_jobs(status=request.args.get('status'), limit=request.args.get('limit', 100, type=int))
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'jobs': jobs,
+                'queue': training_queue.metrics()
+            }
+        })
+    except Exception as e:
+        logger.error(f"获取训练作业列表失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f"获取训练作业列表失败: {str(e)}"
+        }), 500
+
+@train_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_training_job(job_id):
+    """
+    获取训练作业状态
+    
+    Args:
+        job_id (int): 作业ID
+        
+    Returns:
+        JSON: 作业信息
+    """
+    try:
+        job = training_queue.get_job(job_id)
+        if job is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'训练作业 {job_id} 不存在'
+            }), 404
+        return jsonify({
+            'status': 'success',
+            'data': job
+        })
+    except Exception as e:
+        logger.error(f"获取训练作业失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f"获取训练作业失败: {str(e)}"
+        }), 500
+
+def run_training(data, stop_signal=None):
+    """
+    执行训练任务
+
+    任务存在有效断点时从断点继续训练
+    
+    Args:
+        data (dict): 训练参数
+        stop_signal (callable, optional): 返回暂停或取消请求的函数，取消在批次之间检查，暂停在epoch结束时检查
+        
+    Returns:
+        JSON: 训练结果
+    """
+    try:
+        # 检查训练参数
         if not data:
             return jsonify({
                 'status': 'error',
@@ -279,6 +521,7 @@ def start_training():
         epochs = data.get('epochs') # 先获取原始值
         batch_size = data.get('batch_size') # 先获取原始值
         use_pretrained = data.get('usePretrained', True) # 获取 use_pretrained 参数，默认为 True
+        mixed_precision = data.get('mixedPrecision') # 是否使用混合精度训练
         task_id = data.get('taskId')
         dataset_id = data.get('datasetId')
 
@@ -337,6 +580,19 @@ def start_training():
         if not valid_batch_size:
             batch_size = 32 # 使用默认值
             logger.warning(f"任务 {task_id}: batch_size 无效或缺失，使用默认值 32")
+
+        loader_options = parse_loader_options(data, db_params)
+        # 微批次大小和梯度累积步数，batch_size 为有效批次大小
+        micro_batch_size = parse_positive_int(data, db_params, 'microBatchSize', 'micro_batch_size')
+        accumulation_steps = parse_positive_int(data, db_params, 'accumulationSteps', 'accumulation_steps')
+        # 是否缓存解码后的图像，避免每个epoch重复解码（只在主进程加载时生效）
+        cache_images = parse_bool_param(data, db_params, 'cacheImages', 'cache_images')
+        # 是否在训练前把数据集预解码为内存映射缓存
+        mmap_cache = parse_bool_param(data, db_params, 'mmapCache', 'mmap_cache')
+        # 是否把数据集打包为分片后顺序读取
+        use_shards = parse_bool_param(data, db_params, 'useShards', 'use_shards')
+        if mixed_precision is None and db_params:
+            mixed_precision = db_params.get('mixedPrecision', db_params.get('mixed_precision'))
         # --- 参数验证结束 ---
 
         if dataset_id is None:
@@ -372,12 +628,8 @@ def start_training():
                 'message': f"数据集 ID {dataset_id} 不存在"
             }), 404
 
-        # --- 接下来的逻辑中使用 dataset_info['dataset_name'] 等 ---
-        # 使用时间戳和用户ID构建数据集路径 (这部分逻辑需要确认是否正确)
         # 注意：get_dataset_info 返回的是字典，应该用 dataset_info['xxx'] 获取值
-        timestamp = dataset_info.get('timestamp')
         user_id = dataset_info.get('user_id')
-        db_dataset_name = dataset_info.get('dataset_name') # 从数据库获取的名字
 
         # 这里获取数据集路径的逻辑似乎有点问题，通常路径是直接存在数据库里的
         # training_dataset 表里应该有 dataset_path 字段
@@ -481,9 +733,9 @@ def start_training():
                               if img.parent.name == class_name or 
                               (class_name == 'default_class' and img.parent.name == dataset_dir.name)]
                 
-                # 按7:3比例划分训练集和验证集
-                import random
-                random.shuffle(class_images)
+                # 按7:3比例划分训练集和验证集，以任务ID为随机种子，重试任务时划分结果不变
+                class_images.sort()
+                random.Random(task_id).shuffle(class_images)
                 split_idx = int(len(class_images) * 0.7)
                 
                 # 移动文件到对应目录
@@ -562,6 +814,10 @@ def start_training():
                             # 确保不覆盖现有参数，只添加classes信息
                             params['classes'] = [str(cls) for cls in classes]
                             params['num_classes'] = num_classes
+                            # 保存本次使用的数据读取方式，重试或从断点恢复时沿用
+                            params['cacheImages'] = cache_images
+                            params['mmapCache'] = mmap_cache
+                            params['useShards'] = use_shards
                             logger.info(f"添加classes信息: {classes}")
                             logger.info(f"添加num_classes信息: {num_classes}")
                             
@@ -594,6 +850,17 @@ def start_training():
                 finally:
                     conn.close()
             
+            # 打包为分片，训练时按分片顺序读取，避免逐个小文件随机读取；
+            # 类别列表与 num_classes 一致，没有训练图像的类别目录不参与编号
+            if use_shards:
+                from algo.shards import convert_dataset
+                shard_dir = dataset_dir / 'shards'
+                convert_dataset(train_dir, shard_dir / 'train', class_names=classes)
+                train_data = str(shard_dir / 'train')
+                if val_data['images']:
+                    convert_dataset(val_dir, shard_dir / 'val', class_names=classes)
+                    val_data = str(shard_dir / 'val')
+            
             # 创建训练器实例
             trainer = ModelTrainer(
                 model_name=model_name,
@@ -609,6 +876,13 @@ def start_training():
                 batch_size=batch_size, # 确保传递的是整数 batch_size
                 task_id=task_id,
                 user_id=user_id,
+                image_cache=DecodedImageCache() if cache_images else None,
+                loader_options=loader_options,
+                mmap_cache=mmap_cache,
+                mixed_precision=parse_bool(mixed_precision),
+                micro_batch_size=micro_batch_size,
+                accumulation_steps=accumulation_steps,
+                stop_signal=stop_signal,
             )
             
             # 保存训练结果
@@ -634,6 +908,10 @@ def start_training():
                 'data': training_result
             })
             
+        except TrainingInterrupted:
+            # 训练被暂停或取消，清理临时目录（恢复时重新解压，划分结果不变）
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+            raise
         except Exception as train_error:
             # 训练过程中出现错误
             logger.error(f"训练过程错误: {str(train_error)}", exc_info=True)
@@ -643,11 +921,13 @@ def start_training():
             shutil.rmtree(dataset_dir)
             raise train_error  # 继续向上抛出异常
 
+    except TrainingInterrupted:
+        raise
     except Exception as e:
         logger.error(f"训练失败: {str(e)}", exc_info=True) # 记录详细堆栈
         # 更新任务状态为失败(2)
         # 确保 task_id 存在才更新
-        task_id_for_update = data.get('taskId') if 'data' in locals() else None
+        task_id_for_update = (data or {}).get('taskId')
         if task_id_for_update:
              update_task_status(task_id=task_id_for_update, status=2, error_message=str(e))
         return jsonify({
@@ -703,6 +983,9 @@ def delete_train_task(task_id):
         JSON: 删除结果
     """
     try:
+        # 先取消排队中或运行中的训练作业
+        training_queue.control(task_id, ACTION_CANCEL)
+        
         # 删除数据库记录
         from utils.db_utils import delete_train_task
         if delete_train_task(task_id):
@@ -724,6 +1007,50 @@ def delete_train_task(task_id):
             'message': '删除训练任务失败'
         }), 500
 
+@train_bp.route('/train-task/<int:task_id>/<action>', methods=['POST'])
+def control_train_task(task_id, action):
+    """
+    暂停、恢复或取消训练任务
+
+    运行中的任务暂停时在当前epoch结束后保存断点并释放训练槽位，恢复后重新排队并从下一轮继续；
+    取消时在当前批次结束后停止，删除断点和临时数据集
+    
+    Args:
+        task_id (int): 任务ID
+        action (str): 操作，pause、resume 或 cancel
+        
+    Returns:
+        JSON: 作业状态
+    """
+    if action not in (ACTION_PAUSE, ACTION_RESUME, ACTION_CANCEL):
+        return jsonify({
+            'status': 'error',
+            'message': f'不支持的操作: {action}'
+        }), 400
+    try:
+        job = training_queue.control(task_id, action)
+        if job is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'训练任务 {task_id} 没有训练作业'
+            }), 404
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'jobId': job['id'],
+                'taskId': task_id,
+                'jobStatus': job['status'],
+                'requested': job['control'],
+                'position': job['position']
+            }
+        })
+    except Exception as e:
+        logger.error(f"训练任务操作失败: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': f"训练任务操作失败: {str(e)}"
+        }), 500
+
 @train_bp.route('/retry/<int:task_id>', methods=['POST'])
 def retry_training(task_id):
     """
@@ -759,25 +1086,22 @@ def retry_training(task_id):
                         'message': '只能重试失败的训练任务'
                     }), 400
                 
-                # 重置任务状态
-                update_task_status(task_id=task_id, status=0)  # 0表示待训练状态
-                
-                # 准备重试参数
+                # 准备重试参数，缺少的参数由 run_training 从任务参数中读取
                 retry_data = {
                     'taskId': task_id,
-                    'datasetId': task['dataset_id'],
-                    'dataset_name': task['dataset_name'],
-                    'model_name': task['model_name'],
-                    'epochs': task['epochs'],
-                    'batch_size': task['batch_size'],
-                    'learning_rate': task['learning_rate'], # 添加 learning_rate
-                    'use_pretrained': task['use_pretrained'] # 添加 use_pretrained
+                    'datasetId': task.get('dataset_id'),
+                    'dataset_name': task.get('dataset_name'),
+                    'model_name': task.get('model_name'),
+                    'epochs': task.get('epochs'),
+                    'batch_size': task.get('batch_size'),
+                    'learning_rate': task.get('learning_rate'),
+                    'usePretrained': task.get('use_pretrained', True)
                 }
-                
-                # 开始重新训练
-                return start_training(retry_data)
         finally:
             conn.close()
+        
+        # 重新加入训练队列，存在有效断点时从断点继续
+        return enqueue_training(retry_data)
     except Exception as e:
         logger.error(f"重试训练任务失败: {str(e)}")
         return jsonify({
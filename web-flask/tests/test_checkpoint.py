@@ -0,0 +1,73 @@
+import pytest
+import torch
+
+from algo import checkpoint
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'CHECKPOINT_DIR', tmp_path / 'checkpoints')
+    monkeypatch.setattr(checkpoint, 'LEGACY_CHECKPOINT_DIR', tmp_path / 'legacy')
+    return tmp_path
+
+
+def _state(epoch, model_name='resnet18', num_classes=3):
+    return {
+        'epoch': epoch,
+        'model_name': model_name,
+        'num_classes': num_classes,
+        'model_state_dict': {'weight': torch.full((2,), float(epoch))},
+        'optimizer_state_dict': {},
+        'scheduler_state_dict': {},
+        'history': {'train_loss': [0.5] * epoch},
+        'best_val_acc': 0.0
+    }
+
+
+def _epochs(task_id):
+    return [int(path.stem[len('checkpoint_epoch'):]) for path in checkpoint.list_checkpoints(task_id)]
+
+
+def test_select_retained():
+    entries = [('e1', 1, 0.9), ('e2', 2, 0.5), ('e3', 3, None), ('e4', 4, 0.6)]
+    assert checkpoint.select_retained(entries, 2) == {'e3', 'e4'}
+    assert checkpoint.select_retained(entries, 2, keep_best=1) == {'e1', 'e3', 'e4'}
+
+
+def test_retention_keeps_latest_and_best():
+    for epoch, metric in [(1, 0.7), (2, 0.9), (3, 0.6), (4, 0.8), (5, 0.5)]:
+        checkpoint.save_checkpoint(_state(epoch), 1, metric=metric, keep=2, keep_best=1)
+    assert _epochs(1) == [5, 4, 2]
+
+    index = checkpoint._read_index(checkpoint.get_checkpoint_dir(1))
+    assert sorted(info['epoch'] for info in index.values()) == [2, 4, 5]
+
+
+def test_load_latest_skips_invalid_checkpoints():
+    checkpoint.save_checkpoint(_state(1), 1, keep=3)
+    checkpoint.save_checkpoint(_state(2, num_classes=5), 1, keep=3)
+    corrupt = checkpoint.get_checkpoint_dir(1) / 'checkpoint_epoch0003.pt'
+    corrupt.write_bytes(b'not a checkpoint')
+
+    state = checkpoint.load_latest_checkpoint(1, 'resnet18', 3)
+    assert state['epoch'] == 1
+    assert torch.equal(state['model_state_dict']['weight'], torch.full((2,), 1.0))
+    assert checkpoint.load_latest_checkpoint(1, 'vgg16', 3) is None
+
+
+def test_remove_checkpoints():
+    checkpoint.save_checkpoint(_state(1), 1)
+    checkpoint.save_checkpoint(_state(1), 2)
+    checkpoint.remove_checkpoints(1)
+    assert checkpoint.list_checkpoints(1) == []
+    assert _epochs(2) == [1]
+
+
+def test_legacy_checkpoints_are_migrated(checkpoint_dir):
+    legacy_task_dir = checkpoint_dir / 'legacy' / '9'
+    legacy_task_dir.mkdir(parents=True)
+    torch.save(dict(_state(2), version=checkpoint.CHECKPOINT_VERSION), legacy_task_dir / 'checkpoint_epoch0002.pt')
+
+    assert checkpoint.load_latest_checkpoint(9, 'resnet18', 3)['epoch'] == 2
+    assert not legacy_task_dir.exists()
+    assert (checkpoint_dir / 'checkpoints' / '9' / 'checkpoint_epoch0002.pt').exists()
@@ -0,0 +1,197 @@
+import sys
+import time
+import types
+import sqlite3
+import threading
+from contextlib import nullcontext
+import pytest
+
+from utils import job_queue
+from utils.job_queue import TrainingJobQueue
+
+
+class FakeApp:
+    def app_context(self):
+        return nullcontext()
+
+
+@pytest.fixture
+def task_updates(monkeypatch):
+    """替换 utils.db_utils 和 algo.checkpoint，记录训练任务状态更新"""
+    updates = []
+    db_utils = types.ModuleType('utils.db_utils')
+    db_utils.update_task_status = lambda task_id, status, **kwargs: updates.append((task_id, status))
+    checkpoint = types.ModuleType('algo.checkpoint')
+    checkpoint.remove_checkpoints = lambda task_id: updates.append((task_id, 'removed'))
+    monkeypatch.setitem(sys.modules, 'utils.db_utils', db_utils)
+    monkeypatch.setitem(sys.modules, 'algo.checkpoint', checkpoint)
+    return updates
+
+
+def _make_queue(tmp_path, owner):
+    queue = TrainingJobQueue(db_path=tmp_path / 'train_jobs.db', slots=1)
+    queue._owner = lambda: owner
+    return queue
+
+
+def _set_heartbeat(db_path, job_id, heartbeat_at):
+    conn = sqlite3.connect(str(db_path), isolation_level=None)
+    try:
+        conn.execute('UPDATE train_job SET heartbeat_at = ? WHERE id = ?', (heartbeat_at, job_id))
+    finally:
+        conn.close()
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_claim_order(tmp_path, task_updates):
+    queue = _make_queue(tmp_path, 'host:a')
+    low = queue.submit({'n': 1}, task_id=1)
+    high = queue.submit({'n': 2}, task_id=2, priority=5)
+    low_later = queue.submit({'n': 3}, task_id=3)
+
+    assert queue.get_job(low_later)['position'] == 3
+    assert [queue._claim()['id'] for _ in range(3)] == [high, low, low_later]
+    assert queue._claim() is None
+    job = queue.get_job(high)
+    assert job['status'] == job_queue.JOB_RUNNING
+    assert job['owner'] == 'host:a'
+    assert job['payload'] == {'n': 2}
+
+
+def test_expired_lease_is_requeued(tmp_path, task_updates):
+    queue_a = _make_queue(tmp_path, 'host:a')
+    queue_b = _make_queue(tmp_path, 'host:b')
+    job_id = queue_a.submit({}, task_id=1)
+    queue_a._claim()
+
+    # 心跳未超时的作业不被回收
+    queue_b._recover()
+    assert queue_b.get_job(job_id)['status'] == job_queue.JOB_RUNNING
+
+    _set_heartbeat(queue_a.db_path, job_id, time.time() - job_queue.LEASE_TIMEOUT - 1)
+    queue_b._recover()
+    job = queue_b.get_job(job_id)
+    assert job['status'] == job_queue.JOB_QUEUED
+    assert job['owner'] is None
+    assert (1, job_queue.TASK_STATUS[job_queue.JOB_QUEUED]) in task_updates
+
+    # 被回收的作业由其他进程取出后，原进程不能覆盖其状态
+    assert queue_b._claim()['id'] == job_id
+    queue_a._finish(job_id, job_queue.JOB_FAILED, 'lost')
+    job = queue_b.get_job(job_id)
+    assert job['status'] == job_queue.JOB_RUNNING
+    assert job['owner'] == 'host:b'
+
+
+def test_expired_lease_applies_pending_control(tmp_path, task_updates):
+    queue_a = _make_queue(tmp_path, 'host:a')
+    queue_b = _make_queue(tmp_path, 'host:b')
+    job_id = queue_a.submit({}, task_id=1)
+    queue_a._claim()
+    queue_b.control(1, job_queue.ACTION_PAUSE)
+
+    _set_heartbeat(queue_a.db_path, job_id, time.time() - job_queue.LEASE_TIMEOUT - 1)
+    queue_b._recover()
+    assert queue_b.get_job(job_id)['status'] == job_queue.JOB_PAUSED
+
+
+def test_heartbeat_updates_own_jobs(tmp_path, task_updates, monkeypatch):
+    monkeypatch.setattr(job_queue, 'HEARTBEAT_INTERVAL', 0.05)
+    queue_a = _make_queue(tmp_path, 'host:a')
+    queue_b = _make_queue(tmp_path, 'host:b')
+    own = queue_a.submit({}, task_id=1)
+    other = queue_a.submit({}, task_id=2)
+    queue_a._claim()
+    queue_b._claim()
+    _set_heartbeat(queue_a.db_path, own, 0.0)
+    _set_heartbeat(queue_a.db_path, other, time.time())
+
+    heartbeat = threading.Thread(target=queue_a._heartbeat, daemon=True)
+    heartbeat.start()
+    try:
+        assert _wait_for(lambda: queue_a.get_job(own)['heartbeat_at'] > 0)
+    finally:
+        queue_a.stop()
+        heartbeat.join()
+    assert queue_a.get_job(own)['status'] == job_queue.JOB_RUNNING
+    assert queue_a.get_job(other)['owner'] == 'host:b'
+
+
+def test_control_queued_and_paused_jobs(tmp_path, task_updates):
+    queue = _make_queue(tmp_path, 'host:a')
+    job_id = queue.submit({}, task_id=7)
+
+    assert queue.control(7, job_queue.ACTION_PAUSE)['status'] == job_queue.JOB_PAUSED
+    assert queue.control(7, job_queue.ACTION_RESUME)['status'] == job_queue.JOB_QUEUED
+    assert queue.control(7, job_queue.ACTION_RESUME)['status'] == job_queue.JOB_QUEUED
+    queue.control(7, job_queue.ACTION_PAUSE)
+    assert queue.control(7, job_queue.ACTION_CANCEL)['status'] == job_queue.JOB_CANCELLED
+    assert (7, 'removed') in task_updates
+    assert queue.control(8, job_queue.ACTION_CANCEL) is None
+    assert queue.get_job(job_id)['position'] is None
+
+
+def test_control_reaches_job_in_other_process(tmp_path, task_updates, monkeypatch):
+    monkeypatch.setattr(job_queue, 'CONTROL_POLL_SECONDS', 0.0)
+    queue_a = _make_queue(tmp_path, 'host:a')
+    queue_b = _make_queue(tmp_path, 'host:b')
+    job_id = queue_a.submit({}, task_id=1)
+    queue_a._claim()
+    stop_signal = queue_a._stop_signal(job_id)
+    assert stop_signal() is None
+
+    job = queue_b.control(1, job_queue.ACTION_CANCEL)
+    assert job['status'] == job_queue.JOB_RUNNING
+    assert job['control'] == job_queue.ACTION_CANCEL
+    assert stop_signal() == job_queue.ACTION_CANCEL
+
+
+def test_paused_job_resumes_and_completes(tmp_path, task_updates, monkeypatch):
+    monkeypatch.setattr(job_queue, 'POLL_INTERVAL', 0.05)
+    runs = []
+
+    def runner(payload, stop_signal):
+        runs.append(payload)
+        if len(runs) == 1:
+            while stop_signal() is None:
+                time.sleep(0.01)
+            raise RuntimeError('stopped')
+
+    queue = _make_queue(tmp_path, 'host:a')
+    job_id = queue.submit({'epochs': 1}, task_id=3)
+    queue.start(FakeApp(), runner)
+    try:
+        assert _wait_for(lambda: runs)
+        queue.control(3, job_queue.ACTION_PAUSE)
+        assert _wait_for(lambda: queue.get_job(job_id)['status'] == job_queue.JOB_PAUSED)
+        assert queue.get_job(job_id)['error_message'] is None
+
+        queue.control(3, job_queue.ACTION_RESUME)
+        assert _wait_for(lambda: queue.get_job(job_id)['status'] == job_queue.JOB_DONE)
+    finally:
+        queue.stop()
+    assert runs == [{'epochs': 1}, {'epochs': 1}]
+
+
+def test_failed_job_records_error(tmp_path, task_updates, monkeypatch):
+    monkeypatch.setattr(job_queue, 'POLL_INTERVAL', 0.05)
+
+    def runner(payload, stop_signal):
+        raise ValueError('bad dataset')
+
+    queue = _make_queue(tmp_path, 'host:a')
+    job_id = queue.submit({}, task_id=4)
+    queue.start(FakeApp(), runner)
+    try:
+        assert _wait_for(lambda: queue.get_job(job_id)['status'] == job_queue.JOB_FAILED)
+    finally:
+        queue.stop()
+    assert queue.get_job(job_id)['error_message'] == 'bad dataset'
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+图表工具模块
+
+在独立进程池中使用无界面后端渲染类别分布图表，按分布数据的哈希缓存渲染结果，
+并提供供ECharts前端直接渲染的紧凑数据
+"""
+
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError as FutureTimeoutError
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+logger = logging.getLogger(__name__)
+
+# 图表缓存目录
+CHART_CACHE_DIR = Path(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) / 'results' / 'charts'
+
+# 图表缓存总大小上限，超出后按最近使用时间淘汰
+CHART_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# 渲染中标记文件的有效期（秒），超过该时间仍未完成视为渲染所在的服务进程已退出
+CHART_PENDING_TIMEOUT = 120
+
+# 等待其他服务进程渲染时检查结果的间隔（秒）
+CHART_POLL_INTERVAL = 0.2
+
+# 渲染进程数
+CHART_WORKERS = 2
+
+# 默认渲染分辨率
+CHART_DPI = 300
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 本进程正在渲染的图表，避免同一数据重复提交；其他服务进程通过缓存目录中的标记文件得知
+_pending = {}
+
+def chart_digest(class_distribution, dpi=CHART_DPI):
+    """
+    计算类别分布数据的哈希值，作为缓存键
+
+    Args:
+        class_distribution (dict): 类别分布，键为类别名称，值为百分比
+        dpi (int): 渲染分辨率
+
+    Returns:
+        str: SHA-256哈希值
+    """
+    payload = json.dumps({
+        'data': sorted((str(k), round(float(v), 4)) for k, v in class_distribution.items()),
+        'dpi': dpi
+    }, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def build_chart_data(class_distribution):
+    """
+    生成供ECharts前端渲染的紧凑图表数据
+
+    Args:
+        class_distribution (dict): 类别分布，键为类别名称，值为百分比
+
+    Returns:
+        dict: 类别名称列表和对应的百分比列表
+    """
+    return {
+        'categories': [str(k) for k in class_distribution.keys()],
+        'values': [round(float(v), 2) for v in class_distribution.values()]
+    }
+
+def draw_class_distribution_chart(class_distribution):
+    """
+    绘制类别分布柱状图
+
+    直接创建 Figure 对象而不经过 pyplot，图表不会注册到全局状态，不再使用后即可被回收
+
+    Args:
+        class_distribution (dict): 类别分布，键为类别名称，值为百分比
+
+    Returns:
+        matplotlib.figure.Figure: 图表对象
+    """
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    # 准备数据
+    classes = list(class_distribution.keys())
+    percentages = list(class_distribution.values())
+
+    # 创建柱状图
+    bars = ax.bar(classes, percentages, color='skyblue')
+
+    # 添加数据标签
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., height + 1,
+                f'{height:.1f}%', ha='center', va='bottom')
+
+    # 设置标题和标签
+    ax.set_title('类别分布', fontsize=16)
+    ax.set_xlabel('类别', fontsize=12)
+    ax.set_ylabel('百分比 (%)', fontsize=12)
+
+    # 设置Y轴范围
+    ax.set_ylim(0, max(percentages) * 1.2 if percentages and max(percentages) > 0 else 1)
+
+    # 旋转X轴标签
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+
+    # 调整布局
+    fig.tight_layout()
+    return fig
+
+def render_chart_png(class_distribution, dpi=CHART_DPI):
+    """
+    渲染类别分布图表为PNG数据（在渲染进程中执行）
+
+    Args:
+        class_distribution (dict): 类别分布，键为类别名称，值为百分比
+        dpi (int): 渲染分辨率
+
+    Returns:
+        bytes: PNG数据
+    """
+    fig = draw_class_distribution_chart(class_distribution)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    fig.clear()
+    return buffer.getvalue()
+
+def _touch(chart_path):
+    """
+    更新缓存图表的最近使用时间
+    """
+    try:
+        os.utime(chart_path)
+    except OSError:
+        pass
+
+def get_chart_path(digest):
+    """
+    获取缓存图表文件路径
+
+    Args:
+        digest (str): 图表哈希值
+
+    Returns:
+        Path: 图表文件路径
+    """
+    return CHART_CACHE_DIR / f"{digest}.png"
+
+def _get_marker_path(digest):
+    """
+    获取渲染中标记文件路径
+    """
+    return CHART_CACHE_DIR / f"{digest}.pending"
+
+def _marker_alive(marker_path):
+    """
+    判断渲染中标记是否存在且未过期
+    """
+    try:
+        return time.time() - marker_path.stat().st_mtime < CHART_PENDING_TIMEOUT
+    except OSError:
+        return False
+
+def _get_executor():
+    """
+    获取渲染进程池（首次使用时创建）
+
+    使用spawn方式创建子进程：服务进程中有多个线程并已加载torch/CUDA，fork出的子进程可能继承被占用的锁
+
+    Returns:
+        ProcessPoolExecutor: 进程池
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def prune_chart_cache(max_bytes=CHART_CACHE_MAX_BYTES):
+    """
+    按最近使用时间淘汰缓存图表，直到总大小不超过上限
+
+    Args:
+        max_bytes (int): 缓存总大小上限
+    """
+    if not CHART_CACHE_DIR.exists():
+        return
+    entries = []
+    for chart_path in CHART_CACHE_DIR.glob('*.png'):
+        try:
+            stat = chart_path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, chart_path, stat.st_size))
+
+    total = sum(size for _, _, size in entries)
+    for _, chart_path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(chart_path)
+            total -= size
+        except OSError:
+            pass
+
+def _store_chart(digest, future):
+    """
+    渲染完成回调：原子写入缓存文件
+
+    Args:
+        digest (str): 图表哈希值
+        future (Future): 渲染任务
+    """
+    try:
+        if future.exception() is not None:
+            logger.error(f"渲染类别分布图表失败: {future.exception()}")
+            return
+        os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+        chart_path = get_chart_path(digest)
+        tmp_path = chart_path.with_suffix('.png.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(future.result())
+        os.replace(tmp_path, chart_path)
+        prune_chart_cache()
+    except Exception as e:
+        logger.error(f"保存类别分布图表失败: {str(e)}")
+    finally:
+        with _executor_lock:
+            _pending.pop(digest, None)
+            try:
+                os.remove(_get_marker_path(digest))
+            except OSError:
+                pass
+
+def submit_chart(class_distribution, dpi=CHART_DPI):
+    """
+    提交类别分布图表渲染任务
+
+    已缓存的图表直接返回已完成的Future，相同数据正在渲染时复用同一个任务
+
+    Args:
+        class_distribution (dict): 类别分布，键为类别名称，值为百分比
+        dpi (int): 渲染分辨率
+
+    Returns:
+        tuple: (图表哈希值, Future)，Future的结果为图表文件路径
+    """
+    digest = chart_digest(class_distribution, dpi)
+    chart_path = get_chart_path(digest)
+    if chart_path.exists():
+        _touch(chart_path)
+        done = Future()
+        done.set_result(chart_path)
+        return digest, done
+
+    executor = _get_executor()
+    with _executor_lock:
+        pending = _pending.get(digest)
+        if pending is not None:
+            return digest, pending
+
+        result = Future()
+        render = executor.submit(render_chart_png, dict(class_distribution), dpi)
+
+        def on_done(f):
+            _store_chart(digest, f)
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                result.set_result(chart_path)
+
+        _pending[digest] = result
+        try:
+            os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+            _get_marker_path(digest).touch()
+        except OSError as e:
+            logger.warning(f"创建图表渲染标记失败: {str(e)}")
+    render.add_done_callback(on_done)
+    return digest, result
+
+def wait_chart(digest, timeout=None):
+    """
+    等待图表渲染完成
+
+    渲染任务可能由其他服务进程提交，此时按缓存目录中的标记文件轮询渲染结果
+
+    Args:
+        digest (str): 图表哈希值
+        timeout (float, optional): 最长等待秒数
+
+    Returns:
+        Path: 图表文件路径，图表不存在且没有对应的渲染任务时返回None
+
+    Raises:
+        concurrent.futures.TimeoutError: 等待超时，图表仍在渲染
+    """
+    chart_path = get_chart_path(digest)
+    if chart_path.exists():
+        return chart_path
+    with _executor_lock:
+        pending = _pending.get(digest)
+    if pending is not None:
+        return pending.result(timeout=timeout)
+
+    marker_path = _get_marker_path(digest)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while _marker_alive(marker_path):
+        if chart_path.exists():
+            return chart_path
+        if deadline is not None and time.monotonic() >= deadline:
+            raise FutureTimeoutError()
+        time.sleep(CHART_POLL_INTERVAL)
+    return chart_path if chart_path.exists() else None
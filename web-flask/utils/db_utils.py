@@ -76,7 +76,7 @@ def update_task_status(task_id, status, error_message=None, start_time=None, end
     
     Args:
         task_id (int): 任务ID
-        status (int): 任务状态（0：等待中，1：进行中，2：失败，3：成功）
+        status (int): 任务状态（0：等待中，1：进行中，2：失败，3：成功，4：已暂停，5：已取消）
         error_message (str, optional): 错误信息
         start_time (datetime, optional): 开始时间
         end_time (datetime, optional): 结束时间
@@ -91,7 +91,9 @@ def update_task_status(task_id, status, error_message=None, start_time=None, end
                 0: 'PENDING',
                 1: 'RUNNING',
                 2: 'FAILED',
-                3: 'COMPLETED'
+                3: 'COMPLETED',
+                4: 'PAUSED',
+                5: 'CANCELLED'
             }
             task_status = status_map.get(status, 'PENDING')
             
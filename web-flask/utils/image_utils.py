@@ -11,8 +11,9 @@ import numpy as np
 import cv2
 from pathlib import Path
 from osgeo import gdal
-import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
+from utils.chart_utils import draw_class_distribution_chart
+from utils.image_writer import write_image, result_writer, FORMAT_ALIASES
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +28,58 @@ CLASS_COLORS = {
     6: [255, 0, 255]     # 其他 - 紫色
 }
 
+# 类别图中无预测结果的单元值
+CLASS_MAP_NODATA = 255
+
+# 分块渲染时每个窗口的行数
+RENDER_WINDOW_ROWS = 512
+
+# 内存图像重采样时每个子窗口的最大边长（cv2.remap 的源图像和映射表每边不能超过 32767 像素）
+RESAMPLE_WINDOW_SIZE = 4096
+
+def build_class_palette(class_colors=None):
+    """
+    构建类别颜色查找表
+    
+    查找表长度为257：下标0-255对应类别ID，最后一项为黑色，用于越界的类别ID
+    
+    Args:
+        class_colors (dict, optional): 类别颜色映射，默认使用 CLASS_COLORS
+        
+    Returns:
+        numpy.ndarray: 颜色查找表，形状为 (257, 3)，uint8类型
+    """
+    if class_colors is None:
+        class_colors = CLASS_COLORS
+    palette = np.zeros((257, 3), dtype=np.uint8)
+    for class_id, color in class_colors.items():
+        if 0 <= class_id < 256:
+            palette[class_id] = color
+    return palette
+
+# 类别颜色查找表
+CLASS_PALETTE = build_class_palette()
+
+def colorize_class_map(class_map, palette=None):
+    """
+    使用查找表将类别图转换为彩色图
+    
+    一次索引操作完成着色，未定义颜色的类别ID为黑色
+    
+    Args:
+        class_map (numpy.ndarray): 类别图，形状为 (H, W)，值为类别ID
+        palette (numpy.ndarray, optional): 颜色查找表，默认使用 CLASS_PALETTE
+        
+    Returns:
+        numpy.ndarray: 彩色类别图，形状为 (H, W, 3)
+    """
+    if palette is None:
+        palette = CLASS_PALETTE
+    if class_map.dtype == np.uint8:
+        return palette[class_map]
+    # 越界ID统一映射到查找表最后一项（黑色）
+    return np.take(palette, np.clip(class_map, -1, len(palette) - 1), axis=0, mode='wrap')
+
 def read_image(image_path):
     """
     读取图像文件
@@ -126,46 +179,59 @@ def read_with_opencv(image_path):
         logger.error(f"OpenCV读取图像失败: {str(e)}")
         raise
 
-def save_image(image, save_path, format=None):
+def save_image(image, save_path, format=None, options=None):
     """
     保存图像
     
+    png、webp、jpg、tiff 先写入临时文件再重命名，写入过程中目标路径上不会出现不完整的文件；
+    其他格式（如bmp）由OpenCV按文件扩展名直接写入
+    
     Args:
         image (numpy.ndarray): 图像数据，形状为 (H, W, C)
         save_path (str or Path): 保存路径
-        format (str, optional): 图像格式，如果为None则根据文件扩展名确定
+        format (str, optional): 图像格式（png、webp、jpg、tiff），如果为None则根据文件扩展名确定
+        options (dict, optional): 编码选项，如PNG压缩级别 {'compression': 6}、
+            无损WebP {'lossless': True}、GeoTIFF压缩 {'compress': 'DEFLATE', 'zlevel': 6}
         
     Returns:
         bool: 是否成功保存
     """
     try:
         save_path = Path(save_path)
+        if format is None and save_path.suffix and save_path.suffix.lower().lstrip('.') not in FORMAT_ALIASES:
+            os.makedirs(save_path.parent, exist_ok=True)
+            
+            # 转换为BGR格式（OpenCV使用BGR）
+            if len(image.shape) == 3 and image.shape[2] == 3:
+                image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            else:
+                image_bgr = image
+            
+            return bool(cv2.imwrite(str(save_path), image_bgr))
         
-        # 确保目录存在
-        os.makedirs(save_path.parent, exist_ok=True)
-        
-        # 确定图像格式
-        if format is None:
-            format = save_path.suffix.lower().lstrip('.')
-            if not format:
-                format = 'png'
-                save_path = save_path.with_suffix('.png')
-        
-        # 转换为BGR格式（OpenCV使用BGR）
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        else:
-            image_bgr = image
-        
-        # 保存图像
-        cv2.imwrite(str(save_path), image_bgr)
-        
+        write_image(image, save_path, format=format, options=options)
         return True
         
     except Exception as e:
         logger.error(f"保存图像失败: {str(e)}")
         return False
 
+def save_image_async(image, save_path, format=None, options=None, callback=None):
+    """
+    在后台写入队列中保存图像，立即返回
+    
+    Args:
+        image (numpy.ndarray): 图像数据，形状为 (H, W, C)
+        save_path (str or Path): 保存路径
+        format (str, optional): 图像格式，如果为None则根据文件扩展名确定
+        options (dict, optional): 编码选项，同 save_image
+        callback (callable, optional): 完成回调，参数为 (保存路径, 异常)
+        
+    Returns:
+        concurrent.futures.Future: 结果为实际保存路径
+    """
+    return result_writer.submit(image, save_path, format=format, options=options, callback=callback)
+
 def resize_image(image, size):
     """
     调整图像大小
@@ -183,7 +249,7 @@ def resize_image(image, size):
         logger.error(f"调整图像大小失败: {str(e)}")
         raise
 
-def create_classification_visualization(image, class_id, save_path=None):
+def create_classification_visualization(image, class_id, save_path=None, async_save=False, callback=None):
     """
     创建分类结果可视化图像
     
@@ -191,6 +257,8 @@ def create_classification_visualization(image, class_id, save_path=None):
         image (numpy.ndarray): 原始图像
         class_id (int): 类别ID
         save_path (str or Path, optional): 保存路径，如果为None则不保存
+        async_save (bool): 是否在后台写入队列中保存，不阻塞调用方
+        callback (callable, optional): 后台保存完成回调，参数为 (保存路径, 异常)
         
     Returns:
         numpy.ndarray: 可视化图像
@@ -214,7 +282,10 @@ def create_classification_visualization(image, class_id, save_path=None):
         
         # 保存图像
         if save_path is not None:
-            save_image(vis_image, save_path)
+            if async_save:
+                save_image_async(vis_image, save_path, callback=callback)
+            else:
+                save_image(vis_image, save_path)
         
         return vis_image
         
@@ -222,39 +293,178 @@ def create_classification_visualization(image, class_id, save_path=None):
         logger.error(f"创建分类可视化失败: {str(e)}")
         raise
 
-def create_segmentation_visualization(image, class_map, save_path=None, alpha=0.5):
+def _open_raster_source(image):
+    """
+    打开渲染用的栅格数据源
+    
+    Args:
+        image (numpy.ndarray or str or Path): 图像数组，或可由GDAL读取的栅格文件路径
+        
+    Returns:
+        tuple: (高度, 宽度, 重采样读取函数, GDAL数据集或None)，
+            读取函数参数为 (目标高度, 目标宽度, 目标窗口起始行, 目标窗口结束行)
+    """
+    if isinstance(image, np.ndarray):
+        def read_resampled(dst_h, dst_w, y0, y1):
+            return _remap_rows(image, dst_h, dst_w, y0, y1)
+        return image.shape[0], image.shape[1], read_resampled, None
+    
+    dataset = gdal.Open(str(image), gdal.GA_ReadOnly)
+    if dataset is None:
+        raise IOError(f"无法打开影像文件: {image}")
+    band_count = dataset.RasterCount
+    if band_count < 1:
+        raise ValueError(f"影像文件没有有效波段: {image}")
+    height, width = dataset.RasterYSize, dataset.RasterXSize
+    
+    def read_resampled(dst_h, dst_w, y0, y1):
+        # 只读取目标窗口覆盖的源图像范围，由GDAL直接重采样到目标窗口大小
+        if (dst_h, dst_w) == (height, width):
+            window, kwargs = (0, y0, width, y1 - y0), {}
+        else:
+            src_y0 = y0 * height / dst_h
+            src_y1 = min(float(height), y1 * height / dst_h)
+            window = (0, src_y0, width, src_y1 - src_y0)
+            kwargs = {'buf_xsize': dst_w, 'buf_ysize': y1 - y0, 'resample_alg': gdal.GRIORA_Bilinear}
+        # 读取前三个波段（RGB），单波段时复制到三个通道
+        bands = [dataset.GetRasterBand(i + 1).ReadAsArray(*window, **kwargs).astype(np.uint8)
+                 for i in range(min(band_count, 3))]
+        while len(bands) < 3:
+            bands.append(bands[0])
+        return np.dstack(bands[:3])
+    
+    return height, width, read_resampled, dataset
+
+def _open_class_map_source(class_map):
+    """
+    打开类别图数据源
+    
+    Args:
+        class_map (numpy.ndarray or str or Path): 类别图数组，或单波段栅格文件路径
+        
+    Returns:
+        tuple: (高度, 宽度, 按行读取函数, GDAL数据集或None)
+    """
+    if isinstance(class_map, np.ndarray):
+        def read_rows(y0, y1):
+            return class_map[y0:y1]
+        return class_map.shape[0], class_map.shape[1], read_rows, None
+    
+    dataset = gdal.Open(str(class_map), gdal.GA_ReadOnly)
+    if dataset is None:
+        raise IOError(f"无法打开类别图文件: {class_map}")
+    band = dataset.GetRasterBand(1)
+    width = dataset.RasterXSize
+    
+    def read_rows(y0, y1):
+        return band.ReadAsArray(0, y0, width, y1 - y0)
+    
+    return dataset.RasterYSize, width, read_rows, dataset
+
+def _resample_step(scale):
+    """
+    计算子窗口的目标像素数，使对应的源图像范围和映射表都不超过 RESAMPLE_WINDOW_SIZE
+    """
+    return max(1, min(RESAMPLE_WINDOW_SIZE, int(RESAMPLE_WINDOW_SIZE / max(scale, 1.0)) - 2))
+
+def _remap_rows(image, dst_h, dst_w, y0, y1):
+    """
+    将内存图像中与目标窗口对应的部分双线性重采样到目标大小
+    
+    坐标映射与 cv2.resize 的双线性插值一致，逐窗口重采样的结果拼接后不会出现接缝。
+    窗口再按行列切分为子窗口，每次 cv2.remap 的输入不超过 RESAMPLE_WINDOW_SIZE
+    
+    Args:
+        image (numpy.ndarray): 源图像
+        dst_h (int): 目标高度
+        dst_w (int): 目标宽度
+        y0 (int): 目标窗口起始行
+        y1 (int): 目标窗口结束行（不含）
+        
+    Returns:
+        numpy.ndarray: 重采样后的窗口图像，形状为 (y1 - y0, dst_w, C)
+    """
+    src_h, src_w = image.shape[:2]
+    if (src_h, src_w) == (dst_h, dst_w):
+        return image[y0:y1]
+    
+    scale_y = src_h / dst_h
+    scale_x = src_w / dst_w
+    map_y = (np.arange(y0, y1, dtype=np.float32) + 0.5) * scale_y - 0.5
+    map_x = (np.arange(dst_w, dtype=np.float32) + 0.5) * scale_x - 0.5
+    step_y, step_x = _resample_step(scale_y), _resample_step(scale_x)
+    
+    window = np.empty((y1 - y0, dst_w) + image.shape[2:], dtype=image.dtype)
+    for r0 in range(0, y1 - y0, step_y):
+        sub_y = map_y[r0:r0 + step_y]
+        # 只取子窗口插值需要的源图像范围
+        src_y0 = max(0, int(np.floor(sub_y[0])))
+        src_y1 = min(src_h, int(np.floor(sub_y[-1])) + 2)
+        for c0 in range(0, dst_w, step_x):
+            sub_x = map_x[c0:c0 + step_x]
+            src_x0 = max(0, int(np.floor(sub_x[0])))
+            src_x1 = min(src_w, int(np.floor(sub_x[-1])) + 2)
+            grid_x, grid_y = np.meshgrid(sub_x - src_x0, sub_y - src_y0)
+            window[r0:r0 + len(sub_y), c0:c0 + len(sub_x)] = cv2.remap(
+                image[src_y0:src_y1, src_x0:src_x1], grid_x, grid_y,
+                interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return window
+
+def _render_segmentation_windows(image, class_map, alpha, window_rows):
+    """
+    逐窗口生成分割可视化结果
+    
+    Args:
+        image (numpy.ndarray or str or Path): 原始图像或栅格文件路径
+        class_map (numpy.ndarray or str or Path): 类别图或栅格文件路径
+        alpha (float): 透明度，范围 [0, 1]
+        window_rows (int): 每个窗口的行数
+        
+    Yields:
+        tuple: (窗口起始行, 窗口可视化图像)
+    """
+    h, w, read_class_rows, class_ds = _open_class_map_source(class_map)
+    _, _, read_image_window, image_ds = _open_raster_source(image)
+    
+    for y0 in range(0, h, window_rows):
+        y1 = min(y0 + window_rows, h)
+        color_window = colorize_class_map(read_class_rows(y0, y1))
+        image_window = read_image_window(h, w, y0, y1)
+        yield y0, cv2.addWeighted(image_window, 1 - alpha, color_window, alpha, 0)
+
+def create_segmentation_visualization(image, class_map, save_path=None, alpha=0.5, window_rows=RENDER_WINDOW_ROWS,
+                                      async_save=False, callback=None):
     """
     创建分割结果可视化图像
     
+    着色使用查找表一次索引完成，混合按窗口进行，临时数组大小与窗口成正比。
+    栅格过大、不需要返回图像时使用 render_segmentation_to_file。
+    
     Args:
         image (numpy.ndarray): 原始图像
         class_map (numpy.ndarray): 类别图，形状为 (H, W)，值为类别ID
         save_path (str or Path, optional): 保存路径，如果为None则不保存
         alpha (float): 透明度，范围 [0, 1]
+        window_rows (int): 每个渲染窗口的行数
+        async_save (bool): 是否在后台写入队列中保存，不阻塞调用方
+        callback (callable, optional): 后台保存完成回调，参数为 (保存路径, 异常)
         
     Returns:
         numpy.ndarray: 可视化图像
     """
     try:
-        # 创建彩色类别图
         h, w = class_map.shape
-        color_map = np.zeros((h, w, 3), dtype=np.uint8)
-        
-        # 为每个类别填充颜色
-        for class_id, color in CLASS_COLORS.items():
-            mask = (class_map == class_id)
-            color_map[mask] = color
+        vis_image = np.empty((h, w, 3), dtype=np.uint8)
         
-        # 调整原始图像大小以匹配类别图
-        if image.shape[:2] != (h, w):
-            image = resize_image(image, (w, h))
-        
-        # 混合图像
-        vis_image = cv2.addWeighted(image, 1 - alpha, color_map, alpha, 0)
+        for y0, window in _render_segmentation_windows(image, class_map, alpha, window_rows):
+            vis_image[y0:y0 + window.shape[0]] = window
         
         # 保存图像
         if save_path is not None:
-            save_image(vis_image, save_path)
+            if async_save:
+                save_image_async(vis_image, save_path, callback=callback)
+            else:
+                save_image(vis_image, save_path)
         
         return vis_image
         
@@ -262,51 +472,145 @@ def create_segmentation_visualization(image, class_map, save_path=None, alpha=0.
         logger.error(f"创建分割可视化失败: {str(e)}")
         raise
 
-def create_class_distribution_chart(class_distribution, save_path=None):
+def render_segmentation_to_file(image, class_map, save_path, alpha=0.5, window_rows=RENDER_WINDOW_ROWS):
     """
-    创建类别分布图表
+    将分割结果可视化逐窗口写入文件
+    
+    适用于大幅影像：原始图像和类别图都可以是栅格文件路径，按窗口读取、着色、混合后直接写入输出文件，
+    峰值内存只与窗口大小有关。TIFF输出为分块压缩的GeoTIFF（源为栅格文件时保留地理参考），
+    其他格式先写入临时GeoTIFF，再由GDAL逐行转换。
     
     Args:
-        class_distribution (dict): 类别分布，键为类别名称，值为百分比
-        save_path (str or Path, optional): 保存路径，如果为None则不保存
+        image (numpy.ndarray or str or Path): 原始图像或栅格文件路径
+        class_map (numpy.ndarray or str or Path): 类别图或单波段栅格文件路径
+        save_path (str or Path): 保存路径
+        alpha (float): 透明度，范围 [0, 1]
+        window_rows (int): 每个渲染窗口的行数
         
     Returns:
-        matplotlib.figure.Figure: 图表对象
+        Path: 输出文件路径
     """
     try:
-        # 创建图表
-        fig, ax = plt.subplots(figsize=(10, 6))
-        
-        # 准备数据
-        classes = list(class_distribution.keys())
-        percentages = list(class_distribution.values())
-        
-        # 创建柱状图
-        bars = ax.bar(classes, percentages, color='skyblue')
+        save_path = Path(save_path)
+        os.makedirs(save_path.parent, exist_ok=True)
         
-        # 添加数据标签
-        for bar in bars:
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height + 1,
-                    f'{height:.1f}%', ha='center', va='bottom')
+        h, w, _, class_ds = _open_class_map_source(class_map)
+        is_tiff = save_path.suffix.lower() in ['.tif', '.tiff']
+        tiff_path = save_path if is_tiff else save_path.with_name(save_path.name + '.tmp.tif')
+        
+        driver = gdal.GetDriverByName('GTiff')
+        out_ds = driver.Create(str(tiff_path), w, h, 3, gdal.GDT_Byte,
+                               options=['TILED=YES', 'COMPRESS=DEFLATE', 'PHOTOMETRIC=RGB', 'BIGTIFF=IF_SAFER'])
+        if out_ds is None:
+            raise IOError(f"无法创建输出文件: {tiff_path}")
+        
+        # 保留地理参考信息
+        if class_ds is not None:
+            out_ds.SetGeoTransform(class_ds.GetGeoTransform())
+            out_ds.SetProjection(class_ds.GetProjection())
+        elif not isinstance(image, np.ndarray):
+            src_ds = gdal.Open(str(image), gdal.GA_ReadOnly)
+            if src_ds is not None and (src_ds.RasterYSize, src_ds.RasterXSize) == (h, w):
+                out_ds.SetGeoTransform(src_ds.GetGeoTransform())
+                out_ds.SetProjection(src_ds.GetProjection())
+            src_ds = None
+        
+        for y0, window in _render_segmentation_windows(image, class_map, alpha, window_rows):
+            for i in range(3):
+                out_ds.GetRasterBand(i + 1).WriteArray(window[:, :, i], 0, y0)
+        out_ds.FlushCache()
+        
+        if not is_tiff:
+            # 由GDAL逐行转换为目标格式
+            format_drivers = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+            driver_name = format_drivers.get(save_path.suffix.lower())
+            if driver_name is None:
+                raise ValueError(f"不支持的输出格式: {save_path.suffix}")
+            gdal.GetDriverByName(driver_name).CreateCopy(str(save_path), out_ds)
+            out_ds = None
+            gdal.GetDriverByName('GTiff').Delete(str(tiff_path))
+        out_ds = None
+        
+        return save_path
         
-        # 设置标题和标签
-        ax.set_title('类别分布', fontsize=16)
-        ax.set_xlabel('类别', fontsize=12)
-        ax.set_ylabel('百分比 (%)', fontsize=12)
+    except Exception as e:
+        logger.error(f"渲染分割可视化文件失败: {str(e)}")
+        raise
+
+def save_class_map(class_grid, save_path, cell_size, source_size, source_path=None):
+    """
+    将分块预测结果保存为类别图GeoTIFF
+    
+    类别图的每个单元对应原始影像中 cell_size × cell_size 像素的分割块，
+    最后一行/列的单元延伸到影像边缘。单元大小和原始影像尺寸写入元数据，供瓦片服务换算坐标。
+    
+    Args:
+        class_grid (numpy.ndarray): 分块类别图，形状为 (行块数, 列块数)，uint8类型
+        save_path (str or Path): 保存路径
+        cell_size (int): 每个单元对应的原始影像像素数
+        source_size (tuple): 原始影像大小 (宽度, 高度)
+        source_path (str or Path, optional): 原始影像路径，为GeoTIFF时继承其地理参考
         
-        # 设置Y轴范围
-        ax.set_ylim(0, max(percentages) * 1.2)
+    Returns:
+        Path: 保存路径
+    """
+    try:
+        save_path = Path(save_path)
+        os.makedirs(save_path.parent, exist_ok=True)
+        rows, cols = class_grid.shape
+        
+        driver = gdal.GetDriverByName('GTiff')
+        ds = driver.Create(str(save_path), cols, rows, 1, gdal.GDT_Byte, options=['COMPRESS=DEFLATE'])
+        if ds is None:
+            raise IOError(f"无法创建类别图文件: {save_path}")
+        
+        band = ds.GetRasterBand(1)
+        band.WriteArray(class_grid)
+        band.SetNoDataValue(CLASS_MAP_NODATA)
+        ds.SetMetadata({
+            'CELL_SIZE': str(cell_size),
+            'SOURCE_WIDTH': str(source_size[0]),
+            'SOURCE_HEIGHT': str(source_size[1])
+        })
+        
+        # 继承原始影像的地理参考（单元按 cell_size 放大像元大小）
+        if source_path is not None and Path(source_path).suffix.lower() in ['.tif', '.tiff', '.img']:
+            src_ds = gdal.Open(str(source_path), gdal.GA_ReadOnly)
+            if src_ds is not None and src_ds.GetProjection():
+                gt = src_ds.GetGeoTransform()
+                ds.SetGeoTransform((gt[0], gt[1] * cell_size, gt[2] * cell_size,
+                                    gt[3], gt[4] * cell_size, gt[5] * cell_size))
+                ds.SetProjection(src_ds.GetProjection())
+            src_ds = None
+        
+        ds.FlushCache()
+        ds = None
+        return save_path
         
-        # 旋转X轴标签
-        plt.xticks(rotation=45, ha='right')
+    except Exception as e:
+        logger.error(f"保存类别图失败: {str(e)}")
+        raise
+
+def create_class_distribution_chart(class_distribution, save_path=None):
+    """
+    创建类别分布图表
+    
+    在调用线程中同步渲染；请求处理中应使用 chart_utils.submit_chart 在渲染进程池中异步生成
+    
+    Args:
+        class_distribution (dict): 类别分布，键为类别名称，值为百分比
+        save_path (str or Path, optional): 保存路径，如果为None则不保存
         
-        # 调整布局
-        plt.tight_layout()
+    Returns:
+        matplotlib.figure.Figure: 图表对象
+    """
+    try:
+        # 创建图表（不经过pyplot，不会在全局状态中累积图表对象）
+        fig = draw_class_distribution_chart(class_distribution)
         
         # 保存图表
         if save_path is not None:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight')
+            fig.savefig(save_path, dpi=300, bbox_inches='tight')
         
         return fig
         
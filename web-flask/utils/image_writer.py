@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+结果影像写入模块
+
+提供结果影像的编码、原子写入以及后台写入队列，并统计各格式的编码耗时和文件大小
+"""
+
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from osgeo import gdal
+
+logger = logging.getLogger(__name__)
+
+# 后台写入线程数
+WRITER_WORKERS = 2
+
+# 队列中允许等待的最大写入任务数，超出时提交方阻塞
+WRITER_MAX_PENDING = 8
+
+# 各格式的默认编码选项
+DEFAULT_WRITE_OPTIONS = {
+    'png': {'compression': 3},
+    'webp': {'lossless': True, 'quality': 90},
+    'jpg': {'quality': 95},
+    'tiff': {'compress': 'DEFLATE', 'zlevel': 6, 'tiled': True}
+}
+
+# 文件扩展名到格式的映射
+FORMAT_ALIASES = {
+    'png': 'png',
+    'webp': 'webp',
+    'jpg': 'jpg',
+    'jpeg': 'jpg',
+    'tif': 'tiff',
+    'tiff': 'tiff'
+}
+
+def _to_bgr(image):
+    """
+    将RGB图像转换为OpenCV使用的BGR顺序
+
+    Args:
+        image (numpy.ndarray): 图像数据，形状为 (H, W, C) 或 (H, W)
+
+    Returns:
+        numpy.ndarray: BGR图像
+    """
+    if len(image.shape) == 3 and image.shape[2] == 3:
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    if len(image.shape) == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA)
+    return image
+
+def _encode_with_opencv(image, fmt, options):
+    """
+    使用OpenCV将图像编码为字节
+
+    Args:
+        image (numpy.ndarray): RGB图像
+        fmt (str): 格式（'png'、'webp'或'jpg'）
+        options (dict): 编码选项
+
+    Returns:
+        bytes: 编码后的数据
+    """
+    if fmt == 'png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(options['compression'])]
+    elif fmt == 'webp':
+        # 质量大于100时OpenCV使用无损WebP
+        quality = 101 if options.get('lossless') else int(options['quality'])
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(options['quality'])]
+
+    ok, buffer = cv2.imencode(f'.{fmt}', _to_bgr(image), params)
+    if not ok:
+        raise IOError(f"图像编码失败: {fmt}")
+    return buffer.tobytes()
+
+def _write_geotiff(image, path, options):
+    """
+    使用GDAL写入分块压缩的GeoTIFF
+
+    Args:
+        image (numpy.ndarray): 图像数据，形状为 (H, W, C) 或 (H, W)
+        path (str or Path): 输出路径
+        options (dict): 编码选项
+    """
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    h, w, bands = image.shape
+    gdal_types = {
+        np.dtype(np.uint8): gdal.GDT_Byte,
+        np.dtype(np.uint16): gdal.GDT_UInt16,
+        np.dtype(np.int16): gdal.GDT_Int16,
+        np.dtype(np.float32): gdal.GDT_Float32
+    }
+    data_type = gdal_types.get(image.dtype)
+    if data_type is None:
+        raise ValueError(f"不支持的GeoTIFF数据类型: {image.dtype}")
+
+    creation_options = [f"COMPRESS={options['compress']}", 'BIGTIFF=IF_SAFER']
+    if options['compress'] == 'DEFLATE':
+        creation_options += [f"ZLEVEL={int(options['zlevel'])}", 'PREDICTOR=2']
+    if options.get('tiled'):
+        creation_options.append('TILED=YES')
+    if bands == 3:
+        creation_options.append('PHOTOMETRIC=RGB')
+
+    ds = gdal.GetDriverByName('GTiff').Create(str(path), w, h, bands, data_type, options=creation_options)
+    if ds is None:
+        raise IOError(f"无法创建GeoTIFF文件: {path}")
+    for i in range(bands):
+        ds.GetRasterBand(i + 1).WriteArray(image[:, :, i])
+    ds.FlushCache()
+    ds = None
+
+def resolve_format(save_path, format=None):
+    """
+    确定输出格式，未指定格式且路径没有扩展名时使用PNG
+
+    Args:
+        save_path (str or Path): 保存路径
+        format (str, optional): 图像格式
+
+    Returns:
+        tuple: (格式, 保存路径)
+    """
+    save_path = Path(save_path)
+    if format is None:
+        format = save_path.suffix.lower().lstrip('.')
+        if not format:
+            format = 'png'
+            save_path = save_path.with_suffix('.png')
+    fmt = FORMAT_ALIASES.get(format.lower())
+    if fmt is None:
+        raise ValueError(f"不支持的图像格式: {format}")
+    return fmt, save_path
+
+class WriteMetrics:
+    """
+    各格式的写入统计
+    """
+    def __init__(self):
+        """
+        初始化统计
+        """
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, fmt, encode_seconds, size, error=False):
+        """
+        记录一次写入
+
+        Args:
+            fmt (str): 格式
+            encode_seconds (float): 编码耗时（秒）
+            size (int): 文件大小（字节）
+            error (bool): 是否失败
+        """
+        with self._lock:
+            stats = self._stats.setdefault(fmt, {
+                'count': 0, 'errors': 0, 'encode_seconds': 0.0, 'bytes': 0
+            })
+            if error:
+                stats['errors'] += 1
+                return
+            stats['count'] += 1
+            stats['encode_seconds'] += encode_seconds
+            stats['bytes'] += size
+
+    def snapshot(self):
+        """
+        获取统计快照
+
+        Returns:
+            dict: 各格式的写入次数、失败次数、总/平均编码耗时和总/平均文件大小
+        """
+        with self._lock:
+            result = {}
+            for fmt, stats in self._stats.items():
+                count = stats['count']
+                result[fmt] = dict(stats)
+                result[fmt]['avg_encode_ms'] = stats['encode_seconds'] * 1000 / count if count else 0.0
+                result[fmt]['avg_bytes'] = stats['bytes'] / count if count else 0
+            return result
+
+# 进程内写入统计
+write_metrics = WriteMetrics()
+
+def write_image(image, save_path, format=None, options=None):
+    """
+    编码并原子写入图像
+
+    先写入同目录下的临时文件，完成后重命名为目标文件，读取方不会看到写了一半的文件
+
+    Args:
+        image (numpy.ndarray): 图像数据（RGB顺序），形状为 (H, W, C)
+        save_path (str or Path): 保存路径
+        format (str, optional): 图像格式（png、webp、jpg、tiff），为None时根据扩展名确定
+        options (dict, optional): 编码选项，覆盖 DEFAULT_WRITE_OPTIONS 中对应格式的默认值
+
+    Returns:
+        Path: 实际保存路径
+    """
+    fmt, save_path = resolve_format(save_path, format)
+    write_options = dict(DEFAULT_WRITE_OPTIONS[fmt])
+    if options:
+        write_options.update(options)
+
+    os.makedirs(save_path.parent, exist_ok=True)
+    tmp_path = save_path.with_name(f".{save_path.name}.{threading.get_ident()}.tmp")
+    try:
+        start = time.perf_counter()
+        if fmt == 'tiff':
+            _write_geotiff(image, tmp_path, write_options)
+        else:
+            data = _encode_with_opencv(image, fmt, write_options)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        encode_seconds = time.perf_counter() - start
+
+        os.replace(tmp_path, save_path)
+        write_metrics.record(fmt, encode_seconds, os.path.getsize(save_path))
+        return save_path
+    except Exception:
+        write_metrics.record(fmt, 0.0, 0, error=True)
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        raise
+
+class ResultImageWriter:
+    """
+    结果影像后台写入队列
+
+    写入在有界线程池中执行，等待中的任务数达到上限时提交方阻塞，避免待写图像占满内存
+    """
+    def __init__(self, max_workers=WRITER_WORKERS, max_pending=WRITER_MAX_PENDING):
+        """
+        初始化写入队列
+
+        Args:
+            max_workers (int): 写入线程数
+            max_pending (int): 允许排队（含正在写入）的最大任务数
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='result-writer')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, image, save_path, format=None, options=None, callback=None):
+        """
+        提交写入任务
+
+        调用方之后仍可修改的数组会先复制一份再排队
+
+        Args:
+            image (numpy.ndarray): 图像数据（RGB顺序）
+            save_path (str or Path): 保存路径
+            format (str, optional): 图像格式，为None时根据扩展名确定
+            options (dict, optional): 编码选项
+            callback (callable, optional): 完成回调，参数为 (保存路径, 异常)，成功时异常为None
+
+        Returns:
+            concurrent.futures.Future: 结果为实际保存路径
+        """
+        if image.flags.writeable:
+            image = image.copy()
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(write_image, image, save_path, format, options)
+        except Exception:
+            self._slots.release()
+            raise
+
+        def on_done(f):
+            self._slots.release()
+            error = f.exception()
+            if error is not None:
+                logger.error(f"后台写入图像失败 {save_path}: {str(error)}")
+            if callback is not None:
+                try:
+                    callback(None if error else f.result(), error)
+                except Exception as e:
+                    logger.error(f"图像写入回调执行失败: {str(e)}")
+
+        future.add_done_callback(on_done)
+        return future
+
+    def metrics(self):
+        """
+        获取写入统计
+
+        Returns:
+            dict: 各格式的写入统计
+        """
+        return write_metrics.snapshot()
+
+# 进程内共享的后台写入队列
+result_writer = ResultImageWriter()
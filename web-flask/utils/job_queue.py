@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+"""
+训练任务队列模块
+
+训练请求先写入SQLite持久化队列并立即返回作业ID，由固定数量的训练槽位（后台线程）按优先级和提交顺序取出执行。
+多个服务进程共用同一个队列，各自的槽位从队列中抢占作业。运行中的作业记录所属进程并定期更新心跳，
+心跳超时的作业（所属进程已退出）重新入队，训练时从断点继续。
+
+运行中的作业可以暂停或取消：请求记录在队列中，训练循环读到取消请求后在批次之间停止，读到暂停请求后
+在当前epoch结束、保存断点后停止，随后释放槽位；暂停的作业恢复后重新入队，从暂停时保存的断点继续训练
+"""
+
+import os
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 队列数据库路径（作业参数不能放在文件服务公开的 file_store 目录下）
+JOB_DB_PATH = Path(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) / 'results' / 'train_jobs.db'
+
+# 旧版本的队列数据库路径，启动时迁移到 JOB_DB_PATH
+LEGACY_JOB_DB_PATH = Path(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))) / 'file_store/train_jobs.db'
+
+# 同时运行的训练任务数
+TRAINING_SLOTS = int(os.environ.get('TRAINING_SLOTS', 1))
+
+# 空闲槽位检查新作业的间隔（秒），其他进程提交的作业最迟在这个间隔后被取出
+POLL_INTERVAL = 5.0
+
+# 训练循环检查暂停/取消请求时读取队列数据库的最小间隔（秒）
+CONTROL_POLL_SECONDS = 2.0
+
+# 运行中作业的心跳间隔（秒）
+HEARTBEAT_INTERVAL = 10.0
+
+# 心跳超过该时间（秒）未更新的运行中作业视为所属进程已退出
+LEASE_TIMEOUT = 60.0
+
+# 作业状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_PAUSED = 'paused'
+JOB_CANCELLED = 'cancelled'
+
+# 作业控制操作
+ACTION_PAUSE = 'pause'
+ACTION_RESUME = 'resume'
+ACTION_CANCEL = 'cancel'
+
+# 作业状态对应的训练任务状态（见 update_task_status）
+TASK_STATUS = {
+    JOB_QUEUED: 0,
+    JOB_PAUSED: 4,
+    JOB_CANCELLED: 5
+}
+
+class TrainingJobQueue:
+    """
+    持久化训练任务队列
+
+    优先级数值大的作业先执行，优先级相同时先提交的先执行
+    """
+    def __init__(self, db_path=JOB_DB_PATH, slots=TRAINING_SLOTS):
+        """
+        初始化队列
+
+        Args:
+            db_path (Path): 队列数据库路径
+            slots (int): 训练槽位数
+        """
+        self.db_path = Path(db_path)
+        self.slots = max(1, slots)
+        self._cond = threading.Condition()
+        self._workers = []
+        self._stopped = False
+        self._stop_event = threading.Event()
+        self._initialized = False
+        self._app = None
+        self._runner = None
+        # 本进程运行中作业的暂停/取消请求，作业ID -> 操作
+        self._controls = {}
+
+    def _connect(self):
+        """
+        打开数据库连接，事务由调用方显式控制
+        """
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        """
+        创建作业表
+        """
+        if self._initialized:
+            return
+        os.makedirs(self.db_path.parent, exist_ok=True)
+        self._migrate_legacy_db()
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS train_job ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'task_id INTEGER, '
+                'priority INTEGER NOT NULL DEFAULT 0, '
+                'payload TEXT NOT NULL, '
+                'status TEXT NOT NULL, '
+                'error_message TEXT, '
+                'create_time REAL NOT NULL, '
+                'start_time REAL, '
+                'end_time REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_train_job_status ON train_job (status, priority, id)')
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(train_job)').fetchall()]
+            for name, column_type in (('control', 'TEXT'), ('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE train_job ADD COLUMN {name} {column_type}')
+        finally:
+            conn.close()
+        self._initialized = True
+
+    def _migrate_legacy_db(self):
+        """
+        把旧路径下的队列数据库（连同WAL文件）移动到当前路径
+        """
+        if self.db_path != JOB_DB_PATH or not LEGACY_JOB_DB_PATH.exists() or self.db_path.exists():
+            return
+        for suffix in ('-wal', '-shm', ''):
+            legacy_path = Path(f"{LEGACY_JOB_DB_PATH}{suffix}")
+            if legacy_path.exists():
+                shutil.move(str(legacy_path), f"{self.db_path}{suffix}")
+        logger.info(f"训练队列数据库已迁移到 {self.db_path}")
+
+    @staticmethod
+    def _to_dict(row):
+        """
+        把数据库行转换为字典
+        """
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    @staticmethod
+    def _owner():
+        """
+        当前进程的标识（主机名:进程号），在调用时获取，预加载后fork出的工作进程各自不同
+        """
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self, app, runner):
+        """
+        启动训练槽位线程和心跳线程，重复调用时直接返回
+
+        启动前把心跳已超时的运行中作业重新入队
+
+        Args:
+            app (Flask): Flask应用，作业在应用上下文中执行
+            runner (callable): 执行作业的函数，参数为作业参数字典和停止信号函数，失败或被暂停、取消时抛出异常
+        """
+        with self._cond:
+            if self._workers:
+                return
+            self._app = app
+            self._runner = runner
+            self._init_db()
+            self._recover()
+            for i in range(self.slots):
+                worker = threading.Thread(target=self._work, name=f"train-slot-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            heartbeat = threading.Thread(target=self._heartbeat, name='train-heartbeat', daemon=True)
+            heartbeat.start()
+            self._workers.append(heartbeat)
+        logger.info(f"训练队列已启动，槽位数: {self.slots}，进程: {self._owner()}")
+
+    def _recover(self):
+        """
+        把心跳已超时的运行中作业恢复为排队状态，已请求暂停或取消的作业直接转为对应状态
+
+        没有心跳记录的运行中作业来自升级前的队列，同样视为已超时
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                'SELECT id, task_id, owner, control FROM train_job WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)',
+                (JOB_RUNNING, time.time() - LEASE_TIMEOUT)
+            ).fetchall()
+            for row in rows:
+                status = self._stopped_status(row['control']) or JOB_QUEUED
+                conn.execute('UPDATE train_job SET status = ?, control = NULL, owner = NULL, heartbeat_at = NULL, start_time = NULL '
+                             'WHERE id = ?', (status, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        for row in rows:
+            status = self._stopped_status(row['control']) or JOB_QUEUED
+            logger.info(f"作业 {row['id']}（任务 {row['task_id']}）的进程 {row['owner']} 心跳超时，转为 {status}")
+            self._update_task(row['task_id'], status)
+        if rows:
+            with self._cond:
+                self._cond.notify_all()
+
+    def _heartbeat(self):
+        """
+        心跳线程：定期更新本进程运行中作业的心跳，并回收其他进程心跳超时的作业
+        """
+        while not self._stop_event.wait(HEARTBEAT_INTERVAL):
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute('UPDATE train_job SET heartbeat_at = ? WHERE status = ? AND owner = ?',
+                                 (time.time(), JOB_RUNNING, self._owner()))
+                finally:
+                    conn.close()
+                self._recover()
+            except Exception as e:
+                logger.error(f"更新训练作业心跳失败: {str(e)}")
+
+    @staticmethod
+    def _stopped_status(action):
+        """
+        暂停/取消操作对应的作业结束状态
+        """
+        return {ACTION_PAUSE: JOB_PAUSED, ACTION_CANCEL: JOB_CANCELLED}.get(action)
+
+    @staticmethod
+    def _update_task(task_id, status):
+        """
+        同步训练任务状态，取消时删除任务的断点
+        """
+        if not task_id:
+            return
+        from utils.db_utils import update_task_status
+        try:
+            if status == JOB_CANCELLED:
+                from algo.checkpoint import remove_checkpoints
+                remove_checkpoints(task_id)
+                update_task_status(task_id, TASK_STATUS[status], end_time=datetime.now())
+            else:
+                update_task_status(task_id, TASK_STATUS[status])
+        except Exception as e:
+            logger.warning(f"更新任务 {task_id} 状态失败: {str(e)}")
+
+    def submit(self, payload, task_id=None, priority=0):
+        """
+        提交训练作业
+
+        Args:
+            payload (dict): 训练参数
+            task_id (int, optional): 训练任务ID
+            priority (int): 优先级，数值大的先执行
+
+        Returns:
+            int: 作业ID
+        """
+        try:
+            self._init_db()
+            conn = self._connect()
+            try:
+                cursor = conn.execute(
+                    'INSERT INTO train_job (task_id, priority, payload, status, create_time) VALUES (?, ?, ?, ?, ?)',
+                    (task_id, int(priority), json.dumps(payload), JOB_QUEUED, time.time())
+                )
+                job_id = cursor.lastrowid
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"提交训练作业失败: {str(e)}")
+            raise
+
+        if task_id:
+            from utils.db_utils import update_task_status
+            update_task_status(task_id, 0)
+        logger.info(f"训练作业 {job_id}（任务 {task_id}）已入队，优先级: {priority}")
+        with self._cond:
+            self._cond.notify()
+        return job_id
+
+    def _claim(self):
+        """
+        取出下一个排队中的作业并标记为运行中
+
+        Returns:
+            dict: 作业，没有排队中的作业时返回None
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT * FROM train_job WHERE status = ? ORDER BY priority DESC, id LIMIT 1', (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            now = time.time()
+            conn.execute('UPDATE train_job SET status = ?, owner = ?, heartbeat_at = ?, start_time = ? WHERE id = ?',
+                         (JOB_RUNNING, self._owner(), now, now, row['id']))
+            conn.execute('COMMIT')
+            return self._to_dict(row)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id, status, error_message=None):
+        """
+        记录作业结束状态，作业已因心跳超时被其他进程接管时不覆盖
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                'UPDATE train_job SET status = ?, control = NULL, heartbeat_at = NULL, error_message = ?, end_time = ? '
+                'WHERE id = ? AND status = ? AND owner = ?',
+                (status, error_message, time.time(), job_id, JOB_RUNNING, self._owner())
+            )
+            if cursor.rowcount == 0:
+                logger.warning(f"训练作业 {job_id} 已不属于本进程，不记录结束状态 {status}")
+        finally:
+            conn.close()
+
+    def _read_control(self, job_id):
+        """
+        读取队列数据库中记录的作业暂停/取消请求
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT control FROM train_job WHERE id = ?', (job_id,)).fetchone()
+            return row['control'] if row else None
+        finally:
+            conn.close()
+
+    def _stop_signal(self, job_id):
+        """
+        生成作业的停止信号函数（训练循环在每个批次之前调用）
+
+        优先读取本进程记录的请求；其他进程写入数据库的请求最多每隔 CONTROL_POLL_SECONDS 读取一次，
+        读到后记入本进程
+
+        Args:
+            job_id (int): 作业ID
+
+        Returns:
+            callable: 返回 ACTION_PAUSE、ACTION_CANCEL 或 None
+        """
+        last_poll = [0.0]
+
+        def check():
+            action = self._controls.get(job_id)
+            if action is None and time.monotonic() - last_poll[0] >= CONTROL_POLL_SECONDS:
+                last_poll[0] = time.monotonic()
+                try:
+                    action = self._read_control(job_id)
+                except Exception as e:
+                    logger.warning(f"读取作业 {job_id} 的控制请求失败: {str(e)}")
+                if action:
+                    self._controls[job_id] = action
+            return action
+        return check
+
+    def _work(self):
+        """
+        训练槽位线程：循环取出并执行作业
+        """
+        while not self._stopped:
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"读取训练队列失败: {str(e)}")
+                job = None
+            if job is None:
+                with self._cond:
+                    self._cond.wait(POLL_INTERVAL)
+                continue
+
+            job_id = job['id']
+            logger.info(f"开始执行训练作业 {job_id}（任务 {job['task_id']}）")
+            try:
+                with self._app.app_context():
+                    self._runner(job['payload'], self._stop_signal(job_id))
+                self._controls.pop(job_id, None)
+                self._finish(job_id, JOB_DONE)
+                logger.info(f"训练作业 {job_id} 完成")
+            except Exception as e:
+                status = self._stopped_status(self._controls.pop(job_id, None))
+                if status:
+                    logger.info(f"训练作业 {job_id} 已停止，状态: {status}")
+                else:
+                    status = JOB_FAILED
+                    logger.error(f"训练作业 {job_id} 失败: {str(e)}")
+                try:
+                    self._finish(job_id, status, None if status != JOB_FAILED else str(e))
+                except Exception as finish_error:
+                    logger.error(f"记录作业状态失败: {str(finish_error)}")
+
+    def stop(self):
+        """
+        停止取出新作业，正在执行的作业不受影响
+        """
+        self._stopped = True
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def control(self, task_id, action):
+        """
+        暂停、恢复或取消训练任务的最新作业
+
+        排队中的作业立即转为暂停或取消；运行中的作业只记录请求，执行该作业的进程（可能是其他服务进程）
+        在训练循环中读到请求后停止：暂停在当前epoch结束并保存断点后生效，取消在批次之间生效并删除断点和临时数据集；
+        暂停的作业恢复后重新入队
+
+        Args:
+            task_id (int): 训练任务ID
+            action (str): 操作，ACTION_PAUSE、ACTION_RESUME 或 ACTION_CANCEL
+
+        Returns:
+            dict: 作业信息，作业不存在时返回None；当前状态不支持该操作时作业状态不变
+        """
+        self._init_db()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT id, status, owner FROM train_job WHERE task_id = ? ORDER BY id DESC LIMIT 1',
+                               (task_id,)).fetchone()
+            new_status = None
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            if action == ACTION_RESUME and row['status'] == JOB_PAUSED:
+                new_status = JOB_QUEUED
+            elif action in (ACTION_PAUSE, ACTION_CANCEL) and row['status'] == JOB_QUEUED:
+                new_status = self._stopped_status(action)
+            elif action == ACTION_CANCEL and row['status'] == JOB_PAUSED:
+                new_status = JOB_CANCELLED
+            elif action in (ACTION_PAUSE, ACTION_CANCEL) and row['status'] == JOB_RUNNING:
+                conn.execute('UPDATE train_job SET control = ? WHERE id = ?', (action, row['id']))
+                if row['owner'] == self._owner():
+                    self._controls[row['id']] = action
+                logger.info(f"已请求{'暂停' if action == ACTION_PAUSE else '取消'}运行中的作业 {row['id']}（任务 {task_id}）")
+            if new_status:
+                conn.execute('UPDATE train_job SET status = ?, control = NULL WHERE id = ?', (new_status, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        if new_status:
+            logger.info(f"作业 {row['id']}（任务 {task_id}）状态: {row['status']} -> {new_status}")
+            self._update_task(task_id, new_status)
+            if new_status == JOB_QUEUED:
+                with self._cond:
+                    self._cond.notify()
+        return self.get_job(row['id'])
+
+    def get_job(self, job_id):
+        """
+        获取作业信息
+
+        Args:
+            job_id (int): 作业ID
+
+        Returns:
+            dict: 作业信息，包含排队位置（从1开始，非排队状态为None），作业不存在时返回None
+        """
+        self._init_db()
+        conn = self._connect()
+        try:
+            job = self._to_dict(conn.execute('SELECT * FROM train_job WHERE id = ?', (job_id,)).fetchone())
+            if job is None:
+                return None
+            job['position'] = None
+            if job['status'] == JOB_QUEUED:
+                job['position'] = conn.execute(
+                    'SELECT COUNT(*) FROM train_job WHERE status = ? AND (priority > ? OR (priority = ? AND id <= ?))',
+                    (JOB_QUEUED, job['priority'], job['priority'], job_id)
+                ).fetchone()[0]
+            return job
+        finally:
+            conn.close()
+
+    def list_jobs(self, status=None, limit=100):
+        """
+        列出作业，按执行顺序排列
+
+        Args:
+            status (str, optional): 只列出指定状态的作业
+            limit (int): 最多返回的作业数
+
+        Returns:
+            list: 作业列表
+        """
+        self._init_db()
+        conn = self._connect()
+        try:
+            if status:
+                rows = conn.execute('SELECT * FROM train_job WHERE status = ? ORDER BY priority DESC, id LIMIT ?',
+                                    (status, limit)).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM train_job ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+            return [self._to_dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def metrics(self):
+        """
+        获取队列统计
+
+        Returns:
+            dict: 槽位数以及各状态的作业数
+        """
+        self._init_db()
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM train_job GROUP BY status').fetchall())
+        finally:
+            conn.close()
+        return {'slots': self.slots, 'jobs': counts}
+
+# 进程内共享的训练队列
+training_queue = TrainingJobQueue()
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+地图瓦片工具模块
+
+按需渲染原始影像和分割类别图的 256×256 XYZ 瓦片，并提供有界瓦片缓存
+"""
+
+import os
+import math
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from osgeo import gdal
+from utils.image_utils import CLASS_PALETTE, CLASS_MAP_NODATA, colorize_class_map
+
+logger = logging.getLogger(__name__)
+
+# 瓦片大小（像素）
+TILE_SIZE = 256
+
+# 瓦片缓存默认字节预算
+DEFAULT_TILE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# 原始影像超过该尺寸且没有概览时自动构建概览
+OVERVIEW_MIN_SIZE = 2048
+
+# 概览缓存目录，概览建立在指向原始影像的VRT上，不在原始影像旁写入文件
+OVERVIEW_CACHE_DIR = Path(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) / 'results' / 'overviews'
+
+# 概览缓存总大小上限，超出后按最近使用时间淘汰
+OVERVIEW_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+# 刷新概览最近使用时间的最小间隔（秒），避免每个瓦片都写文件时间
+OVERVIEW_TOUCH_INTERVAL = 60
+
+# 各影像（按概览缓存键）的概览状态：'pending' 构建中，VRT路径 构建完成，None 不需要或构建失败
+_overview_state = {}
+_overview_touched = {}
+_overview_lock = threading.Lock()
+
+# 各影像波段的最小/最大值缓存，键为 (概览缓存键, 波段号)
+MINMAX_CACHE_SIZE = 1024
+_minmax_cache = OrderedDict()
+_minmax_lock = threading.Lock()
+
+# 概览在后台单线程构建，构建期间瓦片直接从原始影像读取
+_overview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='overview-builder')
+
+class TileCache:
+    """
+    瓦片LRU缓存
+
+    缓存编码后的瓦片字节，按字节预算淘汰最近最少使用的瓦片
+    """
+    def __init__(self, max_bytes=DEFAULT_TILE_CACHE_MAX_BYTES):
+        """
+        初始化缓存
+
+        Args:
+            max_bytes (int): 缓存字节预算
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        """
+        查询缓存
+
+        Args:
+            etag (str): 瓦片ETag
+
+        Returns:
+            bytes: 瓦片内容，未命中时返回None
+        """
+        with self._lock:
+            data = self._entries.get(etag)
+            if data is not None:
+                self._entries.move_to_end(etag)
+            return data
+
+    def put(self, etag, data):
+        """
+        写入缓存
+
+        Args:
+            etag (str): 瓦片ETag
+            data (bytes): 瓦片内容
+        """
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(etag, None)
+            if old is not None:
+                self._current_bytes -= len(old)
+            self._entries[etag] = data
+            self._current_bytes += len(data)
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= len(evicted)
+
+# 进程内共享的瓦片缓存
+tile_cache = TileCache()
+
+def get_max_zoom(width, height):
+    """
+    计算影像的最大缩放级别
+
+    最大级别时瓦片像素与原始影像像素一一对应，级别0时整幅影像落在一个瓦片内
+
+    Args:
+        width (int): 影像宽度
+        height (int): 影像高度
+
+    Returns:
+        int: 最大缩放级别
+    """
+    return max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE)))
+
+def make_tile_etag(layer, raster_path, z, x, y):
+    """
+    生成瓦片ETag
+
+    由图层、文件路径、文件修改时间和大小以及瓦片坐标计算，文件变化后ETag随之变化，无需渲染即可比较。
+    原始影像图层还包含概览是否已构建，概览构建完成后此前从原始影像读取的瓦片随之刷新
+
+    Args:
+        layer (str): 图层名称
+        raster_path (str or Path): 栅格文件路径
+        z (int): 缩放级别
+        x (int): 瓦片列号
+        y (int): 瓦片行号
+
+    Returns:
+        str: ETag
+    """
+    stat = os.stat(raster_path)
+    overview = ''
+    if layer == 'source':
+        overview = 'ovr' if ensure_overviews(raster_path) != str(raster_path) else 'raw'
+    key = f"{layer}|{os.path.abspath(raster_path)}|{stat.st_mtime_ns}|{stat.st_size}|{overview}|{z}/{x}/{y}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def _overview_key(raster_path):
+    """
+    计算概览缓存键，影像文件变化后缓存键随之变化
+    """
+    stat = os.stat(raster_path)
+    key = f"{os.path.abspath(raster_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def _touch_overview(key, vrt_path):
+    """
+    更新概览的最近使用时间，同一概览在 OVERVIEW_TOUCH_INTERVAL 内只更新一次
+    """
+    now = time.time()
+    if now - _overview_touched.get(key, 0) < OVERVIEW_TOUCH_INTERVAL:
+        return
+    _overview_touched[key] = now
+    try:
+        os.utime(vrt_path)
+    except OSError:
+        pass
+
+def prune_overview_cache(max_bytes=OVERVIEW_CACHE_MAX_BYTES, keep=None):
+    """
+    按最近使用时间淘汰概览，直到总大小不超过上限
+
+    其他进程中已打开的概览文件在删除后仍可继续读取，之后的请求发现概览不存在时会重新构建
+
+    Args:
+        max_bytes (int): 缓存总大小上限
+        keep (str, optional): 不淘汰的概览缓存键
+    """
+    if not OVERVIEW_CACHE_DIR.exists():
+        return
+    entries = []
+    for cache_dir in OVERVIEW_CACHE_DIR.iterdir():
+        # 跳过构建中的临时目录
+        if cache_dir.name.startswith('.') or not cache_dir.is_dir():
+            continue
+        try:
+            mtime = (cache_dir / 'source.vrt').stat().st_mtime
+            size = sum(f.stat().st_size for f in cache_dir.iterdir() if f.is_file())
+        except OSError:
+            continue
+        entries.append((mtime, cache_dir, size))
+
+    total = sum(size for _, _, size in entries)
+    for _, cache_dir, size in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        if cache_dir.name == keep:
+            continue
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        total -= size
+        logger.info(f"已淘汰影像概览: {cache_dir.name}")
+
+def _build_overviews(raster_path, key):
+    """
+    构建概览（在后台线程中执行）
+
+    先在临时目录中生成指向原始影像的VRT及其外部概览（.ovr），完成后整体重命名到缓存目录
+
+    Args:
+        raster_path (str): 栅格文件路径
+        key (str): 概览缓存键
+    """
+    result = None
+    try:
+        ds = gdal.Open(os.path.abspath(raster_path), gdal.GA_ReadOnly)
+        if ds is not None:
+            size = max(ds.RasterXSize, ds.RasterYSize)
+            if size > OVERVIEW_MIN_SIZE and ds.GetRasterBand(1).GetOverviewCount() == 0:
+                levels = []
+                factor = 2
+                while size / factor >= TILE_SIZE:
+                    levels.append(factor)
+                    factor *= 2
+                logger.info(f"构建影像概览: {raster_path}, 级别: {levels}")
+                os.makedirs(OVERVIEW_CACHE_DIR, exist_ok=True)
+                build_dir = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=OVERVIEW_CACHE_DIR))
+                try:
+                    vrt_ds = gdal.Translate(str(build_dir / 'source.vrt'), ds, format='VRT')
+                    vrt_ds.BuildOverviews('AVERAGE', levels)
+                    vrt_ds = None
+                    os.rename(build_dir, OVERVIEW_CACHE_DIR / key)
+                    prune_overview_cache(keep=key)
+                except OSError:
+                    # 其他进程已经生成了同一概览
+                    shutil.rmtree(build_dir, ignore_errors=True)
+                except BaseException:
+                    shutil.rmtree(build_dir, ignore_errors=True)
+                    raise
+                result = str(OVERVIEW_CACHE_DIR / key / 'source.vrt')
+            ds = None
+    except Exception as e:
+        logger.warning(f"构建影像概览失败: {str(e)}")
+    with _overview_lock:
+        _overview_state[key] = result
+
+def ensure_overviews(raster_path):
+    """
+    获取带概览金字塔的影像路径
+
+    大幅影像没有概览时在后台构建，不阻塞瓦片请求；构建完成前返回原始影像路径，
+    之后返回带概览的VRT路径，低缩放级别瓦片直接从概览读取
+
+    Args:
+        raster_path (str or Path): 栅格文件路径
+
+    Returns:
+        str: 用于读取瓦片的影像路径
+    """
+    raster_path = str(raster_path)
+    key = _overview_key(raster_path)
+    with _overview_lock:
+        state = _overview_state.get(key, 'missing')
+        if state == 'pending':
+            return raster_path
+        if state is None:
+            return raster_path
+        vrt_path = OVERVIEW_CACHE_DIR / key / 'source.vrt'
+        if vrt_path.exists():
+            # 包括已构建但可能被其他进程淘汰的概览，被淘汰时重新构建
+            _overview_state[key] = str(vrt_path)
+            _touch_overview(key, vrt_path)
+            return str(vrt_path)
+        _overview_state[key] = 'pending'
+    _overview_executor.submit(_build_overviews, raster_path, key)
+    return raster_path
+
+def _tile_window(z, x, y, max_zoom, width, height):
+    """
+    计算瓦片对应的影像窗口
+
+    Args:
+        z (int): 缩放级别
+        x (int): 瓦片列号
+        y (int): 瓦片行号
+        max_zoom (int): 最大缩放级别
+        width (int): 影像宽度（像素）
+        height (int): 影像高度（像素）
+
+    Returns:
+        tuple: (读取窗口 (xoff, yoff, xsize, ysize), 瓦片内目标区域 (ox, oy, ow, oh))，瓦片在影像之外时返回None
+    """
+    span = TILE_SIZE * 2.0 ** (max_zoom - z)
+    x0, y0 = x * span, y * span
+    cx0, cy0 = max(0.0, x0), max(0.0, y0)
+    cx1, cy1 = min(float(width), x0 + span), min(float(height), y0 + span)
+    if cx0 >= cx1 or cy0 >= cy1:
+        return None
+
+    xoff, yoff = int(math.floor(cx0)), int(math.floor(cy0))
+    xsize = max(1, int(math.ceil(cx1)) - xoff)
+    ysize = max(1, int(math.ceil(cy1)) - yoff)
+
+    ox = int(round((xoff - x0) / span * TILE_SIZE))
+    oy = int(round((yoff - y0) / span * TILE_SIZE))
+    ow = min(TILE_SIZE - ox, max(1, int(round(xsize / span * TILE_SIZE))))
+    oh = min(TILE_SIZE - oy, max(1, int(round(ysize / span * TILE_SIZE))))
+    return (xoff, yoff, xsize, ysize), (ox, oy, ow, oh)
+
+def _band_min_max(key, band_index, band):
+    """
+    获取波段的最小/最大值
+
+    每个影像波段只统计一次，同一影像的所有瓦片使用相同的拉伸范围
+
+    Args:
+        key (str): 影像的概览缓存键
+        band_index (int): 波段号
+        band (gdal.Band): 波段对象
+
+    Returns:
+        tuple: (最小值, 最大值)
+    """
+    cache_key = (key, band_index)
+    with _minmax_lock:
+        value = _minmax_cache.get(cache_key)
+        if value is not None:
+            _minmax_cache.move_to_end(cache_key)
+            return value
+    value = tuple(band.ComputeRasterMinMax(True))
+    with _minmax_lock:
+        _minmax_cache[cache_key] = value
+        while len(_minmax_cache) > MINMAX_CACHE_SIZE:
+            _minmax_cache.popitem(last=False)
+    return value
+
+def _to_uint8(data, vmin, vmax):
+    """
+    将非8位波段数据线性拉伸到0-255
+
+    Args:
+        data (numpy.ndarray): 波段数据
+        vmin (float): 拉伸范围最小值
+        vmax (float): 拉伸范围最大值
+
+    Returns:
+        numpy.ndarray: uint8数据
+    """
+    if data.dtype == np.uint8:
+        return data
+    if vmax <= vmin:
+        return np.zeros(data.shape, dtype=np.uint8)
+    scaled = (data.astype(np.float32) - vmin) * (255.0 / (vmax - vmin))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+def get_raster_info(layer, raster_path):
+    """
+    获取栅格的瓦片信息
+
+    Args:
+        layer (str): 图层名称（'source' 或 'classmap'）
+        raster_path (str or Path): 栅格文件路径
+
+    Returns:
+        dict: 影像宽高、最大缩放级别和瓦片大小
+    """
+    ds = gdal.Open(str(raster_path), gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"无法打开栅格文件: {raster_path}")
+    if layer == 'classmap':
+        width = int(ds.GetMetadataItem('SOURCE_WIDTH') or ds.RasterXSize)
+        height = int(ds.GetMetadataItem('SOURCE_HEIGHT') or ds.RasterYSize)
+    else:
+        width, height = ds.RasterXSize, ds.RasterYSize
+    return {
+        'width': width,
+        'height': height,
+        'max_zoom': get_max_zoom(width, height),
+        'tile_size': TILE_SIZE
+    }
+
+def render_source_tile(raster_path, z, x, y):
+    """
+    渲染原始影像瓦片
+
+    按瓦片窗口读取前三个波段并由GDAL缩放到瓦片分辨率，低缩放级别自动使用概览
+
+    Args:
+        raster_path (str or Path): 影像文件路径
+        z (int): 缩放级别
+        x (int): 瓦片列号
+        y (int): 瓦片行号
+
+    Returns:
+        numpy.ndarray: RGBA瓦片，形状为 (256, 256, 4)，影像之外的区域透明
+    """
+    key = _overview_key(raster_path)
+    ds = gdal.Open(ensure_overviews(raster_path), gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"无法打开影像文件: {raster_path}")
+
+    tile = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    width, height = ds.RasterXSize, ds.RasterYSize
+    window = _tile_window(z, x, y, get_max_zoom(width, height), width, height)
+    if window is None:
+        return tile
+
+    (xoff, yoff, xsize, ysize), (ox, oy, ow, oh) = window
+    band_count = ds.RasterCount
+    for i in range(3):
+        band_index = min(i, band_count - 1) + 1
+        band = ds.GetRasterBand(band_index)
+        data = band.ReadAsArray(xoff, yoff, xsize, ysize, buf_xsize=ow, buf_ysize=oh,
+                                resample_alg=gdal.GRIORA_Bilinear)
+        if data.dtype != np.uint8:
+            data = _to_uint8(data, *_band_min_max(key, band_index, band))
+        tile[oy:oy + oh, ox:ox + ow, i] = data
+    tile[oy:oy + oh, ox:ox + ow, 3] = 255
+    return tile
+
+def render_class_map_tile(class_map_path, z, x, y):
+    """
+    渲染分割类别图瓦片
+
+    类别图以分块为单元保存，按元数据中的单元大小换算到原始影像像素坐标，
+    最近邻取样后使用 CLASS_COLORS 查找表着色，无预测结果的区域透明
+
+    Args:
+        class_map_path (str or Path): 类别图文件路径
+        z (int): 缩放级别
+        x (int): 瓦片列号
+        y (int): 瓦片行号
+
+    Returns:
+        numpy.ndarray: RGBA瓦片，形状为 (256, 256, 4)
+    """
+    ds = gdal.Open(str(class_map_path), gdal.GA_ReadOnly)
+    if ds is None:
+        raise IOError(f"无法打开类别图文件: {class_map_path}")
+
+    tile = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    cell_size = int(ds.GetMetadataItem('CELL_SIZE') or 1)
+    width = int(ds.GetMetadataItem('SOURCE_WIDTH') or ds.RasterXSize * cell_size)
+    height = int(ds.GetMetadataItem('SOURCE_HEIGHT') or ds.RasterYSize * cell_size)
+    window = _tile_window(z, x, y, get_max_zoom(width, height), width, height)
+    if window is None:
+        return tile
+
+    (xoff, yoff, xsize, ysize), (ox, oy, ow, oh) = window
+    grid = ds.GetRasterBand(1).ReadAsArray()
+
+    # 目标像素中心对应的原始影像坐标 -> 类别图单元，最后一行/列单元延伸到影像边缘
+    src_x = xoff + (np.arange(ow) + 0.5) * (xsize / ow)
+    src_y = yoff + (np.arange(oh) + 0.5) * (ysize / oh)
+    cols = np.minimum((src_x // cell_size).astype(np.intp), grid.shape[1] - 1)
+    rows = np.minimum((src_y // cell_size).astype(np.intp), grid.shape[0] - 1)
+    classes = grid[np.ix_(rows, cols)]
+
+    tile[oy:oy + oh, ox:ox + ow, :3] = colorize_class_map(classes, CLASS_PALETTE)
+    tile[oy:oy + oh, ox:ox + ow, 3] = np.where(classes == CLASS_MAP_NODATA, 0, 255)
+    return tile
+
+def encode_tile(tile):
+    """
+    将RGBA瓦片编码为PNG
+
+    Args:
+        tile (numpy.ndarray): RGBA瓦片
+
+    Returns:
+        bytes: PNG数据
+    """
+    ok, buffer = cv2.imencode('.png', cv2.cvtColor(tile, cv2.COLOR_RGBA2BGRA))
+    if not ok:
+        raise IOError("瓦片PNG编码失败")
+    return buffer.tobytes()